@@ -1,9 +1,20 @@
+from django import forms
 from django.contrib import admin
 from django.contrib import messages
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
 
-from .models import Event, Contact, EventType, EventInstance, Registration, ParticipantProfile
+from .export import roster_response
+from .importer import ImportFailed, import_schedule, read_rows
+from .recurrence import generate_instances
+
+from .models import (
+    ArchivedEventInstance, ArchivedRegistration, Event, Contact, EventType, EventInstance, Registration,
+    ParticipantProfile, WaitlistEntry,
+)
 
 # Register your models here.
 #admin.site.register(Event)
@@ -19,7 +30,7 @@ class ParticipantProfileAdmin(admin.ModelAdmin):
     actions = ['approve_profiles']
 
     def approve_profiles(self, request, queryset):
-        updated = queryset.filter(approved=False).update(approved=True)
+        updated = ParticipantProfile.approve(User.objects.filter(profile__in=queryset))
         self.message_user(request, f"Approved {updated} user(s).", level=messages.SUCCESS)
     approve_profiles.short_description = 'Approve selected profiles'
 
@@ -49,8 +60,68 @@ class EventAdmin(admin.ModelAdmin):
         }),
         ('Capacity', {
             'fields': ('max_leaders', 'max_followers', 'max_participants')
-        })
+        }),
+        ('Recurrence', {
+            'fields': ('recurrence', ('recurrence_start', 'recurrence_end'), 'recurrence_exceptions')
+        }),
     )
+    actions = ['export_registrations', 'generate_recurring_instances']
+
+    def generate_recurring_instances(self, request, queryset):
+        created = generate_instances(queryset)
+        self.message_user(request, f"Created {created} instance(s).", level=messages.SUCCESS)
+    generate_recurring_instances.short_description = 'Create upcoming instances of selected recurring events'
+
+    def export_registrations(self, request, queryset):
+        return roster_response(Registration.objects.filter(event_instance__event__in=queryset), 'registrations.csv')
+    export_registrations.short_description = 'Export registrations of selected events as CSV'
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='events_event_import'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        """Upload a term's schedule, and optionally its registrations, as CSV or XLSX."""
+        if not self.has_add_permission(request):
+            return redirect('admin:events_event_changelist')
+        form = ScheduleImportForm(request.POST or None, request.FILES or None)
+        errors = []
+        if request.method == 'POST' and form.is_valid():
+            schedule = form.cleaned_data['schedule']
+            registrations = form.cleaned_data['registrations']
+            try:
+                counts = import_schedule(
+                    read_rows(schedule, schedule.name),
+                    read_rows(registrations, registrations.name) if registrations else (),
+                    dry_run=form.cleaned_data['dry_run'],
+                )
+            except ImportFailed as failure:
+                errors = failure.errors
+            else:
+                summary = (
+                    f'{counts["events"]} event(s), {counts["instances"]} instance(s) '
+                    f'and {counts["registrations"]} registration(s)'
+                )
+                if form.cleaned_data['dry_run']:
+                    self.message_user(request, f'The files are valid: {summary} would be imported.')
+                else:
+                    self.message_user(request, f'Imported {summary}.', level=messages.SUCCESS)
+                    return redirect('admin:events_event_changelist')
+        return TemplateResponse(request, 'admin/events/event/import_schedule.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import schedule',
+            'form': form,
+            'errors': errors,
+        })
+
+
+class ScheduleImportForm(forms.Form):
+    schedule = forms.FileField(help_text='CSV or XLSX: title, date, max_leaders, max_followers, max_participants, '
+                                         'and optionally summary, types (separated by ;), description, status.')
+    registrations = forms.FileField(required=False, help_text='CSV or XLSX: username, event, date, role (L, F or D).')
+    dry_run = forms.BooleanField(required=False, help_text='Only check the files.')
 
 # Register the Admin classes for EventInstance using the decorator
 class RegistrationInline(admin.TabularInline):
@@ -58,6 +129,12 @@ class RegistrationInline(admin.TabularInline):
     extra = 0
     fields = ('user', 'role')
 
+class WaitlistInline(admin.TabularInline):
+    model = WaitlistEntry
+    extra = 0
+    fields = ('user', 'role', 'joined')
+    readonly_fields = ('joined',)
+
 # Extend User admin to add an action to approve user profiles
 class CustomUserAdmin(UserAdmin):
     actions = ['approve_users']
@@ -74,14 +151,7 @@ class CustomUserAdmin(UserAdmin):
     approved_status.short_description = 'Approved'
 
     def approve_users(self, request, queryset):
-        from .models import ParticipantProfile
-        count = 0
-        for user in queryset:
-            profile, created = ParticipantProfile.objects.get_or_create(user=user)
-            if not profile.approved:
-                profile.approved = True
-                profile.save()
-                count += 1
+        count = ParticipantProfile.approve(queryset)
         self.message_user(request, f"Approved {count} user(s).", level=messages.SUCCESS)
     approve_users.short_description = 'Approve selected users'
 
@@ -92,7 +162,7 @@ admin.site.register(User, CustomUserAdmin)
 
 @admin.register(EventInstance)
 class EventInstanceAdmin(admin.ModelAdmin):
-    list_display = ('event', 'date', 'status')
+    list_display = ('event', 'date', 'status', 'num_leaders', 'num_followers', 'num_doubles', 'num_registered')
     list_filter = ('status', 'date')
     fieldsets = (
         (None, {
@@ -102,4 +172,35 @@ class EventInstanceAdmin(admin.ModelAdmin):
             'fields': ('status', 'id')
         }),
     )
-    inlines = [RegistrationInline]
+    inlines = [RegistrationInline, WaitlistInline]
+    actions = ['export_registrations']
+
+    def export_registrations(self, request, queryset):
+        return roster_response(Registration.objects.filter(event_instance__in=queryset), 'registrations.csv')
+    export_registrations.short_description = 'Export registrations of selected instances as CSV'
+
+
+class ArchivedRegistrationInline(admin.TabularInline):
+    model = ArchivedRegistration
+    extra = 0
+    fields = ('username', 'role')
+    readonly_fields = fields
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedEventInstance)
+class ArchivedEventInstanceAdmin(admin.ModelAdmin):
+    """Read-only history of archived instances."""
+    list_display = ('event_title', 'date', 'status', 'num_leaders', 'num_followers', 'num_doubles', 'num_registered')
+    list_filter = ('status', 'date')
+    search_fields = ('event_title',)
+    inlines = [ArchivedRegistrationInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
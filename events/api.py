@@ -0,0 +1,153 @@
+"""Read-only JSON API for the mobile app and the timetable kiosks.
+
+Responses carry compact field sets, and lists are paginated with opaque cursors
+(events.pagination). Every response has a strong ETag derived from the version stamps
+of the events and, where seat counts are shown, of their instances, which are bumped
+whenever an event, its instances or their seat counts change. A client revalidating
+with If-None-Match gets 304 Not Modified after one small query instead of the full set.
+"""
+from datetime import date
+
+from django.db.models import Case, Count, F, IntegerField, Max, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.http import condition, require_safe
+
+from .capacity import available_roles
+from .models import Event, EventInstance, Registration
+from .pagination import keyset_page
+
+API_PAGE_SIZE = 50
+
+
+def api_login_required(view):
+    """Answer anonymous requests with 401 instead of redirecting to the login page."""
+    def wrapped(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'detail': 'Authentication required.'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapped
+
+
+def page_links(request, page):
+    def link(cursor):
+        return None if cursor is None else request.build_absolute_uri(f'{request.path}?cursor={cursor}')
+    return {'next': link(page.next_cursor), 'previous': link(page.previous_cursor)}
+
+
+def event_data(event):
+    return {
+        'id': event.pk,
+        'title': event.title,
+        'types': [event_type.name for event_type in event.type.all()],
+        'max_leaders': event.max_leaders,
+        'max_followers': event.max_followers,
+        'max_participants': event.max_participants,
+        'url': reverse('api-event-detail', args=[event.pk]),
+    }
+
+
+def instance_data(instance):
+    return {
+        'id': instance.pk,
+        'date': instance.date,
+        'status': instance.status,
+        'leaders': instance.num_leaders,
+        'followers': instance.num_followers,
+        'doubles': instance.num_doubles,
+        'registered': instance.num_registered,
+        'available_roles': available_roles(instance),
+    }
+
+
+def events_etag(request):
+    # New, deleted and changed events all move at least one of these
+    stamp = Event.objects.aggregate(count=Count('pk'), last=Max('pk'), versions=Sum('version'))
+    return f'events-{stamp["count"]}-{stamp["last"]}-{stamp["versions"]}'
+
+
+def event_etag(request, pk):
+    stamp = (
+        Event.objects.filter(pk=pk)
+        .annotate(seats=Sum('eventinstance__version'))
+        .values_list('version', 'modified', 'seats')
+        .first()
+    )
+    if stamp is None:
+        return None
+    # A stale admin save can write back an old version; the modification time tells them apart.
+    # Instance versions only grow, and adding or removing an instance bumps the event's.
+    return f'event-{pk}-{stamp[0]}-{stamp[1].timestamp():.6f}-{stamp[2]}'
+
+
+def registrations_etag(request):
+    if not request.user.is_authenticated:
+        return None
+    profile = getattr(request.user, 'profile', None)
+    # Saving an event bumps its instances' versions too, and so does a role change, through
+    # the seat counters; the role digest, weighted by id, catches it all the same
+    role_weight = Case(
+        *(When(role=role, then=Value(weight)) for weight, role in enumerate(Registration.Role.values, 1)),
+        output_field=IntegerField(),
+    )
+    stamp = Registration.objects.filter(user=request.user).aggregate(
+        count=Count('pk'), last=Max('pk'), versions=Sum('event_instance__version'), roles=Sum(F('pk') * role_weight),
+    )
+    return (
+        f'registrations-{request.user.pk}-{bool(profile and profile.approved):d}'
+        f'-{stamp["count"]}-{stamp["last"]}-{stamp["versions"]}-{stamp["roles"]}'
+    )
+
+
+@require_safe
+@condition(etag_func=events_etag)
+def event_list(request):
+    """All events, by id."""
+    page = keyset_page(Event.objects.prefetch_related('type'), ('id',), request.GET.get('cursor', ''), API_PAGE_SIZE)
+    return JsonResponse({'results': [event_data(event) for event in page], **page_links(request, page)})
+
+
+@require_safe
+@condition(etag_func=event_etag)
+def event_detail(request, pk):
+    """One event with the seat counts of its scheduled instances."""
+    event = get_object_or_404(Event.objects.prefetch_related('type'), pk=pk)
+    instances = EventInstance.objects.filter(event=event, date__isnull=False).order_by('date')
+    data = event_data(event)
+    data.update(summary=event.summary, version=event.version, instances=[])
+    for instance in instances:
+        instance.event = event
+        data['instances'].append(instance_data(instance))
+    return JsonResponse(data)
+
+
+@require_safe
+@api_login_required
+@condition(etag_func=registrations_etag)
+def my_registrations(request):
+    """The current user's registrations to open instances, by date."""
+    profile = getattr(request.user, 'profile', None)
+    if not profile or not profile.approved:
+        return JsonResponse({'results': [], 'approval_pending': True, 'next': None, 'previous': None})
+    registrations = (
+        Registration.objects.select_related('event_instance__event')
+        .filter(user=request.user, event_instance__status__exact='n')
+        .annotate(instance_date=Coalesce('event_instance__date', Value(date.max)))
+    )
+    page = keyset_page(registrations, ('instance_date', 'id'), request.GET.get('cursor', ''), API_PAGE_SIZE)
+    results = [
+        {
+            'id': registration.pk,
+            'role': registration.role,
+            'instance': {
+                'id': registration.event_instance.pk,
+                'date': registration.event_instance.date,
+                'status': registration.event_instance.status,
+            },
+            'event': {'id': registration.event_instance.event.pk, 'title': registration.event_instance.event.title},
+        }
+        for registration in page
+    ]
+    return JsonResponse({'results': results, 'approval_pending': False, **page_links(request, page)})
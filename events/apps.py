@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class EventsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'events'
+
+    def ready(self):
+        # Connect the signal receivers that maintain denormalized counters
+        from . import signals  # noqa: F401
@@ -0,0 +1,105 @@
+"""Moving past event instances and their registrations into the archive tables.
+
+The live EventInstance and Registration tables are read by every page, so they
+should hold the current term rather than every class ever held. archive_past_instances
+copies instances dated before a cutoff into ArchivedEventInstance, with their
+registrations in ArchivedRegistration, and deletes the originals and any waitlist
+entries. The archive_past_instances management command runs it with a cutoff of
+settings.ARCHIVE_AFTER_DAYS ago; schedule it nightly.
+
+Instances are moved in batches, each in its own transaction, so a large backlog
+neither holds locks for long nor loads everything at once. Undated instances stay.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from .importer import chunked
+from .models import ArchivedEventInstance, ArchivedRegistration, Event, EventInstance, Registration, WaitlistEntry
+from .stats import invalidate_home_statistics
+
+ARCHIVE_BATCH_SIZE = 500
+INSERT_BATCH_SIZE = 1000
+# The rows deleted with each archived instance, in order: (model, field pointing to the instance)
+ARCHIVE_DELETES = ((Registration, 'event_instance'), (WaitlistEntry, 'event_instance'), (EventInstance, 'id'))
+
+
+def unhandled_relations():
+    """Relations to the deleted models that ARCHIVE_DELETES leaves out, as 'app.Model.field' labels.
+
+    The deletes skip the ORM's cascade collection, so a new foreign key to one of these
+    models would leave its rows dangling or fail the delete; archive_past_instances
+    refuses to run instead.
+    """
+    deleted = set(ARCHIVE_DELETES)
+    return [
+        f'{relation.related_model._meta.label}.{relation.field.name}'
+        for model, field in ARCHIVE_DELETES
+        for relation in model._meta.related_objects
+        if (relation.related_model, relation.field.name) not in deleted
+    ]
+
+
+def delete_rows(model, field, values):
+    """Delete the rows of model whose field is one of values, without loading them.
+
+    The instances are gone for good, so there are no seat counters to keep in step and
+    no waitlists to promote: QuerySet.delete() would load every row and send signals
+    whose receivers update counters, offer seats and publish counts for rows that are
+    about to disappear. The version stamps and statistics are expired on commit instead.
+    """
+    for chunk in chunked(values):
+        model.objects.filter(**{f'{field}__in': chunk})._raw_delete(model.objects.db)
+
+
+def archive_batch(before, batch_size):
+    """Archive up to batch_size instances dated before the cutoff; return the counts moved."""
+    instances = list(
+        EventInstance.objects.filter(date__lt=before).select_related('event').order_by('date', 'pk')[:batch_size]
+    )
+    if not instances:
+        return 0, 0
+    ids = [instance.pk for instance in instances]
+    ArchivedEventInstance.objects.bulk_create(
+        [
+            ArchivedEventInstance(
+                id=instance.pk, event=instance.event,
+                event_title=instance.event.title if instance.event else '',
+                description=instance.description, date=instance.date, status=instance.status,
+                num_leaders=instance.num_leaders, num_followers=instance.num_followers,
+                num_doubles=instance.num_doubles, num_registered=instance.num_registered,
+            )
+            for instance in instances
+        ],
+        batch_size=INSERT_BATCH_SIZE,
+    )
+    registrations = ArchivedRegistration.objects.bulk_create(
+        [
+            ArchivedRegistration(user_id=user_id, username=username, event_instance_id=instance_id, role=role)
+            for user_id, username, instance_id, role in Registration.objects.filter(event_instance__in=ids)
+            .values_list('user_id', 'user__username', 'event_instance_id', 'role')
+        ],
+        batch_size=INSERT_BATCH_SIZE,
+    )
+
+    for model, field in ARCHIVE_DELETES:
+        delete_rows(model, field, ids)
+
+    event_ids = sorted({instance.event_id for instance in instances if instance.event_id})
+    transaction.on_commit(lambda: Event.touch(pk__in=event_ids))
+    transaction.on_commit(invalidate_home_statistics)
+    return len(instances), len(registrations)
+
+
+def archive_past_instances(before, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive every instance dated before the cutoff date; return the counts moved."""
+    unhandled = unhandled_relations()
+    if unhandled:
+        raise ImproperlyConfigured(f'Archiving would not delete the rows of {", ".join(unhandled)}')
+    moved = {'instances': 0, 'registrations': 0}
+    while True:
+        with transaction.atomic():
+            instances, registrations = archive_batch(before, batch_size)
+        if not instances:
+            return moved
+        moved['instances'] += instances
+        moved['registrations'] += registrations
@@ -0,0 +1,36 @@
+"""Running blocking database work from async views.
+
+Django's async ORM methods run each query on a thread of their own request. Work that
+has to happen in one transaction, such as reserving a seat, is handed to
+database_sync_to_async instead, which runs it on a fixed-size pool of database
+threads. Under a registration burst, requests wait for a free database thread rather
+than each tying up a thread of its own.
+
+The rest of a request's sync work (middleware, session and user loading, template
+rendering) stays on the thread Django's ASGIHandler gives each request; it holds no
+transaction open, so only the database pool bounds how many transactions run at once.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+executor = ThreadPoolExecutor(max_workers=settings.ASYNC_DB_WORKERS, thread_name_prefix='events-db')
+
+
+def database_sync_to_async(func):
+    """Wrap the blocking func as an awaitable that runs on the database thread pool.
+
+    The pool threads keep their connections between calls, so stale or broken ones are
+    closed before and after each call, as Django does at request boundaries.
+    """
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False, executor=executor)
+
@@ -0,0 +1,39 @@
+"""Authentication backend loading the user's ParticipantProfile together with the user.
+
+Most pages look at the logged-in user's profile (approval, role). Django's ModelBackend
+loads the user on every request and the profile then costs a second query; here both
+come from one joined query, and request.user keeps the profile for the rest of the
+request. With settings.AUTH_USER_CACHE_TIMEOUT set, the user and profile are also cached
+for that many seconds, so an authenticated request only reads its session. The cached
+copy is dropped whenever the user or profile changes (events.signals and
+ParticipantProfile.approve).
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from .cache import user_cache_key
+
+
+class ProfileModelBackend(ModelBackend):
+    def users(self):
+        return get_user_model()._default_manager.select_related('profile')
+
+    def get_user(self, user_id):
+        timeout = settings.AUTH_USER_CACHE_TIMEOUT
+        user = cache.get(user_cache_key(user_id)) if timeout else None
+        if user is None:
+            user = self.users().filter(pk=user_id).first()
+            if user is not None and timeout:
+                cache.set(user_cache_key(user_id), user, timeout)
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        timeout = settings.AUTH_USER_CACHE_TIMEOUT
+        user = await cache.aget(user_cache_key(user_id)) if timeout else None
+        if user is None:
+            user = await self.users().filter(pk=user_id).afirst()
+            if user is not None and timeout:
+                await cache.aset(user_cache_key(user_id), user, timeout)
+        return user if user is not None and self.user_can_authenticate(user) else None
@@ -0,0 +1,360 @@
+"""Helpers for the benchmark management command.
+
+Benchmarks run against a throwaway test database, never the configured one. Each
+scenario drives the views through Django's test client and reports throughput and
+p50/p95/p99 latency.
+"""
+import importlib.util
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.urls import reverse
+
+from .cache import cache_key
+from .models import Contact, Event, EventInstance, ParticipantProfile, Registration
+from .pagination import cursor_scope, encode_cursor
+from .views import captcha_challenge
+
+
+@contextmanager
+def benchmark_database():
+    """Create the test database for the duration of the block and destroy it afterwards."""
+    setup_test_environment(debug=False)
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def seed_events(num_events=200, instances_per_event=10, num_contacts=50):
+    """Create contacts, events and dated instances with bulk inserts."""
+    contacts = Contact.objects.bulk_create(
+        Contact(first_name=f'First{i}', last_name=f'Last{i}', phone='', email='') for i in range(num_contacts)
+    )
+    events = Event.objects.bulk_create(
+        Event(
+            title=f'Class {i}', summary='Benchmark class', contact=contacts[i % num_contacts],
+            max_leaders=10, max_followers=10, max_participants=24,
+        )
+        for i in range(num_events)
+    )
+    start = date.today() + timedelta(days=1)
+    EventInstance.objects.bulk_create(
+        EventInstance(event=event, date=start + timedelta(weeks=week), status='n' if week % 5 else 'c')
+        for event in events
+        for week in range(instances_per_event)
+    )
+    return events
+
+
+def seed_users(num_users=3000):
+    """Create approved participants. Passwords are unusable, clients log in with force_login."""
+    User = get_user_model()
+    users = User.objects.bulk_create(
+        User(username=f'dancer{i}', password='!') for i in range(num_users)
+    )
+    roles = ParticipantProfile.Role.values
+    ParticipantProfile.objects.bulk_create(
+        ParticipantProfile(user=user, role=roles[i % len(roles)], approved=True) for i, user in enumerate(users)
+    )
+    return users
+
+
+def seed_registrations(users, num_registrations=30000, seed=0):
+    """Spread registrations evenly over the open instances, alternating roles within the caps."""
+    rng = random.Random(seed)
+    instances = list(EventInstance.objects.filter(status='n').select_related('event'))
+    registrations = []
+    for instance in instances:
+        event = instance.event
+        per_instance = min(
+            -(-num_registrations // len(instances)),
+            2 * min(event.max_leaders, event.max_followers),
+            len(users),
+        )
+        for j, user in enumerate(rng.sample(users, per_instance)):
+            registrations.append(Registration(user=user, event_instance=instance, role='LF'[j % 2]))
+    registrations = registrations[:num_registrations]
+    Registration.objects.bulk_create(registrations, batch_size=1000)
+    # bulk_create skips the signals that maintain the seat counters
+    for instance in instances:
+        instance.refresh_counts()
+    return len(registrations)
+
+
+def summarise(latencies, elapsed):
+    ordered = sorted(latencies)
+    quantiles = statistics.quantiles(ordered, n=100) if len(ordered) > 1 else ordered * 99
+    return {
+        'requests': len(ordered),
+        'rps': round(len(ordered) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(quantiles[49], 2),
+        'p95_ms': round(quantiles[94], 2),
+        'p99_ms': round(quantiles[98], 2),
+    }
+
+
+def measure(send, requests):
+    """Call send(i) for i in range(requests) and summarise throughput and latency in milliseconds."""
+    latencies = []
+    started = time.perf_counter()
+    for i in range(requests):
+        t0 = time.perf_counter()
+        send(i)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return summarise(latencies, time.perf_counter() - started)
+
+
+def measure_concurrent(send, requests, workers):
+    """Like measure(), but with send(i) running on workers threads at once."""
+    latencies = []
+    lock = threading.Lock()
+
+    def timed(i):
+        try:
+            t0 = time.perf_counter()
+            send(i)
+            elapsed = (time.perf_counter() - t0) * 1000
+            with lock:
+                latencies.append(elapsed)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(timed, range(requests)))
+    return summarise(latencies, time.perf_counter() - started)
+
+
+def check(response, url):
+    assert response.status_code < 400, (url, response.status_code)
+    return response
+
+
+def logged_in_clients(users):
+    clients = []
+    for user in users:
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+    return clients
+
+
+class Scenarios:
+    """The benchmark scenarios, each a method returning a result dict.
+
+    Scenarios that change data clean up after themselves, so they can run in any order.
+    """
+
+    names = [
+        'index', 'index_uncached', 'event_list', 'event_detail', 'my_events',
+        'register', 'cancel', 'registration_burst', 'deep_pages', 'cache_backends', 'signup',
+    ]
+
+    def __init__(self, users, requests, workers, seed=0):
+        self.requests = requests
+        self.workers = workers
+        self.rng = random.Random(seed)
+        self.users = users
+        self.clients = logged_in_clients(self.rng.sample(users, min(50, len(users))))
+        self.event_ids = list(Event.objects.values_list('pk', flat=True))
+        self.open_instance_ids = list(EventInstance.objects.filter(status='n').values_list('pk', flat=True))
+
+    def client(self, i):
+        return self.clients[i % len(self.clients)]
+
+    def get(self, url_for):
+        def send(i):
+            url = url_for(i)
+            check(self.client(i).get(url), url)
+        return measure(send, self.requests)
+
+    def index(self):
+        return self.get(lambda i: reverse('index'))
+
+    def index_uncached(self):
+        # A zero timeout stores nothing, so every request runs the COUNT queries again
+        with override_settings(HOME_STATISTICS_TIMEOUT=0):
+            return self.index()
+
+    def event_list(self):
+        pages = max(1, len(self.event_ids) // 10)
+        return self.get(lambda i: f"{reverse('events')}?page={self.rng.randint(1, pages)}")
+
+    def event_detail(self):
+        return self.get(lambda i: reverse('Event-detail', args=[self.rng.choice(self.event_ids)]))
+
+    def my_events(self):
+        return self.get(lambda i: reverse('my-events'))
+
+    def register(self):
+        self.registered = []
+
+        def send(i):
+            pk = self.rng.choice(self.open_instance_ids)
+            url = reverse('register-eventinstance', args=[pk])
+            check(self.client(i).post(url, {'role': self.rng.choice('LF')}), url)
+            self.registered.append((i, pk))
+        return measure(send, self.requests)
+
+    def cancel(self):
+        if not hasattr(self, 'registered'):
+            self.register()
+        done = self.registered
+
+        def send(i):
+            client_index, pk = done[i % len(done)]
+            url = reverse('cancel-eventinstance', args=[pk])
+            check(self.client(client_index).post(url), url)
+        return measure(send, len(done))
+
+    def registration_burst(self):
+        """Registration opens: every user races for a seat on one new instance at the same time."""
+        event = Event.objects.create(
+            title='Burst class', summary='Benchmark burst', max_leaders=20, max_followers=20, max_participants=44,
+        )
+        instance = EventInstance.objects.create(event=event, date=date.today() + timedelta(days=1))
+        url = reverse('register-eventinstance', args=[instance.pk])
+        burst_users = self.rng.sample(self.users, min(self.requests, len(self.users)))
+        clients = logged_in_clients(burst_users)
+        roles = 'LFD'
+
+        def send(i):
+            check(clients[i].post(url, {'role': roles[i % len(roles)]}), url)
+
+        result = measure_concurrent(send, len(clients), self.workers)
+        instance.refresh_from_db()
+        # Judge by the Registration rows, not by the counters the burst is checking
+        rows = dict(instance.registrations.values_list('role').annotate(count=Count('pk')).order_by())
+        registered = sum(rows.values())
+        result['registered'] = registered
+        result['waitlisted'] = instance.waitlist.count()
+        # max_participants only limits DoubleRole admissions (capacity.seat_refusal): each
+        # is taken below it, so there can be no more DoubleRoles than that
+        result['overbooked'] = (
+            rows.get('L', 0) > event.max_leaders or rows.get('F', 0) > event.max_followers
+            or rows.get('D', 0) > event.max_participants
+        )
+        result['counters_match'] = registered == instance.num_registered and all(
+            rows.get(role, 0) == getattr(instance, field) for role, field in EventInstance.COUNTER_FIELDS.items()
+        )
+        event.delete()
+        return result
+
+    def deep_pages(self):
+        """Page 1000 of the contact list, by page number (OFFSET) and by cursor.
+
+        The result is the cursor page 1000; the other three variants are reported as
+        their p50 for comparison. Cursor latency should not depend on the depth.
+        """
+        page_size, depth = 10, 1000
+        contacts = Contact.objects.bulk_create(
+            # Sorted before the seeded contacts, so page 1 and page depth show the same kind of rows
+            (Contact(first_name=f'First{i % 7}', last_name=f'Deep{i:05}', phone='', email='')
+             for i in range(page_size * depth)),
+            batch_size=1000,
+        )
+        staff = get_user_model().objects.create(username='benchmark-staff', is_staff=True)
+        client = logged_in_clients([staff])[0]
+        url = reverse('contacts')
+        # The cursor continuing after the last contact of page depth - 1
+        ordering = ('last_name', 'first_name', 'id')
+        keys = list(Contact.objects.order_by(*ordering).values_list(*ordering)[page_size * (depth - 1) - 1])
+        variants = {
+            'offset_page_1': {'page': 1},
+            f'offset_page_{depth}': {'page': depth},
+            'cursor_page_1': {'cursor': ''},
+            f'cursor_page_{depth}': {'cursor': encode_cursor(keys, cursor_scope(Contact, ordering))},
+        }
+
+        def variant(params):
+            return measure(lambda i: check(client.get(url, params), url), self.requests)
+
+        try:
+            results = {name: variant(params) for name, params in variants.items()}
+        finally:
+            Contact.objects.filter(pk__in=[contact.pk for contact in contacts]).delete()
+            staff.delete()
+        result = results.pop(f'cursor_page_{depth}')
+        result.update({f'{name}_p50_ms': variant_result['p50_ms'] for name, variant_result in results.items()})
+        return result
+
+    def cache_backends(self):
+        """get() of a page-fragment-sized value from each cache backend, four hits to each miss.
+
+        The result is the local-memory cache; the file and database caches are reported
+        as their p50 and hit rate for comparison.
+        """
+        value = 'x' * 2000
+        keys = [cache_key('benchmark', i) for i in range(100)]
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            locations = {'locmem': 'benchmark', 'file': directory, 'db': 'benchmark_cache'}
+            backends = {
+                name: {**settings.CACHE_BACKENDS[name], 'LOCATION': location} for name, location in locations.items()
+            }
+            with override_settings(CACHES={'default': settings.CACHES['default'], **backends}):
+                call_command('createcachetable', verbosity=0)
+                for name in backends:
+                    cache = caches[name]
+                    cache.set_many({key: value for key in keys[:80]})
+                    cache.stats.reset()
+                    results[name] = measure(lambda i: cache.get(self.rng.choice(keys)), self.requests)
+                    results[name]['hit_rate'] = cache.stats.snapshot()['hit_rate']
+                    cache.clear()
+        result = results.pop('locmem')
+        for name, backend_result in results.items():
+            result[f'{name}_p50_ms'] = backend_result['p50_ms']
+            result[f'{name}_hit_rate'] = backend_result['hit_rate']
+        return result
+
+    def signup(self):
+        """Account signups one after another, so that req/s is signups per second on one core.
+
+        Hashing the password is most of the cost. The result is the configured hasher;
+        the other installed ones are reported as their p50 with their current parameters.
+        """
+        url = reverse('register')
+        client = Client()
+        hashers = {
+            name: path for name, path in settings.PASSWORD_HASHER_CLASSES.items()
+            if name != 'argon2' or importlib.util.find_spec('argon2')
+        }
+        results = {}
+
+        def variant(name):
+            def send(i):
+                a, b, token = captcha_challenge()
+                response = client.post(url, {
+                    'username': f'signup-{name}-{i}', 'password1': 'benchmark', 'password2': 'benchmark',
+                    'role': 'F', 'captcha_token': token, 'captcha_answer': a + b,
+                })
+                assert check(response, url).context['success'], response.context['errors']
+            with override_settings(PASSWORD_HASHERS=[hashers[name]]):
+                return measure(send, min(self.requests, 50))
+
+        try:
+            for name in hashers:
+                results[name] = variant(name)
+        finally:
+            get_user_model().objects.filter(username__startswith='signup-').delete()
+        result = results.pop(settings.PASSWORD_HASHER)
+        result['hasher'] = settings.PASSWORD_HASHER
+        result.update({f'{name}_p50_ms': variant_result['p50_ms'] for name, variant_result in results.items()})
+        return result
@@ -0,0 +1,113 @@
+"""In-process fan-out of seat counts to the Server-Sent Events streams.
+
+Every open seat stream of an event subscribes to the broadcaster. When a Registration
+changes, events.signals calls publish_seat_counts once the transaction commits: it
+reads the instance's counters with one query and hands the result to every subscriber
+of that event, so the cost of a change does not grow with the number of listeners.
+Subscribers live on the event loop serving their stream; changes usually come from
+other threads, so they are passed over with call_soon_threadsafe.
+
+The broadcaster only reaches streams served by the same process. Deployments with
+several ASGI worker processes need a shared channel (e.g. PostgreSQL LISTEN/NOTIFY)
+in its place.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from .models import EventInstance
+
+# Keys of the stream messages and the EventInstance counters they come from
+SEAT_FIELDS = {
+    'leaders': 'num_leaders',
+    'followers': 'num_followers',
+    'doubles': 'num_doubles',
+    'registered': 'num_registered',
+}
+
+
+class Subscription:
+    """Latest seat counts per instance not yet sent to one stream.
+
+    Updates that arrive faster than the stream sends them are merged, so only the
+    newest counts of each instance are kept and memory stays bounded.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def push(self, seats):
+        self.pending[seats['instance']] = seats
+        self.ready.set()
+
+    async def get(self):
+        """Wait for updates and return the seat counts of every changed instance."""
+        await self.ready.wait()
+        self.ready.clear()
+        pending, self.pending = self.pending, {}
+        return list(pending.values())
+
+
+class SeatBroadcaster:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    def has_subscribers(self):
+        return bool(self.subscribers)
+
+    def subscribe(self, event_id):
+        """Start receiving the seat counts of event_id's instances; call on the stream's event loop."""
+        subscription = Subscription(asyncio.get_running_loop())
+        with self.lock:
+            self.subscribers[event_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, event_id, subscription):
+        with self.lock:
+            self.subscribers[event_id].discard(subscription)
+            if not self.subscribers[event_id]:
+                del self.subscribers[event_id]
+
+    def publish(self, event_id, seats):
+        """Pass seats to every subscriber of event_id; safe to call from any thread."""
+        with self.lock:
+            subscriptions = list(self.subscribers.get(event_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push, seats)
+            except RuntimeError:
+                # The stream's event loop has closed; its subscription goes with it
+                pass
+
+
+seat_broadcaster = SeatBroadcaster()
+
+
+def seat_counts(instances):
+    """Seat counts of the given EventInstance rows, as sent to the streams."""
+    return [
+        {'instance': str(instance['id']), **{key: instance[field] for key, field in SEAT_FIELDS.items()}}
+        for instance in instances
+    ]
+
+
+def seat_message(seats):
+    """A Server-Sent Events message carrying the seat counts of one or more instances."""
+    return f'event: seats\ndata: {json.dumps(seats)}\n\n'
+
+
+def publish_seat_counts(eventinstance_id):
+    """Read the counters of one instance and push them to the streams of its event."""
+    if not seat_broadcaster.has_subscribers():
+        return
+    instance = (
+        EventInstance.objects.filter(pk=eventinstance_id)
+        .values('id', 'event_id', *SEAT_FIELDS.values())
+        .first()
+    )
+    if instance is not None:
+        seat_broadcaster.publish(instance['event_id'], seat_counts([instance])[0])
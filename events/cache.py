@@ -0,0 +1,132 @@
+"""Cache backends with hit/miss counters, and key helpers for the events app.
+
+settings.CACHES selects one of the backends below with CACHE_BACKEND: a sized
+local-memory cache (the default, one per process), a file-based cache or a database
+table cache, which several processes can share. They behave like Django's own
+backends and also count, per process, the hits and misses of get(), get_many() and
+get_or_set():
+
+    caches['default'].stats.snapshot()  # {'hits': ..., 'misses': ..., 'hit_rate': ...}
+
+Keys of the events app go through cache_key(), so they cannot collide with other
+apps sharing the cache. Template fragments are keyed by {% cache %} on the version
+stamps of their objects instead, so a change makes their old entries unreachable.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.db import DatabaseCache as DjangoDatabaseCache
+from django.core.cache.backends.filebased import FileBasedCache as DjangoFileBasedCache
+from django.core.cache.backends.locmem import LocMemCache as DjangoLocMemCache
+
+CACHE_PREFIX = 'events'
+
+_MISSING = object()
+
+
+def cache_key(*parts):
+    """Key in the events namespace, e.g. cache_key('home-statistics') == 'events:home-statistics'."""
+    return ':'.join([CACHE_PREFIX, *(str(part) for part in parts)])
+
+
+def user_cache_key(user_id):
+    """Key of the user, with profile, cached by events.backends.ProfileModelBackend."""
+    return cache_key('auth-user', user_id)
+
+
+def forget_cached_users(user_ids):
+    """Drop the cached copies of these users, if ProfileModelBackend caches users."""
+    if settings.AUTH_USER_CACHE_TIMEOUT:
+        cache.delete_many([user_cache_key(user_id) for user_id in user_ids])
+
+
+class CacheStats:
+    """Hit and miss counts of one cache, shared by the threads of a process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def record(self, hits, misses):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def reset(self):
+        with self.lock:
+            self.hits = self.misses = 0
+
+    def snapshot(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        return {'hits': hits, 'misses': misses, 'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None}
+
+
+# Django opens a backend per thread; the counts are kept per cache location instead
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+class CountingCacheMixin:
+    """Counts hits and misses of get(), get_many() and get_or_set() in self.stats."""
+
+    def __init__(self, location, params):
+        super().__init__(location, params)
+        with _stats_lock:
+            self.stats = _stats.setdefault((type(self).__name__, str(location)), CacheStats())
+        self._counting = threading.local()
+
+    def _outermost(self):
+        # Backends implement get() with get_many() or the other way round; only the
+        # call made by the caller is counted
+        return not getattr(self._counting, 'active', False)
+
+    def get(self, key, default=None, version=None):
+        if not self._outermost():
+            return super().get(key, default, version)
+        self._counting.active = True
+        try:
+            value = super().get(key, _MISSING, version)
+        finally:
+            self._counting.active = False
+        hit = value is not _MISSING
+        self.stats.record(int(hit), int(not hit))
+        return value if hit else default
+
+    def get_many(self, keys, version=None):
+        if not self._outermost():
+            return super().get_many(keys, version)
+        keys = list(keys)
+        self._counting.active = True
+        try:
+            found = super().get_many(keys, version)
+        finally:
+            self._counting.active = False
+        self.stats.record(len(found), len(set(keys)) - len(found))
+        return found
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        if not self._outermost():
+            return super().get_or_set(key, default, timeout, version)
+        value = self.get(key, _MISSING, version)
+        if value is not _MISSING:
+            return value
+        self._counting.active = True
+        try:
+            return super().get_or_set(key, default, timeout, version)
+        finally:
+            self._counting.active = False
+
+
+class LocMemCache(CountingCacheMixin, DjangoLocMemCache):
+    pass
+
+
+class FileBasedCache(CountingCacheMixin, DjangoFileBasedCache):
+    pass
+
+
+class DatabaseCache(CountingCacheMixin, DjangoDatabaseCache):
+    pass
@@ -0,0 +1,210 @@
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Exists, F, OuterRef, Q
+
+from .models import EventInstance, Registration, WaitlistEntry
+
+
+class RegistrationRefused(Exception):
+    """Raised when a seat cannot be reserved for the requested role."""
+
+
+class CapacityReached(RegistrationRefused):
+    """Raised when the role is full for now; the user may join the waitlist."""
+
+
+def seat_refusal(role, leaders, followers, total, max_leaders, max_followers, max_participants):
+    """Return the reason a seat for role is not available, or None if it is.
+
+    A zero maximum means the role is not limited. DoubleRole is allowed only if the
+    total capacity exceeds the sum of the role caps and the total is not yet reached.
+    """
+    if role == Registration.Role.LEADER:
+        if max_leaders and leaders >= max_leaders:
+            return 'Leader capacity reached'
+    elif role == Registration.Role.FOLLOWER:
+        if max_followers and followers >= max_followers:
+            return 'Follower capacity reached'
+    elif role == Registration.Role.DOUBLEROLE:
+        if not max_participants or max_participants <= (max_leaders + max_followers) or total >= max_participants:
+            return 'DoubleRole not available'
+    else:
+        return 'Invalid role'
+    return None
+
+
+def available_roles(eventinst):
+    """Roles that still have a seat on eventinst, read from its stored counters."""
+    event = eventinst.event
+    return [
+        role for role in Registration.Role.values
+        if not seat_refusal(
+            role, eventinst.num_leaders, eventinst.num_followers, eventinst.num_registered,
+            event.max_leaders, event.max_followers, event.max_participants,
+        )
+    ]
+
+
+def role_choices(eventinst):
+    """(role, label, seat free) for each role that the event's caps allow at all."""
+    event = eventinst.event
+    free = available_roles(eventinst)
+    return [
+        (role, label, role in free)
+        for role, label in Registration.Role.choices
+        if not seat_refusal(role, 0, 0, 0, event.max_leaders, event.max_followers, event.max_participants)
+    ]
+
+
+def seat_available(role, max_leaders, max_followers, max_participants):
+    """Filter matching instances that still have a seat for role under the given caps."""
+    if role == Registration.Role.LEADER:
+        return Q(num_leaders__lt=max_leaders) if max_leaders else Q()
+    if role == Registration.Role.FOLLOWER:
+        return Q(num_followers__lt=max_followers) if max_followers else Q()
+    return Q(num_registered__lt=max_participants)
+
+
+def _take_seat(eventinst, role, queue_jumping=False):
+    """Count a seat for role on eventinst if one is free; return whether it was taken.
+
+    A single conditional UPDATE checks the stored counters and increments them, so the
+    check and the reservation cannot be interleaved by another transaction. Unless
+    queue_jumping is set, the seat is left for the waitlist if anyone waits for role.
+    """
+    event = eventinst.event
+    field = EventInstance.COUNTER_FIELDS[role]
+    seats = EventInstance.objects.filter(
+        seat_available(role, event.max_leaders, event.max_followers, event.max_participants),
+        pk=eventinst.pk, status='n',
+    )
+    if not queue_jumping:
+        seats = seats.exclude(Exists(WaitlistEntry.objects.filter(event_instance=OuterRef('pk'), role=role)))
+    return bool(seats.update(**{
+        field: F(field) + 1,
+        'num_registered': F('num_registered') + 1,
+        'version': F('version') + 1,
+    }))
+
+
+def _seated_registration(user, eventinst, role):
+    registration = Registration(user=user, event_instance=eventinst, role=role)
+    # The seat is already counted by _take_seat
+    registration._seat_reserved = True
+    registration.save()
+    return registration
+
+
+def reserve_seat(user, eventinst, role):
+    """Check capacity and register user to the EventInstance in one transaction.
+
+    The seat is taken with a single conditional UPDATE of the instance's stored
+    counters, which only matches while the role still has room. The update locks the
+    row, so concurrent registrations to the same instance are serialized and cannot
+    oversell seats; the Registration is then inserted in the same transaction.
+    Returns the Registration, or the existing one if the user was already registered.
+    Raises CapacityReached if the role is full or has a waitlist, and
+    RegistrationRefused if the instance is closed or the role is never available.
+    """
+    if eventinst.status != 'n' or eventinst.is_past:
+        raise RegistrationRefused('Registration not allowed for this event instance.')
+
+    event = eventinst.event
+    # Rules that depend only on the caps are checked without touching the counters
+    refusal = seat_refusal(role, 0, 0, 0, event.max_leaders, event.max_followers, event.max_participants)
+    if refusal:
+        raise RegistrationRefused(refusal)
+
+    try:
+        with transaction.atomic():
+            if not _take_seat(eventinst, role):
+                existing = eventinst.registrations.filter(user=user).first()
+                if existing:
+                    return existing
+                raise CapacityReached(f'{Registration.Role(role).label} capacity reached')
+            return _seated_registration(user, eventinst, role)
+    except IntegrityError:
+        # Already registered: the transaction rolled back, releasing the reserved seat
+        return eventinst.registrations.get(user=user)
+
+
+def join_waitlist(user, eventinst, role):
+    """Queue user for a role on eventinst, keeping an earlier entry if there is one."""
+    try:
+        with transaction.atomic():
+            return WaitlistEntry.objects.create(user=user, event_instance=eventinst, role=role)
+    except IntegrityError:
+        return WaitlistEntry.objects.get(user=user, event_instance=eventinst)
+
+
+def lock_instance(eventinst):
+    """Hold the row lock of eventinst until the surrounding transaction ends.
+
+    On backends with row locks (PostgreSQL) this is a SELECT ... FOR UPDATE, so that
+    cancellations and waitlist promotions on one instance run one after another and
+    always take the instance lock before any Registration or WaitlistEntry row lock.
+    SQLite has no row locks; its IMMEDIATE transactions already serialize writers.
+    """
+    if connection.features.has_select_for_update:
+        EventInstance.objects.select_for_update().filter(pk=eventinst.pk).values_list('pk').first()
+
+
+def release_seat(user, eventinst):
+    """Cancel user's registration and waitlist entry, promoting waiters into the freed seat.
+
+    Runs in one transaction, so the seat is never visible as free to newcomers
+    between the cancellation and the promotion. Returns the promoted Registrations.
+    """
+    with transaction.atomic():
+        lock_instance(eventinst)
+        WaitlistEntry.objects.filter(user=user, event_instance=eventinst).delete()
+        registration = Registration.objects.filter(user=user, event_instance=eventinst).first()
+        if registration is None:
+            return []
+        # The seat goes to the waitlist here, so events.signals need not offer it again
+        registration._waiters_promoted = True
+        registration.delete()
+        return promote_waiters(eventinst)
+
+
+def promote_waiters(eventinst):
+    """Move waiters into free seats of eventinst in joining order; return the new Registrations.
+
+    An entry is promoted when its role has a seat under the usual Leader/Follower/
+    DoubleRole rules, so a waiter for a full role does not block later waiters for
+    another role. Must be called inside a transaction.
+    """
+    promoted = []
+    full = set()
+    for entry in eventinst.waitlist.select_related('user'):
+        if entry.role in full:
+            continue
+        if not _take_seat(eventinst, entry.role, queue_jumping=True):
+            full.add(entry.role)
+            if full == set(Registration.Role.values):
+                break
+            continue
+        entry.delete()
+        try:
+            with transaction.atomic():
+                promoted.append(_seated_registration(entry.user, eventinst, entry.role))
+        except IntegrityError:
+            # Registered some other way meanwhile: give the seat back
+            EventInstance.adjust_counts(eventinst.pk, entry.role, -1)
+    return promoted
+
+
+def offer_freed_seats(**filters):
+    """Promote waiters into free seats of the matching instances; one transaction per instance.
+
+    Seats also free up when staff raise an event's caps or delete registrations in the
+    admin or with a queryset delete. Without this the waiters would keep them blocked:
+    _take_seat leaves a role's seats to its waitlist, so newcomers are refused.
+    """
+    instances = EventInstance.objects.select_related('event').filter(
+        Exists(WaitlistEntry.objects.filter(event_instance=OuterRef('pk'))),
+        status='n', **filters,
+    )
+    for eventinst in instances:
+        with transaction.atomic():
+            lock_instance(eventinst)
+            promote_waiters(eventinst)
@@ -0,0 +1,107 @@
+"""Streaming CSV export of registrations, for class rosters.
+
+Rows are read with QuerySet.iterator() in chunks and written to the response as they
+are produced, so memory use stays the same whether an export holds ten registrations
+or the whole term. Under ASGI (settings.ASYNC_VIEWS) the response gets an async
+iterator instead, since Django would otherwise collect a synchronous iterator into a
+list before sending it. It reads each chunk with a query of its own, continuing after
+the last row of the previous chunk, so no database cursor stays open between awaits.
+"""
+import csv
+from datetime import date
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
+
+from .models import ParticipantProfile, Registration
+from .pagination import after
+
+EXPORT_CHUNK_SIZE = 2000
+
+ROSTER_COLUMNS = (
+    ('event', 'event_instance__event__title'),
+    ('date', 'event_instance__date'),
+    ('instance', 'event_instance_id'),
+    ('status', 'event_instance__status'),
+    ('username', 'user__username'),
+    ('first_name', 'user__first_name'),
+    ('last_name', 'user__last_name'),
+    ('email', 'user__email'),
+    ('role', 'role'),
+    ('profile_role', 'user__profile__role'),
+    ('approved', 'user__profile__approved'),
+)
+# The roster order; unique, as a user registers once per instance
+ROSTER_ORDERING = ('roster_date', 'event_instance__event__title', 'event_instance_id', 'user__username')
+ROLE_LABELS = dict(Registration.Role.choices)
+PROFILE_ROLE_LABELS = dict(ParticipantProfile.Role.choices)
+
+
+class Echo:
+    """File-like object whose write() returns the line, for csv.writer to produce strings."""
+
+    def write(self, value):
+        return value
+
+
+def roster_rows(registrations):
+    """Registrations as roster rows, by instance date, event and username."""
+    return (
+        registrations
+        .annotate(roster_date=Coalesce('event_instance__date', Value(date.max)))
+        .order_by(*ROSTER_ORDERING)
+        .values_list(*(field for column, field in ROSTER_COLUMNS))
+    )
+
+
+def roster_line(writer, row):
+    row = list(row)
+    row[8] = ROLE_LABELS.get(row[8], row[8])
+    row[9] = PROFILE_ROLE_LABELS.get(row[9], row[9])
+    return writer.writerow(row)
+
+
+def roster_lines(registrations):
+    writer = csv.writer(Echo())
+    yield writer.writerow([column for column, field in ROSTER_COLUMNS])
+    for row in roster_rows(registrations).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield roster_line(writer, row)
+
+
+def roster_key(row):
+    """The ROSTER_ORDERING values of a roster row."""
+    return [row[1] or date.max, row[0], row[2], row[4]]
+
+
+def roster_chunk(registrations, last):
+    """The CSV of up to EXPORT_CHUNK_SIZE roster rows after the one with the key values
+    last (from the start if None), and the key values of its last row."""
+    rows = roster_rows(registrations)
+    if last is not None:
+        rows = rows.filter(after(ROSTER_ORDERING, last))
+    rows = list(rows[:EXPORT_CHUNK_SIZE])
+    if not rows:
+        return '', None
+    writer = csv.writer(Echo())
+    return ''.join(roster_line(writer, row) for row in rows), roster_key(rows[-1])
+
+
+async def aroster_lines(registrations):
+    yield csv.writer(Echo()).writerow([column for column, field in ROSTER_COLUMNS])
+    next_chunk = sync_to_async(roster_chunk)
+    chunk, last = await next_chunk(registrations, None)
+    while chunk:
+        yield chunk
+        chunk, last = await next_chunk(registrations, last)
+
+
+def roster_response(registrations, filename):
+    """Stream the registrations as a CSV download named filename."""
+    lines = aroster_lines(registrations) if settings.ASYNC_VIEWS else roster_lines(registrations)
+    response = StreamingHttpResponse(lines, content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,36 @@
+"""Password hashers whose cost parameters come from settings.
+
+They keep the algorithm names of Django's hashers, so stored passwords verify whatever
+the settings; a password hashed with other parameters than the current ones is hashed
+again at the user's next login. A setting of None keeps Django's default. The signup
+benchmark scenario measures what the chosen parameters cost.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+def tuned(setting, default):
+    """Hasher attribute read from setting when used, so override_settings applies too."""
+    def get(self):
+        value = getattr(settings, setting)
+        return default if value is None else value
+    return property(get)
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    iterations = tuned('PASSWORD_PBKDF2_ITERATIONS', hashers.PBKDF2PasswordHasher.iterations)
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    work_factor = tuned('PASSWORD_SCRYPT_WORK_FACTOR', hashers.ScryptPasswordHasher.work_factor)
+    parallelism = tuned('PASSWORD_SCRYPT_PARALLELISM', hashers.ScryptPasswordHasher.parallelism)
+
+    @property
+    def maxmem(self):
+        # OpenSSL refuses more than 32 MiB by default, which a work factor above 2**14 needs
+        return 2 * 128 * self.block_size * max(self.work_factor, hashers.ScryptPasswordHasher.work_factor)
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    time_cost = tuned('PASSWORD_ARGON2_TIME_COST', hashers.Argon2PasswordHasher.time_cost)
+    memory_cost = tuned('PASSWORD_ARGON2_MEMORY_COST', hashers.Argon2PasswordHasher.memory_cost)
@@ -0,0 +1,341 @@
+"""Bulk import of a term's events, instances and registrations from CSV or XLSX.
+
+The schedule file has one row per event instance:
+
+    title,date,max_leaders,max_followers,max_participants,summary,types,description,status
+
+Rows with the same title belong to one event; events that already exist (by title)
+get the new instances added. The optional registrations file has the columns
+``username,event,date,role``, where event and date name an instance of the
+schedule file or the database.
+
+Both files are read, validated and written a chunk of rows at a time, so neither is
+held in memory: dates, capacities, that each user exists, Registration uniqueness and
+the Leader/Follower/DoubleRole capacity rules against the instance's current seat
+counts are checked, and the valid rows of the chunk are written with bulk_create. All
+of it happens in one transaction; if any row is invalid it is rolled back, nothing is
+imported and ImportFailed lists the problems. bulk_create skips the signals that
+maintain the seat counters, so the counters are set at the end, from the counts the
+validation made.
+
+Imported registrations do not jump waitlists: a row for a role that someone is
+waiting for on its instance is refused, as reserve_seat would refuse the seat. Staff
+can promote the waiters first, or register the users some other way.
+"""
+import csv
+import io
+from datetime import date, datetime
+from itertools import islice
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import F
+
+from .capacity import seat_refusal
+from .models import Event, EventInstance, EventType, Registration, WaitlistEntry
+from .stats import invalidate_home_statistics
+
+BATCH_SIZE = 1000
+# Keeps "IN (...)" lookups under the query parameter limit of every backend
+LOOKUP_CHUNK = 900
+# Rows validated and written together; a chunk's lookup of existing registrations takes
+# both its users and its instances
+ROW_CHUNK = LOOKUP_CHUNK // 2
+
+STATUSES = {code for code, label in EventInstance.EVENT_STATUS}
+
+
+class ImportFailed(Exception):
+    """Raised with the list of (file, line, message) problems when an import is rejected."""
+
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} problem(s) found, nothing was imported')
+        self.errors = errors
+
+
+def read_rows(file, name):
+    """Yield (line number, row dict) from a CSV or XLSX file, streaming it.
+
+    file is a binary file object. The first row holds the column names, which are
+    matched case-insensitively. XLSX needs the optional openpyxl package.
+    """
+    if Path(name).suffix.lower() == '.xlsx':
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ImportFailed([(name, 0, 'Reading .xlsx files needs the openpyxl package; upload a CSV instead.')])
+        rows = load_workbook(file, read_only=True).active.iter_rows(values_only=True)
+        header = [str(column or '').strip().lower() for column in next(rows, ())]
+        for line, values in enumerate(rows, start=2):
+            if any(value not in (None, '') for value in values):
+                yield line, dict(zip(header, values))
+        return
+
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    header = [column.strip().lower() for column in next(reader, [])]
+    for values in reader:
+        if any(value.strip() for value in values):
+            yield reader.line_num, dict(zip(header, values))
+
+
+def chunked(items, size=LOOKUP_CHUNK):
+    """Lists of up to size items from the iterable items, consumed as they are needed."""
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def clean_text(value):
+    return '' if value is None else str(value).strip()
+
+
+def clean_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(clean_text(value))
+
+
+def clean_capacity(value):
+    if isinstance(value, float) and value.is_integer():
+        # Spreadsheets may store whole numbers as floats
+        value = int(value)
+    value = clean_text(value)
+    if not value:
+        return 0
+    number = int(value)
+    if number < 0:
+        raise ValueError
+    return number
+
+
+class ScheduleImport:
+    """Validates the rows of one import and writes them, a chunk at a time."""
+
+    def __init__(self):
+        self.errors = []
+        self.events = {}            # title -> Event, new or existing
+        self.event_types = {}       # title -> set of type names, for new events
+        self.instances = {}         # (title, date) -> EventInstance, new or existing
+        self.counts = {}            # instance pk -> [leaders, followers, doubles], including the new rows
+        self.waited = {}            # instance pk -> roles someone waits for
+        self.changed = set()        # pks of the instances with new registrations
+        self.touched = set()        # pks of the events to bump the version stamp of
+        self.imported = {'events': 0, 'instances': 0, 'registrations': 0}
+
+    def error(self, source, line, message):
+        self.errors.append((source, line, message))
+
+    def add_schedule(self, rows, source='schedule'):
+        for chunk in chunked(rows, ROW_CHUNK):
+            self.load_events(source, {clean_text(row.get('title')) for line, row in chunk})
+            new_events, new_instances = [], []
+            for line, row in chunk:
+                title = clean_text(row.get('title'))
+                if not title:
+                    self.error(source, line, 'Title is missing.')
+                    continue
+                try:
+                    day = clean_date(row.get('date'))
+                except (TypeError, ValueError):
+                    self.error(source, line, f'Date "{clean_text(row.get("date"))}" is not a YYYY-MM-DD date.')
+                    continue
+                try:
+                    caps = tuple(
+                        clean_capacity(row.get(field)) for field in ('max_leaders', 'max_followers', 'max_participants')
+                    )
+                except ValueError:
+                    self.error(source, line, 'Capacities must be whole numbers of zero or more.')
+                    continue
+                status = clean_text(row.get('status')) or 'n'
+                if status not in STATUSES:
+                    self.error(source, line, f'Status must be one of {", ".join(sorted(STATUSES))}.')
+                    continue
+
+                event = self.events.get(title)
+                if event is None:
+                    event = Event(
+                        title=title, summary=clean_text(row.get('summary')),
+                        max_leaders=caps[0], max_followers=caps[1], max_participants=caps[2],
+                    )
+                    self.events[title] = event
+                    new_events.append(event)
+                    self.event_types[title] = set()
+                elif caps != (event.max_leaders, event.max_followers, event.max_participants):
+                    self.error(source, line, f'Capacities differ from the other rows of "{title}".')
+                    continue
+                if title in self.event_types:
+                    self.event_types[title].update(filter(None, map(str.strip, clean_text(row.get('types')).split(';'))))
+
+                if (title, day) in self.instances:
+                    self.error(source, line, f'"{title}" already has an instance on {day}.')
+                    continue
+                instance = EventInstance(
+                    event=event, date=day, status=status, description=clean_text(row.get('description')),
+                )
+                self.instances[(title, day)] = instance
+                new_instances.append(instance)
+                self.counts[instance.pk] = [0, 0, 0]
+                self.waited[instance.pk] = set()
+
+            Event.objects.bulk_create(new_events, batch_size=BATCH_SIZE)
+            EventInstance.objects.bulk_create(new_instances, batch_size=BATCH_SIZE)
+            self.touched.update(instance.event_id for instance in new_instances)
+            self.imported['events'] += len(new_events)
+            self.imported['instances'] += len(new_instances)
+
+    def load_events(self, source, titles):
+        """Look up the existing events with these titles, and their scheduled instances."""
+        titles = titles - set(self.events) - {''}
+        existing = {}
+        for chunk in chunked(titles):
+            for event in Event.objects.filter(title__in=chunk):
+                existing.setdefault(event.title, []).append(event)
+        for title, events in existing.items():
+            if len(events) > 1:
+                self.error(source, 0, f'{len(events)} events are titled "{title}"; rename them before importing.')
+            self.events[title] = events[0]
+
+        events_by_pk = {events[0].pk: events[0] for events in existing.values()}
+        loaded = []
+        for chunk in chunked(events_by_pk):
+            instances = EventInstance.objects.filter(event__in=chunk, date__isnull=False)
+            if connection.features.has_select_for_update:
+                # Hold the seat counters still until the import commits
+                instances = instances.select_for_update()
+            for instance in instances:
+                instance.event = events_by_pk[instance.event_id]
+                key = (instance.event.title, instance.date)
+                if key in self.instances:
+                    self.error(source, 0, f'"{key[0]}" has several instances on {key[1]}; merge them first.')
+                self.instances[key] = instance
+                self.counts[instance.pk] = [instance.num_leaders, instance.num_followers, instance.num_doubles]
+                self.waited[instance.pk] = set()
+                loaded.append(instance.pk)
+        for chunk in chunked(loaded):
+            waiting = WaitlistEntry.objects.filter(event_instance__in=chunk).values_list('event_instance_id', 'role')
+            for instance_id, role in waiting.distinct():
+                self.waited[instance_id].add(role)
+
+    def add_registrations(self, rows, source='registrations'):
+        User = get_user_model()
+        for chunk in chunked(rows, ROW_CHUNK):
+            first_error = len(self.errors)
+            self.load_events(source, {clean_text(row.get('event')) for line, row in chunk})
+            users = dict(User.objects.filter(
+                username__in={clean_text(row.get('username')) for line, row in chunk},
+            ).values_list('username', 'pk'))
+
+            resolved = []
+            for line, row in chunk:
+                username, title = clean_text(row.get('username')), clean_text(row.get('event'))
+                user_id = users.get(username)
+                if user_id is None:
+                    self.error(source, line, f'No user "{username}".')
+                    continue
+                try:
+                    instance = self.instances.get((title, clean_date(row.get('date'))))
+                except (TypeError, ValueError):
+                    self.error(source, line, f'Date "{clean_text(row.get("date"))}" is not a YYYY-MM-DD date.')
+                    continue
+                if instance is None:
+                    self.error(source, line, f'"{title}" has no instance on {clean_text(row.get("date"))}.')
+                    continue
+                resolved.append((line, username, title, user_id, instance, clean_text(row.get('role')).upper()[:1]))
+
+            # The registrations of earlier chunks are written already
+            taken = set(Registration.objects.filter(
+                user__in={user_id for line, username, title, user_id, instance, role in resolved},
+                event_instance__in={instance.pk for line, username, title, user_id, instance, role in resolved},
+            ).values_list('user_id', 'event_instance_id'))
+            registrations = []
+            for line, username, title, user_id, instance, role in resolved:
+                if (user_id, instance.pk) in taken:
+                    self.error(source, line, f'"{username}" is already registered for "{title}" on {instance.date}.')
+                    continue
+                counts = self.counts[instance.pk]
+                event = instance.event
+                refusal = seat_refusal(
+                    role, counts[0], counts[1], sum(counts),
+                    event.max_leaders, event.max_followers, event.max_participants,
+                )
+                if refusal:
+                    self.error(source, line, f'{refusal} for "{title}" on {instance.date}.')
+                    continue
+                if role in self.waited[instance.pk]:
+                    label = Registration.Role(role).label
+                    self.error(source, line, f'{label} seats of "{title}" on {instance.date} go to its waitlist first.')
+                    continue
+                taken.add((user_id, instance.pk))
+                counts['LFD'.index(role)] += 1
+                registrations.append(Registration(user_id=user_id, event_instance=instance, role=role))
+
+            # The rows were checked in two passes; report their problems in line order
+            self.errors[first_error:] = sorted(self.errors[first_error:], key=lambda error: error[1])
+            Registration.objects.bulk_create(registrations, batch_size=BATCH_SIZE)
+            self.changed.update(registration.event_instance_id for registration in registrations)
+            self.imported['registrations'] += len(registrations)
+
+    def save(self):
+        """Finish the import once every row is written: event types, seat counters and stamps."""
+        self.save_event_types()
+        instances = [instance for instance in self.instances.values() if instance.pk in self.changed]
+        # Instances of a term mostly end up with the same counts, so one UPDATE per
+        # distinct set of counts is far cheaper than bulk_update's CASE per row
+        by_counts = {}
+        for instance in instances:
+            by_counts.setdefault(tuple(self.counts[instance.pk]), []).append(instance.pk)
+        for (leaders, followers, doubles), pks in by_counts.items():
+            for chunk in chunked(pks):
+                EventInstance.objects.filter(pk__in=chunk).update(
+                    num_leaders=leaders, num_followers=followers, num_doubles=doubles,
+                    num_registered=leaders + followers + doubles, version=F('version') + 1,
+                )
+
+        # bulk_create skips the signals that bump versions and expire cached counts
+        event_ids = self.touched | {instance.event_id for instance in instances}
+        for chunk in chunked(event_ids):
+            transaction.on_commit(lambda chunk=chunk: Event.touch(pk__in=chunk))
+        transaction.on_commit(invalidate_home_statistics)
+        return self.imported
+
+    def save_event_types(self):
+        names = set().union(*self.event_types.values())
+        types = {}
+        for chunk in chunked(names):
+            for event_type in EventType.objects.filter(name__in=chunk):
+                types[event_type.name.lower()] = event_type
+        for name in names:
+            if name.lower() not in types:
+                # Type names are unique regardless of case
+                types[name.lower()], created = EventType.objects.get_or_create(
+                    name__iexact=name, defaults={'name': name},
+                )
+        Event.type.through.objects.bulk_create(
+            (
+                Event.type.through(event_id=self.events[title].pk, eventtype_id=types[name.lower()].pk)
+                for title, names in self.event_types.items() for name in names
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+
+@transaction.atomic
+def import_schedule(schedule_rows, registration_rows=(), dry_run=False):
+    """Validate and import schedule and registration rows of (line, dict); return the counts.
+
+    Raises ImportFailed, and rolls back everything written, if any row is invalid. A dry
+    run rolls back a valid import too.
+    """
+    schedule = ScheduleImport()
+    schedule.add_schedule(schedule_rows)
+    schedule.add_registrations(registration_rows)
+    if schedule.errors:
+        raise ImportFailed(schedule.errors)
+    if dry_run:
+        transaction.set_rollback(True)
+        return schedule.imported
+    return schedule.save()
@@ -0,0 +1,38 @@
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from events.archive import archive_past_instances
+from events.models import EventInstance, Registration
+
+
+class Command(BaseCommand):
+    help = (
+        'Move event instances older than ARCHIVE_AFTER_DAYS, with their registrations, '
+        'into the archive tables. Run it nightly.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Archive instances dated before this YYYY-MM-DD date instead.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be archived.')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                before = date.fromisoformat(options['before'])
+            except ValueError:
+                raise CommandError('--before must be a YYYY-MM-DD date.')
+        else:
+            before = timezone.localdate() - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+
+        if options['dry_run']:
+            instances = EventInstance.objects.filter(date__lt=before).count()
+            registrations = Registration.objects.filter(event_instance__date__lt=before).count()
+            self.stdout.write(f'Would archive {instances} instance(s) and {registrations} registration(s) before {before}.')
+            return
+        moved = archive_past_instances(before)
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {moved["instances"]} instance(s) and {moved["registrations"]} registration(s) before {before}.'
+        ))
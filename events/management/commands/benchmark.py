@@ -0,0 +1,83 @@
+import json
+import platform
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from events.benchmarks import Scenarios, benchmark_database, seed_events, seed_registrations, seed_users
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database with realistic data and measure throughput and '
+        'p50/p95/p99 latency of the main views. Each run is appended to a JSON file.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios', nargs='*', metavar='scenario',
+            help=f'Scenarios to run (default: all). Choices: {", ".join(Scenarios.names)}.',
+        )
+        parser.add_argument('--requests', type=int, default=500, help='Requests per scenario.')
+        parser.add_argument('--workers', type=int, default=16, help='Concurrent clients in the burst scenario.')
+        parser.add_argument('--users', type=int, default=3000)
+        parser.add_argument('--events', type=int, default=200)
+        parser.add_argument('--instances-per-event', type=int, default=10)
+        parser.add_argument('--registrations', type=int, default=30000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for data and request order.')
+        parser.add_argument(
+            '--output', default='benchmark-results.json',
+            help='JSON file the run is appended to (default: %(default)s).',
+        )
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or Scenarios.names
+        unknown = set(names) - set(Scenarios.names)
+        if unknown:
+            raise CommandError(f'Unknown scenario(s): {", ".join(sorted(unknown))}')
+
+        # The scenarios send hundreds of POSTs per client, which the rate limits would refuse
+        with benchmark_database(), override_settings(RATE_LIMITS={}):
+            self.stdout.write('Seeding...')
+            seed_events(options['events'], options['instances_per_event'])
+            users = seed_users(options['users'])
+            num_registrations = seed_registrations(users, options['registrations'], options['seed'])
+            scenarios = Scenarios(users, options['requests'], options['workers'], options['seed'])
+            results = {}
+            for name in names:
+                results[name] = getattr(scenarios, name)()
+                self.report(name, results[name])
+            vendor = connection.vendor
+
+        run = {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'database': vendor,
+            'data': {
+                'users': options['users'],
+                'events': options['events'],
+                'instances': options['events'] * options['instances_per_event'],
+                'registrations': num_registrations,
+            },
+            'requests': options['requests'],
+            'workers': options['workers'],
+            'results': results,
+        }
+        path = Path(options['output'])
+        runs = json.loads(path.read_text()) if path.exists() else []
+        runs.append(run)
+        path.write_text(json.dumps(runs, indent=2))
+        self.stdout.write(self.style.SUCCESS(f'Results appended to {path}'))
+
+    def report(self, name, result):
+        extra = ', '.join(
+            f'{key} {value}' for key, value in result.items()
+            if key not in ('requests', 'rps', 'p50_ms', 'p95_ms', 'p99_ms')
+        )
+        self.stdout.write(
+            f'{name}: {result["rps"]} req/s, p50 {result["p50_ms"]} ms, '
+            f'p95 {result["p95_ms"]} ms, p99 {result["p99_ms"]} ms' + (f' ({extra})' if extra else '')
+        )
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+
+from events.models import EventInstance
+
+
+class Command(BaseCommand):
+    help = 'Compare the stored EventInstance seat counters with the Registration rows and repair drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repair', action='store_true',
+            help='Recount and store the counters of every instance that has drifted.',
+        )
+
+    def handle(self, *args, **options):
+        real = {
+            'num_leaders': Count('registrations', filter=Q(registrations__role='L')),
+            'num_followers': Count('registrations', filter=Q(registrations__role='F')),
+            'num_doubles': Count('registrations', filter=Q(registrations__role='D')),
+            'num_registered': Count('registrations'),
+        }
+        instances = EventInstance.objects.annotate(
+            **{f'real_{field}': expr for field, expr in real.items()}
+        ).order_by()
+
+        drifted = []
+        for instance in instances.iterator(chunk_size=1000):
+            diffs = {
+                field: (getattr(instance, field), getattr(instance, f'real_{field}'))
+                for field in real
+                if getattr(instance, field) != getattr(instance, f'real_{field}')
+            }
+            if diffs:
+                drifted.append(instance)
+                details = ', '.join(f'{field} {stored} -> {actual}' for field, (stored, actual) in diffs.items())
+                self.stdout.write(f'{instance.pk}: {details}')
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All seat counters match the registrations.'))
+            return
+
+        if not options['repair']:
+            self.stdout.write(self.style.WARNING(
+                f'{len(drifted)} instance(s) have drifted. Run again with --repair to fix them.'
+            ))
+            return
+
+        for instance in drifted:
+            # Recount under the row lock so concurrent registrations cannot interleave
+            with transaction.atomic():
+                EventInstance.objects.select_for_update().get(pk=instance.pk).refresh_counts()
+        self.stdout.write(self.style.SUCCESS(f'Repaired {len(drifted)} instance(s).'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from events.models import Event
+from events.recurrence import generate_instances
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the instances of recurring events up to the rolling horizon '
+        '(RECURRENCE_HORIZON_DAYS ahead). Safe to re-run; run it daily.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horizon', type=int, help='Days ahead to create instances for, instead of the setting.')
+        parser.add_argument('--event', type=int, action='append', help='Only this event id; can be repeated.')
+
+    def handle(self, *args, **options):
+        events = Event.objects.filter(pk__in=options['event']) if options['event'] else None
+        created = generate_instances(events, horizon_days=options['horizon'])
+        self.stdout.write(self.style.SUCCESS(f'Created {created} instance(s).'))
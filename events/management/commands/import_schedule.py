@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from events.importer import ImportFailed, import_schedule, read_rows
+
+MAX_REPORTED_ERRORS = 50
+
+
+class Command(BaseCommand):
+    help = (
+        'Import events and their instances, and optionally registrations, from CSV or XLSX files. '
+        'Nothing is written unless every row is valid. See events/importer.py for the columns.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('schedule', help='CSV or XLSX file with one row per event instance.')
+        parser.add_argument('--registrations', help='CSV or XLSX file with username, event, date and role columns.')
+        parser.add_argument(
+            '--dry-run', action='store_true', help='Validate the files and report what would be imported.',
+        )
+
+    def handle(self, *args, **options):
+        files = [open(options['schedule'], 'rb')]
+        try:
+            schedule = read_rows(files[0], options['schedule'])
+            registrations = ()
+            if options['registrations']:
+                files.append(open(options['registrations'], 'rb'))
+                registrations = read_rows(files[1], options['registrations'])
+            counts = import_schedule(schedule, registrations, dry_run=options['dry_run'])
+        except ImportFailed as failure:
+            for source, line, message in failure.errors[:MAX_REPORTED_ERRORS]:
+                self.stderr.write(f'{source}:{line}: {message}' if line else f'{source}: {message}')
+            if len(failure.errors) > MAX_REPORTED_ERRORS:
+                self.stderr.write(f'... and {len(failure.errors) - MAX_REPORTED_ERRORS} more')
+            raise CommandError(str(failure))
+        except OSError as error:
+            raise CommandError(str(error))
+        finally:
+            for file in files:
+                file.close()
+
+        summary = f'{counts["events"]} event(s), {counts["instances"]} instance(s), {counts["registrations"]} registration(s)'
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Valid. Would import {summary}.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Imported {summary}.'))
@@ -0,0 +1,130 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger('events.performance')
+
+# The QueryTimer of the request being handled. Context variables follow the request into
+# the threads that sync_to_async runs its database work on, so async views are measured too.
+current_timer = ContextVar('events_query_timer', default=None)
+
+
+# Transaction control statements. They are not counted as queries, so that a view has
+# the same count whether its atomic blocks open a transaction or, as inside TestCase,
+# a savepoint.
+TRANSACTION_STATEMENTS = ('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class QueryTimer:
+    """Database execute wrapper that counts queries and sums their duration."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            if not sql.lstrip().upper().startswith(TRANSACTION_STATEMENTS):
+                self.count += 1
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper installed on every connection; reports to the current request's timer."""
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """connection_created receiver that adds record_query to the new connection."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class RequestTimingMiddleware:
+    """Measure queries, DB time, template render time and wall time of each request.
+
+    The measurements are added to the response as a Server-Timing header and logged
+    to the ``events.performance`` logger. Requests whose URL name has an entry in
+    settings.QUERY_BUDGETS and run more queries than that are logged as warnings.
+    Template time is only known for views that return a TemplateResponse. Works in
+    both sync and async mode, so it does not push async views onto a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer, start, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.finish(request, response, timer, start)
+
+    async def __acall__(self, request):
+        timer, start, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.finish(request, response, timer, start)
+
+    def start(self, request):
+        timer = QueryTimer()
+        request.render_time = None
+        return timer, time.perf_counter(), current_timer.set(timer)
+
+    def finish(self, request, response, timer, start):
+        total = time.perf_counter() - start
+
+        timings = [
+            f'db;dur={timer.duration * 1000:.1f};desc="{timer.count} queries"',
+            f'total;dur={total * 1000:.1f}',
+        ]
+        if request.render_time is not None:
+            timings.insert(1, f'tpl;dur={request.render_time * 1000:.1f}')
+        response.headers['Server-Timing'] = ', '.join(timings)
+
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match else None
+        fields = {
+            'view': url_name,
+            'method': request.method,
+            'status': response.status_code,
+            'queries': timer.count,
+            'db_ms': round(timer.duration * 1000, 1),
+            'tpl_ms': None if request.render_time is None else round(request.render_time * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+        }
+        line = ' '.join(f'{key}={value}' for key, value in fields.items())
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(url_name)
+        if budget is not None and timer.count > budget:
+            logger.warning('query budget exceeded (budget=%s) %s', budget, line, extra={'timing': fields})
+        else:
+            logger.info(line, extra={'timing': fields})
+        return response
+
+    def process_template_response(self, request, response):
+        started = time.perf_counter()
+
+        def rendered(response):
+            request.render_time = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:14
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_seat_counters(apps, schema_editor):
+    EventInstance = apps.get_model('events', 'EventInstance')
+    instances = EventInstance.objects.annotate(
+        real_leaders=Count('registrations', filter=Q(registrations__role='L')),
+        real_followers=Count('registrations', filter=Q(registrations__role='F')),
+        real_doubles=Count('registrations', filter=Q(registrations__role='D')),
+        real_registered=Count('registrations'),
+    )
+    for instance in instances:
+        instance.num_leaders = instance.real_leaders
+        instance.num_followers = instance.real_followers
+        instance.num_doubles = instance.real_doubles
+        instance.num_registered = instance.real_registered
+    EventInstance.objects.bulk_update(
+        instances, ['num_leaders', 'num_followers', 'num_doubles', 'num_registered'], batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0007_participantprofile_approved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventinstance',
+            name='num_doubles',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='eventinstance',
+            name='num_followers',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='eventinstance',
+            name='num_leaders',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='eventinstance',
+            name='num_registered',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_seat_counters, migrations.RunPython.noop),
+    ]
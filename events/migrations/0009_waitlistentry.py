@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0008_eventinstance_seat_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('L', 'Leader'), ('F', 'Follower'), ('D', 'DoubleRole')], max_length=1)),
+                ('joined', models.DateTimeField(auto_now_add=True)),
+                ('event_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='events.eventinstance')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'waitlist entries',
+                'ordering': ['joined', 'id'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'event_instance'), name='unique_user_waitlist')],
+            },
+        ),
+    ]
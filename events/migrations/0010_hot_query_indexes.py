@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0009_waitlistentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='eventinstance',
+            index=models.Index(condition=models.Q(('date__isnull', False)), fields=['event', 'date'], name='eventinst_event_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventinstance',
+            index=models.Index(fields=['status', 'date'], name='eventinst_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registration',
+            index=models.Index(fields=['event_instance', 'role'], name='registration_inst_role_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistentry',
+            index=models.Index(fields=['event_instance', 'role', 'joined'], name='waitlist_inst_role_idx'),
+        ),
+    ]
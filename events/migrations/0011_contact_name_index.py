@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0010_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['last_name', 'first_name', 'id'], name='contact_name_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:47
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0011_contact_name_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='modified',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0012_event_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='recurrence',
+            field=models.CharField(blank=True, choices=[('', 'None'), ('w', 'Weekly'), ('b', 'Every other week')], default='', max_length=1),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='recurrence_end',
+            field=models.DateField(blank=True, help_text='Last possible date, if the series ends', null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='recurrence_exceptions',
+            field=models.TextField(blank=True, help_text='Dates without an instance, one YYYY-MM-DD date per line'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='recurrence_start',
+            field=models.DateField(blank=True, help_text='Date of the first instance; later instances fall on the same weekday', null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='recurrence_until',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+    ]
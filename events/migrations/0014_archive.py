@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:57
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0013_event_recurrence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedEventInstance',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('event_title', models.CharField(max_length=200)),
+                ('description', models.CharField(blank=True, max_length=200)),
+                ('date', models.DateField()),
+                ('status', models.CharField(choices=[('n', 'Normal'), ('c', 'Canceled'), ('p', 'Pending')], max_length=1)),
+                ('num_leaders', models.PositiveIntegerField(default=0)),
+                ('num_followers', models.PositiveIntegerField(default=0)),
+                ('num_doubles', models.PositiveIntegerField(default=0)),
+                ('num_registered', models.PositiveIntegerField(default=0)),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now)),
+                ('event', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='events.event')),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedRegistration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150)),
+                ('role', models.CharField(choices=[('L', 'Leader'), ('F', 'Follower'), ('D', 'DoubleRole')], max_length=1)),
+                ('event_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='registrations', to='events.archivedeventinstance')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedeventinstance',
+            index=models.Index(fields=['event', 'date'], name='archivedinst_event_date_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0014_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventinstance',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
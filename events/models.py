@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 
 from django.urls import reverse # Used in get_absolute_url() to get URL for specified ID
 
@@ -6,9 +6,12 @@ from django.db.models import UniqueConstraint # Constrains fields to unique valu
 from django.db.models.functions import Lower # Returns lower cased value of field
 
 from django.conf import settings
+from django.utils import timezone
 from datetime import date
 from django.core.exceptions import ValidationError
 
+from .cache import forget_cached_users
+
 class ParticipantProfile(models.Model):
     class Role(models.TextChoices):
         LEADER = 'L', 'Leader'
@@ -22,6 +25,25 @@ class ParticipantProfile(models.Model):
     def __str__(self):
         return f'{self.user} profile ({self.get_role_display()})'
 
+    @classmethod
+    def approve(cls, users):
+        """Approve the users of a User queryset, creating missing profiles; return how many were approved.
+
+        Runs a fixed number of queries whatever the number of users: one to find users
+        without a profile, an INSERT for those (none if all have one) and one UPDATE,
+        plus one listing the users when they are cached by ProfileModelBackend.
+        Users who were already approved are not counted.
+        """
+        with transaction.atomic():
+            if settings.AUTH_USER_CACHE_TIMEOUT:
+                # The UPDATE sends no signals; drop the cached users once it commits
+                user_ids = list(users.values_list('pk', flat=True))
+                transaction.on_commit(lambda: forget_cached_users(user_ids))
+            missing = users.filter(profile__isnull=True).values_list('pk', flat=True)
+            # New profiles start unapproved like any other, so the UPDATE counts them
+            cls.objects.bulk_create((cls(user_id=pk) for pk in missing), ignore_conflicts=True)
+            return cls.objects.filter(user__in=users, approved=False).update(approved=True)
+
 
 class EventType(models.Model):
     """Model representing a event type."""
@@ -67,10 +89,51 @@ class Event(models.Model):
     max_leaders = models.PositiveIntegerField(default=0, help_text="Maximum number of Leaders per instance")
     max_followers = models.PositiveIntegerField(default=0, help_text="Maximum number of Followers per instance")
     max_participants = models.PositiveIntegerField(default=0, help_text="Total maximum participants per instance")
+
+    # Recurrence rule; events.recurrence creates the instances it describes a few weeks ahead
+    RECURRENCE = (
+        ('', 'None'),
+        ('w', 'Weekly'),
+        ('b', 'Every other week'),
+    )
+    RECURRENCE_WEEKS = {'w': 1, 'b': 2}
+    recurrence = models.CharField(max_length=1, choices=RECURRENCE, blank=True, default='')
+    recurrence_start = models.DateField(
+        null=True, blank=True, help_text="Date of the first instance; later instances fall on the same weekday")
+    recurrence_end = models.DateField(null=True, blank=True, help_text="Last possible date, if the series ends")
+    recurrence_exceptions = models.TextField(
+        blank=True, help_text="Dates without an instance, one YYYY-MM-DD date per line")
+    # Instances up to this date have been created; later runs only add dates after it
+    recurrence_until = models.DateField(null=True, blank=True, editable=False)
+
+    # Version stamp of the event's fields, contact, types and instances (but not their seat
+    # counts, see EventInstance.version), bumped by events.signals. The JSON API ETags and
+    # the cached template fragments are keyed on it.
+    version = models.PositiveIntegerField(default=1, editable=False)
+    modified = models.DateTimeField(default=timezone.now, editable=False)
     
     def __str__(self):
         """String for representing the Model object."""
         return self.title
+
+    def clean(self):
+        if self.recurrence and not self.recurrence_start:
+            raise ValidationError({'recurrence_start': 'A recurring event needs a first date.'})
+        if self.recurrence_start and self.recurrence_end and self.recurrence_end < self.recurrence_start:
+            raise ValidationError({'recurrence_end': 'The series cannot end before it starts.'})
+        try:
+            self.exception_dates()
+        except ValueError:
+            raise ValidationError({'recurrence_exceptions': 'Write one YYYY-MM-DD date per line.'})
+
+    def exception_dates(self):
+        """The dates listed in recurrence_exceptions."""
+        return {date.fromisoformat(line.strip()) for line in self.recurrence_exceptions.splitlines() if line.strip()}
+
+    @classmethod
+    def touch(cls, **filters):
+        """Bump the version stamp of the matching events."""
+        return cls.objects.filter(**filters).update(version=models.F('version') + 1, modified=timezone.now())
     
     def get_absolute_url(self):
         """Returns the URL to access a detail record for this Event."""
@@ -96,6 +159,16 @@ class EventInstance(models.Model):
     date = models.DateField(null=True, blank=True)
     # Multiple users can register to an event instance via Registration
 
+    # Denormalized seat counters, kept in sync with Registration rows by events.signals.
+    # Use the check_seat_counts management command to detect and repair drift.
+    num_leaders = models.PositiveIntegerField(default=0, editable=False)
+    num_followers = models.PositiveIntegerField(default=0, editable=False)
+    num_doubles = models.PositiveIntegerField(default=0, editable=False)
+    num_registered = models.PositiveIntegerField(default=0, editable=False)
+    # Version stamp of the instance's fields, seat counts and its event's capacities,
+    # bumped with the counters and by events.signals
+    version = models.PositiveIntegerField(default=1, editable=False)
+
     @property
     def is_past(self):
         """Determines if the book is overdue based on due date and current date."""
@@ -117,6 +190,14 @@ class EventInstance(models.Model):
     
     class Meta:
         ordering = ['date']
+        indexes = [
+            # Scheduled instances of an event, in date order (EventDetailView)
+            models.Index(
+                fields=['event', 'date'], condition=models.Q(date__isnull=False), name='eventinst_event_date_idx',
+            ),
+            # Instances by status, in date order (index counts, my events)
+            models.Index(fields=['status', 'date'], name='eventinst_status_date_idx'),
+        ]
     
     def __str__(self):
         """String for representing the Model object.
@@ -129,15 +210,64 @@ class EventInstance(models.Model):
             return 'New event instance'
         return f'{self.id} ({self.event.title if self.event else "No Event"})'
 
-    # Helper methods for capacity checks
+    def save(self, *args, **kwargs):
+        # The seat counters and the version only ever change through UPDATEs; saving a
+        # stale copy of the row (an admin form, say) must not write old values back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.UPDATE_ONLY_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def touch(cls, **filters):
+        """Bump the version stamp of the matching instances."""
+        return cls.objects.filter(**filters).update(version=models.F('version') + 1)
+
+    # Helper methods for capacity checks, served from the stored counters
     def leaders_count(self):
-        return self.registrations.filter(role=Registration.Role.LEADER).count()
+        return self.num_leaders
 
     def followers_count(self):
-        return self.registrations.filter(role=Registration.Role.FOLLOWER).count()
+        return self.num_followers
+
+    def doubles_count(self):
+        return self.num_doubles
 
     def total_count(self):
-        return self.registrations.count()
+        return self.num_registered
+
+    COUNTER_FIELDS = {
+        'L': 'num_leaders',
+        'F': 'num_followers',
+        'D': 'num_doubles',
+    }
+    # Left out of save(), which would otherwise overwrite them with the values loaded
+    UPDATE_ONLY_FIELDS = frozenset([*COUNTER_FIELDS.values(), 'num_registered', 'version'])
+
+    @classmethod
+    def adjust_counts(cls, pk, role, delta):
+        """Atomically add delta to the role and total counters of one instance."""
+        field = cls.COUNTER_FIELDS[role]
+        return cls.objects.filter(pk=pk).update(**{
+            field: models.F(field) + delta,
+            'num_registered': models.F('num_registered') + delta,
+            'version': models.F('version') + 1,
+        })
+
+    def refresh_counts(self):
+        """Recompute the counters from the Registration rows and store them."""
+        counts = self.registrations.aggregate(
+            num_leaders=models.Count('pk', filter=models.Q(role='L')),
+            num_followers=models.Count('pk', filter=models.Q(role='F')),
+            num_doubles=models.Count('pk', filter=models.Q(role='D')),
+            num_registered=models.Count('pk'),
+        )
+        for field, value in counts.items():
+            setattr(self, field, value)
+        EventInstance.objects.filter(pk=self.pk).update(**counts, version=models.F('version') + 1)
+        return counts
 
     def user_registered(self, user):
         if not user or not user.is_authenticated:
@@ -158,11 +288,52 @@ class Registration(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['user', 'event_instance'], name='unique_user_eventinstance')
         ]
+        indexes = [
+            # Per-role counts of an instance (seat counter recounts)
+            models.Index(fields=['event_instance', 'role'], name='registration_inst_role_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember what the row was counted as, so a role or instance change
+        # can move the seat between counters on save.
+        instance = super().from_db(db, field_names, values)
+        instance._counted_as = (instance.__dict__.get('event_instance_id'), instance.__dict__.get('role'))
+        return instance
 
     def __str__(self):
         return f'{self.user} -> {self.event_instance} [{self.get_role_display()}]'
 
 
+class WaitlistEntry(models.Model):
+    """A user waiting for a seat in a role on a full EventInstance, in order of joining."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    event_instance = models.ForeignKey(EventInstance, on_delete=models.CASCADE, related_name='waitlist')
+    role = models.CharField(max_length=1, choices=Registration.Role.choices)
+    joined = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['joined', 'id']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'event_instance'], name='unique_user_waitlist')
+        ]
+        indexes = [
+            # Queue of an instance and role in joining order (positions, promotion, seat checks)
+            models.Index(fields=['event_instance', 'role', 'joined'], name='waitlist_inst_role_idx'),
+        ]
+        verbose_name_plural = 'waitlist entries'
+
+    def __str__(self):
+        return f'{self.user} waiting for {self.event_instance} [{self.get_role_display()}]'
+
+    def position(self):
+        """1-based place of this entry in the queue for its instance and role."""
+        return WaitlistEntry.objects.filter(
+            models.Q(joined__lt=self.joined) | models.Q(joined=self.joined, id__lt=self.id),
+            event_instance_id=self.event_instance_id, role=self.role,
+        ).count() + 1
+
+
 class Contact(models.Model):
     """Model representing an Contact."""
     first_name = models.CharField(max_length=100)
@@ -172,6 +343,10 @@ class Contact(models.Model):
     
     class Meta:
         ordering = ['last_name', 'first_name']
+        indexes = [
+            # Keyset pagination of the contact list walks this order
+            models.Index(fields=['last_name', 'first_name', 'id'], name='contact_name_idx'),
+        ]
     
     def get_absolute_url(self):
         """Returns the URL to access a particular contact instance."""
@@ -181,3 +356,42 @@ class Contact(models.Model):
         """String for representing the Model object."""
         return f'{self.last_name}, {self.first_name}'
 
+
+
+class ArchivedEventInstance(models.Model):
+    """A past EventInstance, moved out of the live tables by events.archive.
+
+    Keeps the final seat counts and the event title, so the history still reads
+    right if the event is renamed or deleted later.
+    """
+    id = models.UUIDField(primary_key=True)
+    event = models.ForeignKey('Event', on_delete=models.SET_NULL, null=True)
+    event_title = models.CharField(max_length=200)
+    description = models.CharField(max_length=200, blank=True)
+    date = models.DateField()
+    status = models.CharField(max_length=1, choices=EventInstance.EVENT_STATUS)
+    num_leaders = models.PositiveIntegerField(default=0)
+    num_followers = models.PositiveIntegerField(default=0)
+    num_doubles = models.PositiveIntegerField(default=0)
+    num_registered = models.PositiveIntegerField(default=0)
+    archived = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-date']
+        indexes = [
+            models.Index(fields=['event', 'date'], name='archivedinst_event_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.event_title} on {self.date}'
+
+
+class ArchivedRegistration(models.Model):
+    """A Registration to an ArchivedEventInstance."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
+    username = models.CharField(max_length=150)
+    event_instance = models.ForeignKey(ArchivedEventInstance, on_delete=models.CASCADE, related_name='registrations')
+    role = models.CharField(max_length=1, choices=Registration.Role.choices)
+
+    def __str__(self):
+        return f'{self.username} -> {self.event_instance} [{self.get_role_display()}]'
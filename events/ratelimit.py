@@ -0,0 +1,255 @@
+"""Rate limiting and admission control for the registration endpoints.
+
+RateLimitMiddleware keeps a token bucket per client and URL name for the views listed
+in settings.RATE_LIMITS. A bucket holds up to `burst` tokens and refills at `rate`
+tokens per second; each POST takes one, and a POST finding the bucket empty gets a
+429 response with a Retry-After header before the view, the session or the user is
+loaded. The client is the session cookie, else the CSRF cookie, else the address.
+Cookies are chosen by the client, so every address also has a bucket
+RATE_LIMIT_ADDRESS_FACTOR times as large, which stops a script rotating cookies
+without penalizing users who share an address.
+
+The buckets live in process memory (RATE_LIMIT_BACKEND=local), or in the default cache
+(cache), which workers share when the cache backend is file or db. Cache buckets are
+read and written without a lock, so racing requests may both take the last token.
+
+admission() caps the seat reservations running at once for one event instance in a
+process: ADMISSION_CONCURRENCY run, up to ADMISSION_QUEUE more wait at most
+ADMISSION_TIMEOUT seconds for their turn, and the rest are refused at once. Writers to
+one instance serialize on its row anyway; waiting here keeps them off the database.
+aadmission() does the same for async views, whose waiters wait on the event loop: a
+waiter holding a thread of the database pool would stall every other async request.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .asyncdb import database_sync_to_async
+from .cache import cache_key
+
+# Buckets kept by LocalRateLimiter; the least recently used are dropped beyond this
+LOCAL_MAX_BUCKETS = 10000
+
+
+def refill(bucket, now, rate, burst):
+    """The tokens of bucket, a (tokens, stamp) pair or None for a new one, at time now."""
+    if bucket is None:
+        return float(burst)
+    tokens, stamp = bucket
+    return min(float(burst), tokens + (now - stamp) * rate)
+
+
+def retry_after(tokens, rate):
+    """Whole seconds until a bucket holding tokens has one again."""
+    return max(1, math.ceil((1 - tokens) / rate))
+
+
+class LocalRateLimiter:
+    """Token buckets in this process's memory."""
+
+    def __init__(self, max_buckets=LOCAL_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+
+    def take(self, key, rate, burst):
+        """Take a token from the bucket of key; return 0 if there was one, else seconds to wait."""
+        now = time.monotonic()
+        with self.lock:
+            tokens = refill(self.buckets.pop(key, None), now, rate, burst)
+            wait = 0 if tokens >= 1 else retry_after(tokens, rate)
+            self.buckets[key] = (tokens - 1 if not wait else tokens, now)
+            while len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        return wait
+
+    def reset(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheRateLimiter:
+    """Token buckets in the default cache, shared by the workers that share the cache."""
+
+    def take(self, key, rate, burst):
+        now = time.time()
+        key = cache_key('rate', key)
+        tokens = refill(cache.get(key), now, rate, burst)
+        wait = 0 if tokens >= 1 else retry_after(tokens, rate)
+        # A bucket left alone this long is full again, the same as a missing one
+        cache.set(key, (tokens - 1 if not wait else tokens, now), math.ceil(burst / rate) + 1)
+        return wait
+
+    def reset(self):
+        pass
+
+
+limiters = {'local': LocalRateLimiter(), 'cache': CacheRateLimiter()}
+
+
+def client_address(request):
+    """The client's address from settings.RATE_LIMIT_ADDRESS_HEADER.
+
+    A proxy appends the address it saw to X-Forwarded-For, so the last entry is the
+    one the client cannot forge.
+    """
+    value = request.META.get(settings.RATE_LIMIT_ADDRESS_HEADER) or request.META.get('REMOTE_ADDR', '')
+    return value.rsplit(',', 1)[-1].strip()
+
+
+def client_keys(request, url_name):
+    """(bucket key, size factor) pairs checked for request: the client's and its address's."""
+    address = client_address(request)
+    keys = [(f'{url_name}:ip:{address}', settings.RATE_LIMIT_ADDRESS_FACTOR)]
+    for kind, cookie in (('session', settings.SESSION_COOKIE_NAME), ('csrf', settings.CSRF_COOKIE_NAME)):
+        if request.COOKIES.get(cookie):
+            keys.insert(0, (f'{url_name}:{kind}:{request.COOKIES[cookie]}', 1))
+            break
+    return keys
+
+
+def too_many_requests(wait, message='Too many requests, please try again shortly.'):
+    response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(wait)
+    return response
+
+
+class RateLimitMiddleware:
+    """Answer POSTs to the views in settings.RATE_LIMITS with 429 once the client's bucket is empty.
+
+    Works in both sync and async mode: a sync-only middleware would make every async
+    request run the rest of the stack through async_to_sync on a thread of its own.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def limits(self, request):
+        """(limiter, key, rate, burst) of each bucket request takes a token from."""
+        if request.method != 'POST':
+            return []
+        url_name = request.resolver_match.url_name
+        limit = settings.RATE_LIMITS.get(url_name)
+        if not limit:
+            return []
+        rate, burst = limit
+        limiter = limiters[settings.RATE_LIMIT_BACKEND]
+        return [(limiter, key, rate * factor, burst * factor) for key, factor in client_keys(request, url_name)]
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        for limiter, key, rate, burst in self.limits(request):
+            wait = limiter.take(key, rate, burst)
+            if wait:
+                return too_many_requests(wait)
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        for limiter, key, rate, burst in self.limits(request):
+            if isinstance(limiter, CacheRateLimiter):
+                # The file and database caches block
+                wait = await database_sync_to_async(limiter.take)(key, rate, burst)
+            else:
+                wait = limiter.take(key, rate, burst)
+            if wait:
+                return too_many_requests(wait)
+        return None
+
+
+class AdmissionRefused(Exception):
+    """Raised when an event instance has too many seat reservations queued already."""
+
+
+class AdmissionQueue:
+    """Per-key cap on the callers inside admit() at once, with a bounded queue of waiters."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> [semaphore, callers running or waiting]
+        self.slots = {}
+
+    @contextmanager
+    def admit(self, key, concurrency, queue, timeout):
+        with self.lock:
+            slot = self.slots.setdefault(key, [threading.BoundedSemaphore(concurrency), 0])
+            if slot[1] >= concurrency + queue:
+                raise AdmissionRefused(key)
+            slot[1] += 1
+        try:
+            if not slot[0].acquire(timeout=timeout):
+                raise AdmissionRefused(key)
+            try:
+                yield
+            finally:
+                slot[0].release()
+        finally:
+            with self.lock:
+                slot[1] -= 1
+                if not slot[1]:
+                    del self.slots[key]
+
+
+admission_queue = AdmissionQueue()
+
+
+def admission(eventinst):
+    """Context manager holding one of eventinst's reservation slots; raises AdmissionRefused."""
+    return admission_queue.admit(
+        eventinst.pk, settings.ADMISSION_CONCURRENCY, settings.ADMISSION_QUEUE, settings.ADMISSION_TIMEOUT,
+    )
+
+
+class AsyncAdmissionQueue:
+    """AdmissionQueue for coroutines, waiting on the event loop rather than on a thread."""
+
+    def __init__(self):
+        # (event loop, key) -> [semaphore, callers running or waiting]; an asyncio
+        # semaphore belongs to the loop it is first waited on
+        self.slots = {}
+
+    @asynccontextmanager
+    async def admit(self, key, concurrency, queue, timeout):
+        slot_key = (asyncio.get_running_loop(), key)
+        slot = self.slots.setdefault(slot_key, [asyncio.Semaphore(concurrency), 0])
+        if slot[1] >= concurrency + queue:
+            raise AdmissionRefused(key)
+        slot[1] += 1
+        try:
+            try:
+                await asyncio.wait_for(slot[0].acquire(), timeout)
+            except asyncio.TimeoutError:
+                raise AdmissionRefused(key)
+            try:
+                yield
+            finally:
+                slot[0].release()
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                del self.slots[slot_key]
+
+
+async_admission_queue = AsyncAdmissionQueue()
+
+
+def aadmission(eventinst):
+    """Async context manager holding one of eventinst's reservation slots; raises AdmissionRefused."""
+    return async_admission_queue.admit(
+        eventinst.pk, settings.ADMISSION_CONCURRENCY, settings.ADMISSION_QUEUE, settings.ADMISSION_TIMEOUT,
+    )
@@ -0,0 +1,92 @@
+"""Creating the EventInstance rows of recurring events.
+
+An Event with a recurrence rule gets one instance per weekly (or every other week)
+date from recurrence_start to recurrence_end, except the listed exception dates. The
+instances are created only within a rolling horizon, settings.RECURRENCE_HORIZON_DAYS
+ahead of today, so the instance table holds the next few weeks rather than years of
+future rows. Running generate_instances daily (the generate_instances management
+command) keeps the horizon filled.
+
+Each run only adds dates after Event.recurrence_until, the last date already covered,
+and skips dates that already have an instance, so re-runs create nothing new and
+instances that staff delete are not brought back. Changing a rule affects the dates
+after recurrence_until.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .importer import chunked
+from .models import Event, EventInstance
+from .stats import invalidate_home_statistics
+
+BATCH_SIZE = 1000
+
+
+def recurrence_dates(event, first, last):
+    """The dates of event's series between first and last, inclusive."""
+    if not event.recurrence or not event.recurrence_start:
+        return
+    step = timedelta(weeks=Event.RECURRENCE_WEEKS[event.recurrence])
+    first = max(first, event.recurrence_start)
+    if event.recurrence_end:
+        last = min(last, event.recurrence_end)
+    # First date of the series on or after first
+    day = event.recurrence_start + -(-(first - event.recurrence_start) // step) * step
+    skipped = event.exception_dates()
+    while day <= last:
+        if day not in skipped:
+            yield day
+        day += step
+
+
+@transaction.atomic
+def generate_instances(events=None, today=None, horizon_days=None):
+    """Create the missing instances of recurring events up to the horizon; return how many.
+
+    events is an Event queryset to limit the run to, today and horizon_days default to
+    the current date and settings.RECURRENCE_HORIZON_DAYS.
+    """
+    today = today or timezone.localdate()
+    if horizon_days is None:
+        horizon_days = settings.RECURRENCE_HORIZON_DAYS
+    horizon = today + timedelta(days=horizon_days)
+
+    events = (Event.objects.all() if events is None else events).exclude(recurrence='')
+    events = events.exclude(recurrence_until__gte=horizon).exclude(recurrence_end__lt=today)
+    if connection.features.has_select_for_update:
+        # Concurrent runs would otherwise both create the same dates
+        events = events.select_for_update()
+
+    windows = {}
+    for event in events:
+        first = today
+        if event.recurrence_until:
+            first = max(first, event.recurrence_until + timedelta(days=1))
+        windows[event] = list(recurrence_dates(event, first, horizon))
+    if not windows:
+        return 0
+
+    existing = set()
+    for chunk in chunked(event.pk for event in windows):
+        existing.update(
+            EventInstance.objects.filter(event__in=chunk, date__gte=today, date__lte=horizon)
+            .order_by().values_list('event_id', 'date')
+        )
+    new_instances = [
+        EventInstance(event=event, date=day)
+        for event, dates in windows.items() for day in dates
+        if (event.pk, day) not in existing
+    ]
+    EventInstance.objects.bulk_create(new_instances, batch_size=BATCH_SIZE)
+
+    for chunk in chunked(event.pk for event in windows):
+        Event.objects.filter(pk__in=chunk).update(recurrence_until=horizon)
+    # bulk_create skips the signals that bump versions and expire cached counts
+    changed = sorted({instance.event_id for instance in new_instances})
+    if changed:
+        transaction.on_commit(lambda: Event.touch(pk__in=changed))
+        transaction.on_commit(invalidate_home_statistics)
+    return len(new_instances)
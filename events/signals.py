@@ -0,0 +1,186 @@
+import weakref
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .broadcast import publish_seat_counts
+from .cache import forget_cached_users
+from .capacity import offer_freed_seats
+from .middleware import install_query_timer
+from .models import Contact, Event, EventInstance, EventType, ParticipantProfile, Registration
+from .stats import invalidate_home_statistics
+
+
+@receiver(post_save, sender=Registration)
+def count_saved_registration(sender, instance, created, raw=False, **kwargs):
+    """Keep the EventInstance seat counters in step with a created or edited Registration."""
+    if raw:
+        return
+    current = (instance.event_instance_id, instance.role)
+    if created and getattr(instance, '_seat_reserved', False):
+        # events.capacity.reserve_seat counted the seat when it reserved it
+        instance._counted_as = current
+        seats_changed(current[0])
+        return
+    previous = None if created else getattr(instance, '_counted_as', None)
+    if not created and previous is None:
+        # Saved without being loaded first; the old role is unknown, so recount.
+        EventInstance(pk=instance.event_instance_id).refresh_counts()
+        seats_changed(current[0])
+    elif previous != current:
+        if previous is not None:
+            EventInstance.adjust_counts(previous[0], previous[1], -1)
+            seats_changed(previous[0])
+            seat_freed(previous[0])
+        EventInstance.adjust_counts(current[0], current[1], 1)
+        seats_changed(current[0])
+    instance._counted_as = current
+
+
+@receiver(post_delete, sender=Registration)
+def count_deleted_registration(sender, instance, **kwargs):
+    """Release the seat of a deleted Registration, including queryset and cascade deletes."""
+    counted_as = getattr(instance, '_counted_as', (instance.event_instance_id, instance.role))
+    EventInstance.adjust_counts(counted_as[0], counted_as[1], -1)
+    seats_changed(counted_as[0])
+    if not getattr(instance, '_waiters_promoted', False):
+        seat_freed(counted_as[0])
+
+
+def seats_changed(eventinstance_id):
+    """Once the change commits, push the new counts to the seat streams.
+
+    The counter UPDATE has already bumped the instance's version stamp.
+    """
+    transaction.on_commit(partial(publish_seat_counts, eventinstance_id))
+
+
+class SeatOffer:
+    """on_commit callback giving the seats freed in one transaction to their waitlists."""
+
+    def __init__(self, eventinstance_id):
+        self.eventinstance_ids = {eventinstance_id}
+
+    def __call__(self):
+        # Seats freed from now on need an offer of their own
+        eventinstance_ids, self.eventinstance_ids = self.eventinstance_ids, None
+        offer_freed_seats(pk__in=sorted(eventinstance_ids))
+
+
+# The SeatOffer each connection's transaction will run. Only the on_commit queue holds
+# it, so it is gone once it has run or its transaction has rolled back
+pending_seat_offers = weakref.WeakKeyDictionary()
+
+
+def seat_freed(eventinstance_id):
+    """Once the change commits, give the freed seat to the instance's waitlist, if it has one.
+
+    A transaction makes one offer for all the seats it frees, so a cascade deleting a
+    user's or an instance's registrations checks each instance once.
+    """
+    connection = transaction.get_connection()
+    offer = pending_seat_offers.get(connection)
+    offer = offer and offer()
+    if offer is not None and offer.eventinstance_ids is not None:
+        offer.eventinstance_ids.add(eventinstance_id)
+        return
+    offer = SeatOffer(eventinstance_id)
+    pending_seat_offers[connection] = weakref.ref(offer)
+    transaction.on_commit(offer)
+
+
+@receiver(post_save, sender=Event)
+def touch_event(sender, instance, raw=False, **kwargs):
+    """Bump the version stamp of a saved event, and of its instances, which show its capacities."""
+    if not raw:
+        transaction.on_commit(partial(Event.touch, pk=instance.pk))
+        transaction.on_commit(partial(EventInstance.touch, event=instance.pk))
+
+
+@receiver(post_save, sender=Event)
+def offer_raised_capacity(sender, instance, created, raw=False, **kwargs):
+    """Raised caps free seats, which go to the waitlists of the event's instances first."""
+    if not raw and not created:
+        transaction.on_commit(partial(offer_freed_seats, event=instance.pk))
+
+
+@receiver(post_save, sender=EventType)
+def touch_typed_events(sender, instance, raw=False, **kwargs):
+    """A renamed type changes the type list of its events."""
+    if not raw:
+        transaction.on_commit(partial(Event.touch, type=instance.pk))
+
+
+@receiver(pre_delete, sender=EventType)
+def touch_untyped_events(sender, instance, **kwargs):
+    # Resolve the events now, while the type links still exist
+    events = list(Event.objects.filter(type=instance).values_list('pk', flat=True))
+    transaction.on_commit(partial(Event.touch, pk__in=events))
+
+
+@receiver(post_save, sender=Contact)
+def touch_contact_events(sender, instance, raw=False, **kwargs):
+    """Events show their contact's name."""
+    if not raw:
+        transaction.on_commit(partial(Event.touch, contact=instance.pk))
+
+
+@receiver(m2m_changed, sender=Event.type.through)
+def touch_retyped_events(sender, instance, action, reverse, pk_set, **kwargs):
+    """Bump the version stamp of events whose types changed, from either side of the relation."""
+    if action in ('post_add', 'post_remove'):
+        events = {'pk__in': pk_set} if reverse else {'pk': instance.pk}
+    elif action == 'pre_clear':
+        events = {'type': instance} if reverse else {'pk': instance.pk}
+        # Resolve the events now, while the type links still exist
+        events = {'pk__in': list(Event.objects.filter(**events).values_list('pk', flat=True))}
+    else:
+        return
+    transaction.on_commit(partial(Event.touch, **events))
+
+
+@receiver(post_save, sender=EventInstance)
+@receiver(post_delete, sender=EventInstance)
+def touch_instance_event(sender, instance, raw=False, **kwargs):
+    """Bump the version stamp of a saved instance; instances are also part of their event's."""
+    if raw:
+        return
+    if kwargs['signal'] is post_save:
+        transaction.on_commit(partial(EventInstance.touch, pk=instance.pk))
+    if instance.event_id:
+        transaction.on_commit(partial(Event.touch, pk=instance.event_id))
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=EventInstance)
+@receiver(post_delete, sender=EventInstance)
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+def expire_home_statistics(sender, **kwargs):
+    """The home page counts cover these models; drop the cached copy when one changes.
+
+    Only once the change commits: a page read meanwhile would cache the old counts again.
+    """
+    transaction.on_commit(invalidate_home_statistics)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def forget_cached_user(sender, instance, **kwargs):
+    """ProfileModelBackend may have cached the user; its copy must not outlive a change."""
+    transaction.on_commit(partial(forget_cached_users, [instance.pk]))
+
+
+@receiver(post_save, sender=ParticipantProfile)
+@receiver(post_delete, sender=ParticipantProfile)
+def forget_cached_profile_user(sender, instance, **kwargs):
+    transaction.on_commit(partial(forget_cached_users, [instance.user_id]))
+
+
+# RequestTimingMiddleware counts queries through a wrapper on every database connection
+connection_created.connect(install_query_timer, dispatch_uid='events.install_query_timer')
@@ -0,0 +1,49 @@
+"""Creating participant accounts.
+
+Hashing the password is the slow part of a signup: by design it takes tens to hundreds
+of milliseconds of CPU. It is done before the transaction opens, so that the user and
+its unapproved profile are inserted in one short transaction. Async signups hash on
+a pool of settings.PASSWORD_HASH_WORKERS threads, which leaves the event loop free for
+other requests and bounds how many hashes run at once; the hashers release the GIL
+while they work, so the threads use as many cores as there are.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+
+from .models import ParticipantProfile
+
+hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix='events-hash')
+
+
+class SignupRefused(Exception):
+    """Raised when the account cannot be created, e.g. because the username was taken meanwhile."""
+
+
+def ahash_password(password):
+    """make_password(password) on the hashing thread pool, as an awaitable."""
+    return sync_to_async(make_password, thread_sensitive=False, executor=hash_executor)(password)
+
+
+def create_participant(username, email, encoded_password, role):
+    """Create a user with an already hashed password and its unapproved profile, in one transaction."""
+    User = get_user_model()
+    user = User(
+        username=User.normalize_username(username),
+        email=User.objects.normalize_email(email),
+        password=encoded_password,
+    )
+    try:
+        with transaction.atomic():
+            user.save()
+            ParticipantProfile.objects.create(user=user, role=role, approved=False)
+    except IntegrityError:
+        # Someone took the username since the form was checked
+        if User.objects.filter(username=user.username).exists():
+            raise SignupRefused('Username already exists')
+        raise
+    return user
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import cache_key
+from .models import Contact, Event, EventInstance
+
+HOME_STATISTICS_KEY = cache_key('home-statistics')
+
+
+def home_statistics():
+    """Record counts shown on the home page.
+
+    The counts are cached for settings.HOME_STATISTICS_TIMEOUT seconds and dropped
+    by the signal receivers whenever an Event, EventInstance or Contact is saved
+    or deleted, so the page only runs the COUNT queries after a change.
+    """
+    stats = cache.get(HOME_STATISTICS_KEY)
+    if stats is None:
+        stats = {
+            'num_events': Event.objects.count(),
+            'num_instances': EventInstance.objects.count(),
+            # Active instances (status = 'n')
+            'num_instances_available': EventInstance.objects.filter(status__exact='n').count(),
+            'num_contacts': Contact.objects.count(),
+        }
+        cache.set(HOME_STATISTICS_KEY, stats, getattr(settings, 'HOME_STATISTICS_TIMEOUT', 300))
+    return dict(stats)
+
+
+def invalidate_home_statistics():
+    cache.delete(HOME_STATISTICS_KEY)
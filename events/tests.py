@@ -1,3 +1,1538 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import get_hasher, identify_hasher
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core import signing
+from django.core.asgi import get_asgi_application
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, reverse
+
+from registrations import urls as registrations_urls
+
+from . import urls as events_urls
+from .api import API_PAGE_SIZE
+from .archive import ARCHIVE_DELETES, archive_past_instances, unhandled_relations
+from .backends import ProfileModelBackend
+from .broadcast import seat_broadcaster
+from .cache import cache_key
+from .capacity import RegistrationRefused, join_waitlist, release_seat, reserve_seat
+from .importer import ImportFailed, clean_capacity, import_schedule, read_rows
+from .models import (
+    ArchivedEventInstance, Contact, Event, EventInstance, EventType, ParticipantProfile, Registration, WaitlistEntry,
+)
+from .pagination import after, cursor_scope, encode_cursor
+from .signals import SeatOffer
+from .signup import SignupRefused, create_participant
+from .ratelimit import AdmissionQueue, AdmissionRefused, aadmission, admission, async_admission_queue, limiters
+from .recurrence import generate_instances
+from .views import CAPTCHA_SALT, captcha_challenge
+
+User = get_user_model()
+
+
+def make_instance(max_leaders=0, max_followers=0, max_participants=0, **kwargs):
+    event = Event.objects.create(
+        title='Salsa basics', summary='Weekly class',
+        max_leaders=max_leaders, max_followers=max_followers, max_participants=max_participants,
+    )
+    kwargs.setdefault('date', date.today() + timedelta(days=7))
+    return EventInstance.objects.create(event=event, **kwargs)
+
+
+class RegisterEventInstanceTests(TestCase):
+    def setUp(self):
+        self.instance = make_instance(max_leaders=1, max_followers=1, max_participants=3)
+        self.user = User.objects.create(username='dancer')
+        self.client.force_login(self.user)
+
+    def register(self, role, instance=None):
+        instance = instance or self.instance
+        return self.client.post(reverse('register-eventinstance', args=[instance.pk]), {'role': role})
+
+    def test_register_within_capacity(self):
+        response = self.register('L')
+        self.assertRedirects(response, reverse('Event-detail', args=[self.instance.event.pk]))
+        self.assertEqual(Registration.objects.get(user=self.user).role, 'L')
+
+    def test_role_capacity_reached(self):
+        other = User.objects.create(username='other')
+        Registration.objects.create(user=other, event_instance=self.instance, role='L')
+        response = self.register('L')
+        self.assertRedirects(response, reverse('Event-detail', args=[self.instance.event.pk]))
+        self.assertFalse(Registration.objects.filter(user=self.user).exists())
+        self.assertTrue(WaitlistEntry.objects.filter(user=self.user, role='L').exists())
+
+    def test_double_role_needs_spare_total_capacity(self):
+        self.assertRedirects(self.register('D'), reverse('Event-detail', args=[self.instance.event.pk]))
+        closed = make_instance(max_leaders=1, max_followers=1, max_participants=2)
+        self.assertEqual(self.register('D', closed).status_code, 403)
+
+    def test_duplicate_registration_is_ignored(self):
+        self.register('F')
+        self.register('L')
+        self.assertEqual(list(Registration.objects.filter(user=self.user).values_list('role', flat=True)), ['F'])
+
+    def test_past_instance_refused(self):
+        past = make_instance(date=date.today() - timedelta(days=1))
+        self.assertEqual(self.register('F', past).status_code, 403)
+
+    def test_invalid_role(self):
+        self.assertEqual(self.register('X').status_code, 403)
+
+
+class ConcurrentRegistrationTests(TransactionTestCase):
+    """Fire many parallel registrations at one instance and check nothing is oversold."""
+
+    attempts = 200
+    workers = 50
+
+    def test_parallel_registrations_do_not_overbook(self):
+        pairs = make_instance(max_leaders=5, max_followers=5)
+        doubles = make_instance(max_leaders=1, max_followers=1, max_participants=12)
+        users = [User.objects.create(username=f'user{i}') for i in range(self.attempts)]
+        # Even users race for Leader/Follower seats, odd users for DoubleRole seats
+        targets = [
+            (pairs, 'L' if i % 4 == 0 else 'F') if i % 2 == 0 else (doubles, 'D')
+            for i in range(self.attempts)
+        ]
+        accepted = []
+        lock = threading.Lock()
+
+        def attempt(i):
+            try:
+                reserve_seat(users[i], *targets[i])
+            except RegistrationRefused:
+                return
+            else:
+                with lock:
+                    accepted.append(i)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(attempt, range(self.attempts)))
+
+        self.assertEqual(pairs.registrations.filter(role='L').count(), 5)
+        self.assertEqual(pairs.registrations.filter(role='F').count(), 5)
+        self.assertEqual(doubles.registrations.count(), 12)
+        self.assertEqual(Registration.objects.count(), len(accepted))
+
+
+class SeatCounterTests(TestCase):
+    def setUp(self):
+        self.instance = make_instance()
+        self.users = [User.objects.create(username=f'user{i}') for i in range(4)]
+
+    def assertCounts(self, leaders, followers, doubles, total=None):
+        self.instance.refresh_from_db()
+        self.assertEqual(
+            (self.instance.num_leaders, self.instance.num_followers, self.instance.num_doubles, self.instance.num_registered),
+            (leaders, followers, doubles, leaders + followers + doubles if total is None else total),
+        )
+
+    def test_counters_follow_create_edit_and_delete(self):
+        for user, role in zip(self.users, 'LFFD'):
+            Registration.objects.create(user=user, event_instance=self.instance, role=role)
+        self.assertCounts(1, 2, 1)
+
+        registration = Registration.objects.get(user=self.users[1])
+        registration.role = 'L'
+        registration.save()
+        self.assertCounts(2, 1, 1)
+
+        Registration.objects.filter(role='L').delete()
+        self.assertCounts(0, 1, 1)
+
+        self.users[3].delete()
+        self.assertCounts(0, 1, 0)
+
+    def test_saving_a_stale_copy_keeps_the_counters(self):
+        self.instance.event.max_leaders = 1
+        self.instance.event.save()
+        stale = EventInstance.objects.get(pk=self.instance.pk)
+        reserve_seat(self.users[0], self.instance, 'L')
+        Registration.objects.create(user=self.users[1], event_instance=self.instance, role='F')
+        stale.description = 'Edited in the admin'
+        stale.save()
+        self.assertCounts(1, 1, 0)
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.description, 'Edited in the admin')
+        with self.assertRaises(RegistrationRefused):
+            reserve_seat(self.users[2], self.instance, 'L')
+
+    def test_reading_availability_needs_no_queries(self):
+        Registration.objects.create(user=self.users[0], event_instance=self.instance, role='F')
+        instance = EventInstance.objects.get(pk=self.instance.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual((instance.leaders_count(), instance.followers_count(), instance.total_count()), (0, 1, 1))
+
+    def test_check_seat_counts_repairs_drift(self):
+        Registration.objects.create(user=self.users[0], event_instance=self.instance, role='L')
+        EventInstance.objects.filter(pk=self.instance.pk).update(num_leaders=5, num_registered=7)
+        out = StringIO()
+        call_command('check_seat_counts', stdout=out)
+        self.assertIn('num_leaders 5 -> 1', out.getvalue())
+        self.assertCounts(5, 0, 0, total=7)
+
+        call_command('check_seat_counts', '--repair', stdout=StringIO())
+        self.assertCounts(1, 0, 0)
+
+
+class EventDetailQueryTests(TestCase):
+    def setUp(self):
+        self.instance = make_instance(max_leaders=2, max_followers=2, max_participants=6)
+        self.event = self.instance.event
+        self.event.type.add(EventType.objects.create(name='Salsa'))
+        self.user = User.objects.create(username='dancer')
+        Registration.objects.create(user=self.user, event_instance=self.instance, role='L')
+
+    def add_instances(self, count):
+        for days in range(count):
+            EventInstance.objects.create(event=self.event, date=date.today() + timedelta(days=days + 8))
+
+    def assertQueriesConstant(self, expected):
+        url = reverse('Event-detail', args=[self.event.pk])
+        # Rendered from scratch; a cached header fragment saves the type query
+        cache.clear()
+        with self.assertNumQueries(expected):
+            self.client.get(url)
+        self.add_instances(30)
+        cache.clear()
+        with self.assertNumQueries(expected):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['event_instances']), 31)
+
+    def test_anonymous_query_count_is_constant(self):
+        # event with contact, types, instances
+        self.assertQueriesConstant(3)
+
+    def test_authenticated_query_count_is_constant(self):
+        self.client.force_login(self.user)
+        # session and user, plus the user's registered instances and waitlist entries
+        self.assertQueriesConstant(7)
+
+    def test_full_roles_are_not_offered(self):
+        other = User.objects.create(username='other')
+        Registration.objects.create(user=other, event_instance=self.instance, role='L')
+        self.client.force_login(User.objects.create(username='third'))
+        response = self.client.get(reverse('Event-detail', args=[self.event.pk]))
+        self.assertEqual(response.context['event_instances'][0].available_roles, ['F', 'D'])
+        self.assertContains(response, '<option value="L">Leader (full, join waitlist)</option>')
+
+
+class QueryBudgetTests(TestCase):
+    """Every view with a budget in settings.QUERY_BUDGETS must stay within it."""
+
+    def setUp(self):
+        self.instance = make_instance(max_leaders=2, max_followers=2, max_participants=6)
+        self.instance.event.contact = Contact.objects.create(first_name='Ana', last_name='Lopez')
+        self.instance.event.save()
+        for days in range(1, 20):
+            EventInstance.objects.create(event=self.instance.event, date=date.today() + timedelta(days=days))
+        self.user = User.objects.create(username='staff', is_staff=True)
+        ParticipantProfile.objects.create(user=self.user, approved=True)
+        self.client.force_login(self.user)
+
+    def queries(self, response):
+        timing = response.headers['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries", (tpl;dur=[\d.]+, )?total;dur=[\d.]+')
+        return int(re.search(r'"(\d+) queries"', timing).group(1))
+
+    def test_views_stay_within_budget(self):
+        register_url = reverse('register-eventinstance', args=[self.instance.pk])
+        cancel_url = reverse('cancel-eventinstance', args=[self.instance.pk])
+        requests = {
+            'index': ('get', reverse('index')),
+            'events': ('get', reverse('events')),
+            'Event-detail': ('get', reverse('Event-detail', args=[self.instance.event.pk])),
+            'register-eventinstance': ('post', register_url, {'role': 'L'}),
+            'my-events': ('get', reverse('my-events')),
+            'cancel-eventinstance': ('post', cancel_url),
+            'contacts': ('get', reverse('contacts')),
+            'unapproved-users': ('get', reverse('unapproved-users')),
+            'api-events': ('get', reverse('api-events')),
+            'api-event-detail': ('get', reverse('api-event-detail', args=[self.instance.event.pk])),
+            'api-my-registrations': ('get', reverse('api-my-registrations')),
+        }
+        self.assertEqual(set(requests), set(settings.QUERY_BUDGETS))
+        for name, (method, url, *data) in requests.items():
+            with self.subTest(view=name):
+                response = getattr(self.client, method)(url, *data)
+                self.assertLess(response.status_code, 400)
+                self.assertLessEqual(self.queries(response), settings.QUERY_BUDGETS[name])
+
+    def test_over_budget_is_logged(self):
+        with self.settings(QUERY_BUDGETS={'events': 0}):
+            with self.assertLogs('events.performance', 'WARNING') as logs:
+                self.client.get(reverse('events'))
+        self.assertIn('query budget exceeded', logs.output[0])
+        self.assertIn('view=events', logs.output[0])
+
+
+class IndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_instance()
+
+    def test_statistics_are_cached_until_a_change(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_events'], 1)
+        with self.assertNumQueries(0):
+            self.client.get(reverse('index'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_instance(status='c')
+            # Until the change commits, the cached counts stay and are not refilled with old ones
+            with self.assertNumQueries(0):
+                self.client.get(reverse('index'))
+        response = self.client.get(reverse('index'))
+        self.assertEqual((response.context['num_instances'], response.context['num_instances_available']), (2, 1))
+
+    def test_visits_are_counted_without_a_session(self):
+        for expected in (1, 2, 3):
+            response = self.client.get(reverse('index'))
+            self.assertEqual(response.context['num_visits'], expected)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Session.objects.exists())
+
+    def test_tampered_visit_cookie_starts_over(self):
+        self.client.cookies['num_visits'] = '41'
+        self.assertEqual(self.client.get(reverse('index')).context['num_visits'], 1)
+
+
+class WaitlistTests(TestCase):
+    def setUp(self):
+        self.instance = make_instance(max_leaders=1, max_followers=1, max_participants=3)
+        self.users = [User.objects.create(username=f'user{i}') for i in range(6)]
+
+    def register(self, user, role):
+        self.client.force_login(user)
+        return self.client.post(reverse('register-eventinstance', args=[self.instance.pk]), {'role': role}, follow=True)
+
+    def cancel(self, user):
+        self.client.force_login(user)
+        return self.client.post(reverse('cancel-eventinstance', args=[self.instance.pk]))
+
+    def test_full_role_joins_waitlist_with_position(self):
+        self.register(self.users[0], 'L')
+        self.register(self.users[1], 'L')
+        response = self.register(self.users[2], 'L')
+        self.assertContains(response, 'You are number 2 on the Leader waitlist')
+        self.assertEqual(Registration.objects.filter(event_instance=self.instance).count(), 1)
+        self.assertEqual(list(self.instance.waitlist.values_list('user__username', flat=True)), ['user1', 'user2'])
+
+    def test_cancellation_promotes_first_eligible_waiter(self):
+        self.register(self.users[0], 'L')
+        self.register(self.users[1], 'F')
+        self.register(self.users[2], 'L')  # waits for a Leader seat
+        self.register(self.users[3], 'F')  # waits for a Follower seat
+
+        self.cancel(self.users[1])
+        registration = Registration.objects.get(event_instance=self.instance, role='F')
+        self.assertEqual(registration.user, self.users[3])
+        self.assertEqual(list(self.instance.waitlist.values_list('user__username', flat=True)), ['user2'])
+        self.instance.refresh_from_db()
+        self.assertEqual((self.instance.num_leaders, self.instance.num_followers, self.instance.num_registered), (1, 1, 2))
+
+    def test_newcomers_do_not_jump_the_queue(self):
+        self.register(self.users[0], 'L')
+        self.register(self.users[1], 'L')
+        # Staff raise the cap; the waiter keeps priority over a new registration
+        self.instance.event.max_leaders = 3
+        with self.captureOnCommitCallbacks(execute=True):
+            self.instance.event.save()
+        self.register(self.users[2], 'L')
+        self.register(self.users[3], 'L')
+        # The waiter got the first new seat, the newcomers the other one and the waitlist
+        self.assertEqual(
+            list(self.instance.registrations.order_by('user__username').values_list('user__username', flat=True)),
+            ['user0', 'user1', 'user2'],
+        )
+        self.assertEqual(list(self.instance.waitlist.values_list('user__username', flat=True)), ['user3'])
+
+    def test_deleted_registration_goes_to_the_waiter(self):
+        self.register(self.users[0], 'L')
+        self.register(self.users[1], 'L')
+        with self.captureOnCommitCallbacks(execute=True):
+            Registration.objects.filter(user=self.users[0]).delete()
+        self.assertTrue(Registration.objects.filter(user=self.users[1], event_instance=self.instance).exists())
+        self.assertFalse(self.instance.waitlist.exists())
+        self.instance.refresh_from_db()
+        self.assertEqual((self.instance.num_leaders, self.instance.num_registered), (1, 1))
+
+    def test_cancellation_promotes_without_a_second_offer(self):
+        self.register(self.users[0], 'L')
+        self.register(self.users[1], 'L')
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.cancel(self.users[0])
+        self.assertTrue(Registration.objects.filter(user=self.users[1], event_instance=self.instance).exists())
+        self.assertFalse([callback for callback in callbacks if isinstance(callback, SeatOffer)])
+        queries = int(re.search(r'"(\d+) queries"', response.headers['Server-Timing']).group(1))
+        self.assertLessEqual(queries, settings.QUERY_BUDGETS['cancel-eventinstance'])
+
+    def test_cascade_makes_one_offer_per_instance(self):
+        self.register(self.users[0], 'L')
+        self.register(self.users[1], 'F')
+        self.register(self.users[2], 'L')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.instance.registrations.all().delete()
+        offers = [callback for callback in callbacks if isinstance(callback, SeatOffer)]
+        self.assertEqual(len(offers), 1)
+        self.assertTrue(Registration.objects.filter(user=self.users[2], event_instance=self.instance).exists())
+
+    def test_leaving_the_waitlist(self):
+        self.register(self.users[0], 'L')
+        self.register(self.users[1], 'L')
+        self.cancel(self.users[1])
+        self.assertFalse(self.instance.waitlist.exists())
+        self.assertTrue(Registration.objects.filter(user=self.users[0]).exists())
+
+
+class ConcurrentCancellationTests(TransactionTestCase):
+    def test_parallel_cancellations_promote_each_waiter_once(self):
+        instance = make_instance(max_leaders=5)
+        users = [User.objects.create(username=f'user{i}') for i in range(15)]
+        for user in users[:5]:
+            reserve_seat(user, instance, 'L')
+        for user in users[5:]:
+            WaitlistEntry.objects.create(user=user, event_instance=instance, role='L')
+
+        def cancel(user):
+            try:
+                return release_seat(user, instance)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            promoted = [r for result in pool.map(cancel, users[:5]) for r in result]
+
+        self.assertEqual(sorted(r.user.username for r in promoted), [f'user{i}' for i in range(5, 10)])
+        self.assertEqual(
+            sorted(instance.registrations.values_list('user__username', flat=True)),
+            [f'user{i}' for i in range(5, 10)],
+        )
+        self.assertEqual(instance.waitlist.count(), 5)
+        instance.refresh_from_db()
+        self.assertEqual((instance.num_leaders, instance.num_registered), (5, 5))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite connection profile')
+class SQLiteWriteConcurrencyTests(TransactionTestCase):
+    """Many parallel writers must wait for the write lock rather than fail with "database is locked"."""
+
+    writers = 32
+
+    def test_connections_use_the_tuned_profile(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertGreater(cursor.fetchone()[0], 0)
+
+    def test_parallel_writers_do_not_hit_lock_errors(self):
+        instances = [make_instance(max_leaders=3, max_followers=3) for _ in range(4)]
+        users = [User.objects.create(username=f'user{i}') for i in range(self.writers)]
+        errors = []
+
+        def write(i):
+            try:
+                instance = instances[i % len(instances)]
+                for _ in range(5):
+                    try:
+                        reserve_seat(users[i], instance, 'LF'[i % 2])
+                    except RegistrationRefused:
+                        pass
+                    release_seat(users[i], instance)
+            except OperationalError as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.writers) as pool:
+            list(pool.map(write, range(self.writers)))
+
+        self.assertEqual(errors, [])
+        for instance in instances:
+            instance.refresh_from_db()
+            self.assertEqual(instance.num_registered, instance.registrations.count())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'reads SQLite query plans')
+class HotQueryIndexTests(TestCase):
+    """The hot registration queries must be answered from indexes, not table scans."""
+
+    def test_hot_queries_use_indexes(self):
+        instance = make_instance()
+        user = User.objects.create(username='dancer')
+        hot_queries = {
+            'seat recount': Registration.objects.filter(event_instance=instance, role='L'),
+            'registered instance ids': Registration.objects.filter(
+                user=user, event_instance__event=instance.event,
+            ).values_list('event_instance_id', flat=True),
+            'my registrations': Registration.objects.select_related('event_instance__event').filter(
+                user=user, event_instance__status__exact='n',
+            ).order_by('event_instance__date'),
+            'scheduled instances': EventInstance.objects.filter(
+                event=instance.event, date__isnull=False,
+            ).order_by('date'),
+            'instances by status': EventInstance.objects.filter(status__exact='n'),
+            'waitlist position': WaitlistEntry.objects.filter(event_instance=instance, role='L', id__lt=10),
+            'contact keyset page': Contact.objects.filter(
+                after(['last_name', 'first_name', 'id'], ['L', 'F', 3]),
+            ).order_by('last_name', 'first_name', 'id')[:11],
+        }
+        for name, queryset in hot_queries.items():
+            with self.subTest(query=name):
+                plan = queryset.explain()
+                self.assertIn('USING', plan)
+                self.assertNotRegex(plan, r'\bSCAN\b')
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor pagination walks the whole list exactly once, in order, without COUNT queries."""
+
+    def setUp(self):
+        self.staff = User.objects.create(username='staff', is_staff=True)
+        # Duplicate names make the id tie-breaker matter
+        Contact.objects.bulk_create(
+            Contact(first_name=f'F{i % 3}', last_name=f'L{i % 7}', phone='', email='') for i in range(35)
+        )
+        self.client.force_login(self.staff)
+
+    def walk(self, url, cursor_key='next_cursor'):
+        pages = []
+        response = self.client.get(url, {'cursor': ''})
+        while True:
+            self.assertTrue(response.context['keyset_paginated'])
+            page = response.context['page_obj']
+            pages.append([obj.pk for obj in page])
+            cursor = getattr(page, cursor_key)
+            if cursor is None:
+                return pages, response
+            response = self.client.get(url, {'cursor': cursor})
+
+    def test_walks_contacts_in_name_order(self):
+        pages, _ = self.walk(reverse('contacts'))
+        expected = list(Contact.objects.order_by('last_name', 'first_name', 'id').values_list('pk', flat=True))
+        self.assertEqual([len(page) for page in pages], [10, 10, 10, 5])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_previous_cursor_returns_the_previous_page(self):
+        url = reverse('contacts')
+        first = self.client.get(url, {'cursor': ''}).context['page_obj']
+        self.assertFalse(first.has_previous())
+        second = self.client.get(url, {'cursor': first.next_cursor}).context['page_obj']
+        back = self.client.get(url, {'cursor': second.previous_cursor}).context['page_obj']
+        self.assertEqual([c.pk for c in back], [c.pk for c in first])
+        self.assertFalse(back.has_previous())
+        self.assertEqual(back.next_cursor, first.next_cursor)
+
+    def test_cursor_of_another_list_starts_over(self):
+        # A valid cursor as the my-events list makes them, replayed on the contact list
+        foreign = encode_cursor([date.today(), 5], cursor_scope(Registration, ('instance_date', 'id')))
+        response = self.client.get(reverse('contacts'), {'cursor': foreign})
+        self.assertEqual(response.status_code, 200)
+        first = self.client.get(reverse('contacts'), {'cursor': ''}).context['page_obj']
+        self.assertEqual([c.pk for c in response.context['page_obj']], [c.pk for c in first])
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+    def test_no_count_query(self):
+        with self.assertNumQueries(3) as queries:
+            # user, contacts page and their prefetched events (there are no instances); the
+            # session comes from the cache
+            response = self.client.get(reverse('contacts'), {'cursor': ''})
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries.captured_queries))
+        self.assertIsNone(response.context['paginator'])
+
+    def test_tampered_cursor_starts_from_the_beginning(self):
+        response = self.client.get(reverse('contacts'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(len(response.context['page_obj']), 10)
+
+    def test_offset_pagination_stays_the_default(self):
+        response = self.client.get(reverse('contacts'), {'page': 2})
+        self.assertFalse(response.context['keyset_paginated'])
+        self.assertEqual(response.context['page_obj'].number, 2)
+
+    def test_my_registrations_sort_undated_instances_last(self):
+        ParticipantProfile.objects.create(user=self.staff, role='L', approved=True)
+        event = Event.objects.create(title='Class', summary='Class summary')
+        today = date.today()
+        instances = [
+            EventInstance.objects.create(event=event, date=day)
+            for day in [today + timedelta(days=d) for d in (12, 3, 7)] + [None] * 9
+        ]
+        for instance in instances:
+            Registration.objects.create(user=self.staff, event_instance=instance, role='L')
+        pages, _ = self.walk(reverse('my-events'))
+        dates = [Registration.objects.get(pk=pk).event_instance.date for pk in sum(pages, [])]
+        self.assertEqual(dates[:3], sorted(dates[:3]))
+        self.assertEqual(dates[3:], [None] * 9)
+        self.assertEqual([len(page) for page in pages], [10, 2])
+
+
+CSRF_TOKEN = 'x' * 32
+
+
+async def asgi_post(application, path, data, session):
+    """POST data to path through an ASGI application, as a server would; return the status."""
+    body = urlencode({**data, 'csrfmiddlewaretoken': CSRF_TOKEN}).encode()
+    cookies = f'{settings.SESSION_COOKIE_NAME}={session}; {settings.CSRF_COOKIE_NAME}={CSRF_TOKEN}'
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [
+            (b'host', b'testserver'), (b'content-type', b'application/x-www-form-urlencoded'),
+            (b'content-length', str(len(body)).encode()), (b'cookie', cookies.encode()),
+        ],
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # The client stays connected
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    await application(scope, receive, send)
+    return next(message['status'] for message in sent if message['type'] == 'http.response.start')
+
+
+def serve(main):
+    """Run the coroutine function main on a new event loop in a thread of its own, as an
+    ASGI server would, rather than under the test's async_to_sync; return its result."""
+    result = {}
+
+    def run():
+        result['value'] = asyncio.run(main())
+
+    server = threading.Thread(target=run)
+    server.start()
+    server.join()
+    return result['value']
+
+
+@contextmanager
+def async_views():
+    """Serve the URLs through the async views, as registrations.asgi does."""
+    def reload_urls():
+        importlib.reload(events_urls)
+        importlib.reload(registrations_urls)
+        clear_url_caches()
+
+    try:
+        with override_settings(ASYNC_VIEWS=True):
+            reload_urls()
+            yield
+    finally:
+        reload_urls()
+
+
+class AsyncViewTests(TransactionTestCase):
+    """The async views under a registration burst, all in-flight on one event loop."""
+
+    burst = 300
+
+    def setUp(self):
+        self.enterContext(async_views())
+        # Every request of the burst is to be served, however long it waits for its turn
+        self.enterContext(override_settings(RATE_LIMITS={}, ADMISSION_QUEUE=self.burst, ADMISSION_TIMEOUT=60))
+
+    def test_burst_of_registrations_runs_bounded_transactions(self):
+        instance = make_instance(max_leaders=100, max_followers=100)
+        users = User.objects.bulk_create(User(username=f'dancer{i}') for i in range(self.burst))
+        sessions = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            sessions.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+        path = reverse('register-eventinstance', args=[instance.pk])
+        application = get_asgi_application()
+        running = SimpleNamespace(now=0, peak=0, threads=set())
+        lock = threading.Lock()
+
+        def counted_reserve_seat(*args, **kwargs):
+            with lock:
+                running.now += 1
+                running.peak = max(running.peak, running.now)
+                running.threads.add(threading.current_thread().name)
+            try:
+                return reserve_seat(*args, **kwargs)
+            finally:
+                with lock:
+                    running.now -= 1
+
+        async def burst():
+            return await asyncio.gather(*(
+                asgi_post(application, path, {'role': 'LF'[i % 2]}, session)
+                for i, session in enumerate(sessions)
+            ))
+
+        with mock.patch('events.views.reserve_seat', counted_reserve_seat):
+            statuses = serve(burst)
+
+        self.assertEqual(set(statuses), {302})
+        # The transactions ran on the database pool only, never more at once than it has threads
+        self.assertLessEqual(running.peak, settings.ASYNC_DB_WORKERS)
+        self.assertTrue(all(name.startswith('events-db') for name in running.threads))
+        instance.refresh_from_db()
+        self.assertEqual((instance.num_leaders, instance.num_followers), (100, 100))
+        self.assertEqual(Registration.objects.count(), 200)
+        self.assertEqual(WaitlistEntry.objects.count(), 100)
+
+    async def test_cancel_promotes_and_detail_shows_seats(self):
+        instance = await sync_to_async(make_instance)(max_leaders=1)
+        first, second = [await User.objects.acreate(username=name) for name in ('first', 'second')]
+        client = AsyncClient()
+        await client.aforce_login(first)
+        await client.post(reverse('register-eventinstance', args=[instance.pk]), {'role': 'L'})
+        await sync_to_async(join_waitlist)(second, instance, 'L')
+
+        response = await client.get(reverse('Event-detail', args=[instance.event_id]))
+        self.assertEqual(response.context['registered_instance_ids'], [instance.pk])
+        self.assertEqual(response.context['event_instances'][0].num_leaders, 1)
+        # Queries run by the async ORM on other threads are still counted
+        queries = int(re.search(r'"(\d+) queries"', response.headers['Server-Timing']).group(1))
+        self.assertTrue(0 < queries <= settings.QUERY_BUDGETS['Event-detail'])
+
+        response = await client.post(reverse('cancel-eventinstance', args=[instance.pk]))
+        self.assertRedirects(response, reverse('my-events'), fetch_redirect_response=False)
+        self.assertTrue(await Registration.objects.filter(user=second, event_instance=instance).aexists())
+        self.assertFalse(await WaitlistEntry.objects.aexists())
+
+
+class SeatStreamTests(TransactionTestCase):
+    """Seat changes reach every open stream from one notification."""
+
+    def setUp(self):
+        self.enterContext(async_views())
+
+    async def test_one_query_per_change_whatever_the_number_of_listeners(self):
+        instance = await sync_to_async(make_instance)(max_leaders=5)
+        user = await User.objects.acreate(username='dancer')
+
+        def register():
+            with CaptureQueriesContext(connection) as queries:
+                reserve_seat(user, instance, 'L')
+            return [query['sql'] for query in queries.captured_queries]
+
+        listeners = [seat_broadcaster.subscribe(instance.event_id) for _ in range(20)]
+        try:
+            queries = await sync_to_async(register)()
+            updates = await asyncio.wait_for(asyncio.gather(*(listener.get() for listener in listeners)), 5)
+        finally:
+            for listener in listeners:
+                seat_broadcaster.unsubscribe(instance.event_id, listener)
+
+        expected = {'instance': str(instance.pk), 'leaders': 1, 'followers': 0, 'doubles': 0, 'registered': 1}
+        self.assertEqual(updates, [[expected]] * 20)
+        # The seat update, the insert and a single read of the new counts
+        self.assertEqual(len([sql for sql in queries if sql.startswith('SELECT')]), 1)
+        self.assertNotIn(instance.event_id, seat_broadcaster.subscribers)
+
+    async def test_stream_sends_current_counts_then_changes(self):
+        instance = await sync_to_async(make_instance)(max_followers=5)
+        user = await User.objects.acreate(username='dancer')
+        response = await AsyncClient().get(reverse('event-seats', args=[instance.event_id]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        messages = aiter(response.streaming_content)
+
+        first = await asyncio.wait_for(anext(messages), 5)
+        self.assertIn(b'event: seats', first)
+        self.assertIn(b'"followers": 0', first)
+
+        await sync_to_async(reserve_seat)(user, instance, 'F')
+        second = await asyncio.wait_for(anext(messages), 5)
+        self.assertIn(f'"instance": "{instance.pk}"'.encode(), second)
+        self.assertIn(b'"followers": 1', second)
+
+
+class WsgiSeatStreamTests(TestCase):
+    def test_no_stream_under_wsgi(self):
+        # A WSGI worker would read the endless stream into a list and never answer
+        instance = make_instance()
+        self.assertEqual(self.client.get(f'/events/events/{instance.event_id}/seats').status_code, 404)
+        self.assertNotContains(self.client.get(reverse('Event-detail', args=[instance.event_id])), 'EventSource')
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.instance = make_instance(max_leaders=2, max_followers=2)
+        self.event = self.instance.event
+        self.user = User.objects.create(username='dancer')
+        ParticipantProfile.objects.create(user=self.user, approved=True)
+
+    def test_event_detail_has_seat_counts(self):
+        Registration.objects.create(user=self.user, event_instance=self.instance, role='L')
+        data = self.client.get(reverse('api-event-detail', args=[self.event.pk])).json()
+        self.assertEqual(data['title'], 'Salsa basics')
+        self.assertEqual(len(data['instances']), 1)
+        self.assertEqual(data['instances'][0]['id'], str(self.instance.pk))
+        self.assertEqual((data['instances'][0]['leaders'], data['instances'][0]['available_roles']), (1, ['L', 'F']))
+
+    def test_unchanged_event_is_not_modified_after_one_query(self):
+        url = reverse('api-event-detail', args=[self.event.pk])
+        etag = self.client.get(url).headers['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_registration_changes_the_etag(self):
+        url = reverse('api-event-detail', args=[self.event.pk])
+        etag = self.client.get(url).headers['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_seat(self.user, self.instance, 'F')
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['instances'][0]['followers'], 1)
+
+    def test_event_list_pages_with_cursors(self):
+        for i in range(API_PAGE_SIZE + 5):
+            Event.objects.create(title=f'Class {i}', summary='Class summary')
+        first = self.client.get(reverse('api-events')).json()
+        self.assertEqual(len(first['results']), API_PAGE_SIZE)
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(second['results']), 6)
+        self.assertIsNone(second['next'])
+        etag = self.client.get(first['next']).headers['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Event.objects.create(title='New class', summary='Class summary')
+        self.assertNotEqual(self.client.get(first['next']).headers['ETag'], etag)
+
+    def test_my_registrations_need_login(self):
+        self.assertEqual(self.client.get(reverse('api-my-registrations')).status_code, 401)
+        Registration.objects.create(user=self.user, event_instance=self.instance, role='L')
+        self.client.force_login(self.user)
+        data = self.client.get(reverse('api-my-registrations')).json()
+        self.assertEqual([r['event']['title'] for r in data['results']], ['Salsa basics'])
+
+    def test_approval_changes_my_registrations_etag(self):
+        pending = User.objects.create(username='pending')
+        ParticipantProfile.objects.create(user=pending, approved=False)
+        Registration.objects.create(user=pending, event_instance=self.instance, role='L')
+        self.client.force_login(pending)
+        url = reverse('api-my-registrations')
+        response = self.client.get(url)
+        self.assertTrue(response.json()['approval_pending'])
+        with self.captureOnCommitCallbacks(execute=True):
+            ParticipantProfile.approve(User.objects.filter(pk=pending.pk))
+        response = self.client.get(url, headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['approval_pending'])
+
+    def test_role_change_changes_my_registrations_etag(self):
+        registration = Registration.objects.create(user=self.user, event_instance=self.instance, role='L')
+        self.client.force_login(self.user)
+        url = reverse('api-my-registrations')
+        etag = self.client.get(url).headers['ETag']
+        registration.role = 'F'
+        with self.captureOnCommitCallbacks(execute=True):
+            registration.save()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['role'], 'F')
+
+
+class ScheduleImportTests(TestCase):
+    schedule = (
+        'title,date,max_leaders,max_followers,max_participants,types\n'
+        'Bachata,2030-01-07,1,1,3,Bachata;Beginner\n'
+        'Bachata,2030-01-14,1,1,3,\n'
+        'Salsa,2030-01-08,0,0,0,\n'
+    )
+
+    def rows(self, text):
+        return read_rows(BytesIO(text.encode()), 'rows.csv')
+
+    def setUp(self):
+        for name in ('ana', 'ben', 'cy'):
+            User.objects.create(username=name)
+
+    def test_imports_events_instances_and_registrations(self):
+        registrations = (
+            'username,event,date,role\n'
+            'ana,Bachata,2030-01-07,L\n'
+            'ben,Bachata,2030-01-07,D\n'
+            'ana,Salsa,2030-01-08,F\n'
+        )
+        counts = import_schedule(self.rows(self.schedule), self.rows(registrations))
+        self.assertEqual(counts, {'events': 2, 'instances': 3, 'registrations': 3})
+        bachata = Event.objects.get(title='Bachata')
+        self.assertEqual(sorted(bachata.type.values_list('name', flat=True)), ['Bachata', 'Beginner'])
+        first = bachata.eventinstance_set.get(date=date(2030, 1, 7))
+        self.assertEqual((first.num_leaders, first.num_doubles, first.num_registered), (1, 1, 2))
+        out = StringIO()
+        call_command('check_seat_counts', stdout=out)
+        self.assertIn('All seat counters match', out.getvalue())
+
+    def test_any_invalid_row_rejects_the_whole_import(self):
+        registrations = (
+            'username,event,date,role\n'
+            'ana,Bachata,2030-01-07,L\n'
+            'ben,Bachata,2030-01-07,L\n'
+            'ana,Bachata,2030-01-07,F\n'
+            'nobody,Salsa,2030-01-08,F\n'
+            'cy,Salsa,2030-02-01,F\n'
+        )
+        with self.assertRaises(ImportFailed) as failure:
+            import_schedule(self.rows(self.schedule + 'Salsa,not a date,0,0,0,\n'), self.rows(registrations))
+        self.assertEqual([line for source, line, message in failure.exception.errors], [5, 3, 4, 5, 6])
+        self.assertIn('Leader capacity reached', failure.exception.errors[1][2])
+        self.assertFalse(Event.objects.exists())
+        self.assertFalse(Registration.objects.exists())
+
+    def test_capacities_must_be_whole_numbers(self):
+        schedule = 'title,date,max_leaders,max_followers,max_participants\n'
+        for line, caps in enumerate(('inf,0,0', '1e3,0,0', '2.5,0,0', '-1,0,0', 'nan,0,0'), start=2):
+            schedule += f'Salsa,2030-01-08,{caps}\n'
+        with self.assertRaises(ImportFailed) as failure:
+            import_schedule(self.rows(schedule))
+        self.assertEqual([line for source, line, message in failure.exception.errors], [2, 3, 4, 5, 6])
+        self.assertIn('whole numbers', failure.exception.errors[0][2])
+        # Spreadsheet cells may hold whole numbers as floats
+        self.assertEqual([clean_capacity(value) for value in (' 4 ', '', 12.0, 3)], [4, 0, 12, 3])
+
+    def test_registrations_for_existing_instances_respect_their_counts(self):
+        instance = make_instance(max_followers=1)
+        Registration.objects.create(user=User.objects.get(username='ana'), event_instance=instance, role='F')
+        rows = f'username,event,date,role\nben,{instance.event.title},{instance.date},F\n'
+        with self.assertRaisesMessage(ImportFailed, '1 problem(s) found'):
+            import_schedule((), self.rows(rows))
+
+    def test_rows_are_validated_and_written_a_chunk_at_a_time(self):
+        def schedule():
+            for line, row in self.rows(self.schedule):
+                # The rows before are written by the time the next one is read
+                self.assertEqual(EventInstance.objects.count(), line - 2)
+                yield line, row
+
+        registrations = (
+            'username,event,date,role\n'
+            'ana,Bachata,2030-01-07,L\n'
+            'ben,Bachata,2030-01-07,L\n'
+            'ana,Bachata,2030-01-07,F\n'
+        )
+        with mock.patch('events.importer.ROW_CHUNK', 1):
+            with self.assertRaises(ImportFailed) as failure:
+                import_schedule(schedule(), self.rows(registrations))
+        # Seats and duplicates are checked across chunks too
+        self.assertEqual([line for source, line, message in failure.exception.errors], [3, 4])
+        self.assertIn('Leader capacity reached', failure.exception.errors[0][2])
+        self.assertIn('already registered', failure.exception.errors[1][2])
+        self.assertFalse(EventInstance.objects.exists())
+
+    def test_registrations_do_not_jump_the_waitlist(self):
+        instance = make_instance(max_leaders=1, max_followers=1)
+        join_waitlist(User.objects.get(username='cy'), instance, 'L')
+        rows = f'username,event,date,role\nana,{instance.event.title},{instance.date},L\n'
+        with self.assertRaises(ImportFailed) as failure:
+            import_schedule((), self.rows(rows))
+        self.assertIn('Leader seats of "Salsa basics"', failure.exception.errors[0][2])
+        rows = f'username,event,date,role\nana,{instance.event.title},{instance.date},F\n'
+        self.assertEqual(import_schedule((), self.rows(rows))['registrations'], 1)
+
+    def test_dry_run_writes_nothing(self):
+        counts = import_schedule(self.rows(self.schedule), dry_run=True)
+        self.assertEqual(counts, {'events': 2, 'instances': 3, 'registrations': 0})
+        self.assertFalse(Event.objects.exists())
+
+    def test_admin_upload(self):
+        admin_user = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        url = reverse('admin:events_event_import')
+        self.assertContains(self.client.get(reverse('admin:events_event_changelist')), url)
+        response = self.client.post(url, {'schedule': SimpleUploadedFile('term.csv', self.schedule.encode())})
+        self.assertRedirects(response, reverse('admin:events_event_changelist'))
+        self.assertEqual(EventInstance.objects.count(), 3)
+
+
+class RegistrationExportTests(TestCase):
+    def setUp(self):
+        self.instance = make_instance(max_leaders=5, max_followers=5)
+        self.staff = User.objects.create(username='staff', is_staff=True)
+        for name, role in (('cy', 'F'), ('ana', 'L')):
+            user = User.objects.create(username=name, first_name=name.title(), email=f'{name}@example.com')
+            ParticipantProfile.objects.create(user=user, role=role, approved=True)
+            Registration.objects.create(user=user, event_instance=self.instance, role=role)
+        other = make_instance(max_followers=5)
+        Registration.objects.create(user=self.staff, event_instance=other, role='F')
+
+    def lines(self, response):
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_instance_roster_is_streamed(self):
+        self.client.force_login(self.staff)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('export-registrations'), {'instance': self.instance.pk})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        # The rows are read while the response is sent, not by the view
+        self.assertFalse([query for query in queries.captured_queries if 'events_registration' in query['sql']])
+
+        lines = self.lines(response)
+        self.assertEqual(lines[0], 'event,date,instance,status,username,first_name,last_name,email,role,profile_role,approved')
+        self.assertEqual([line.split(',')[4] for line in lines[1:]], ['ana', 'cy'])
+        self.assertEqual(lines[1].split(',')[7:], ['ana@example.com', 'Leader', 'Leader', 'True'])
+
+    def test_whole_term_and_filters(self):
+        self.client.force_login(self.staff)
+        url = reverse('export-registrations')
+        self.assertEqual(len(self.lines(self.client.get(url))), 4)
+        self.assertEqual(len(self.lines(self.client.get(url, {'event': self.instance.event_id}))), 3)
+        self.assertEqual(self.client.get(url, {'from': 'soon'}).status_code, 400)
+
+    def test_staff_only(self):
+        self.client.force_login(User.objects.get(username='ana'))
+        self.assertEqual(self.client.get(reverse('export-registrations')).status_code, 403)
+
+    def test_admin_action(self):
+        self.client.force_login(User.objects.create(username='admin', is_staff=True, is_superuser=True))
+        response = self.client.post(reverse('admin:events_eventinstance_changelist'), {
+            'action': 'export_registrations', '_selected_action': [self.instance.pk],
+        })
+        self.assertEqual(len(self.lines(response)), 3)
+
+    async def test_streamed_asynchronously_under_asgi(self):
+        with async_views():
+            client = AsyncClient()
+            await client.aforce_login(self.staff)
+            response = await client.get(reverse('export-registrations'), {'event': self.instance.event_id})
+            lines = b''.join([line async for line in response.streaming_content]).decode().splitlines()
+        self.assertEqual([line.split(',')[4] for line in lines[1:]], ['ana', 'cy'])
+
+    async def test_async_chunks_continue_after_the_last_row(self):
+        def sync_export():
+            undated = make_instance(max_leaders=5, date=None)
+            Registration.objects.create(user=self.staff, event_instance=undated, role='L')
+            self.client.force_login(self.staff)
+            return self.lines(self.client.get(reverse('export-registrations')))
+
+        expected = await sync_to_async(sync_export)()
+        with async_views(), mock.patch('events.export.EXPORT_CHUNK_SIZE', 1):
+            client = AsyncClient()
+            await client.aforce_login(self.staff)
+            response = await client.get(reverse('export-registrations'))
+            lines = b''.join([line async for line in response.streaming_content]).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines, expected)
+
+
+class RecurrenceTests(TestCase):
+    today = date(2030, 1, 1)  # a Tuesday
+
+    def make_event(self, **kwargs):
+        kwargs.setdefault('recurrence', 'w')
+        kwargs.setdefault('recurrence_start', date(2029, 12, 3))  # a Monday
+        return Event.objects.create(title='Weekly salsa', summary='', **kwargs)
+
+    def dates(self, event):
+        return list(event.eventinstance_set.order_by('date').values_list('date', flat=True))
+
+    def test_weekly_instances_within_the_horizon(self):
+        event = self.make_event()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(generate_instances(today=self.today, horizon_days=21), 3)
+        self.assertEqual(self.dates(event), [date(2030, 1, 7), date(2030, 1, 14), date(2030, 1, 21)])
+        event.refresh_from_db()
+        self.assertEqual(event.recurrence_until, date(2030, 1, 22))
+        self.assertEqual(event.version, 2)
+
+    def test_reruns_are_idempotent_and_roll_forward(self):
+        event = self.make_event()
+        generate_instances(today=self.today, horizon_days=14)
+        event.eventinstance_set.filter(date=date(2030, 1, 7)).delete()
+        self.assertEqual(generate_instances(today=self.today, horizon_days=14), 0)
+        # A week later one more date enters the horizon; the deleted one stays deleted
+        # Savepoint, events, their existing dates, insert, recurrence_until, release
+        with self.assertNumQueries(6):
+            self.assertEqual(generate_instances(today=self.today + timedelta(days=7), horizon_days=14), 1)
+        self.assertEqual(self.dates(event), [date(2030, 1, 14), date(2030, 1, 21)])
+
+    def test_existing_instances_are_not_duplicated(self):
+        event = self.make_event()
+        EventInstance.objects.create(event=event, date=date(2030, 1, 7))
+        generate_instances(today=self.today, horizon_days=7)
+        self.assertEqual(self.dates(event), [date(2030, 1, 7)])
+
+    def test_every_other_week_with_exceptions_and_end(self):
+        event = self.make_event(
+            recurrence='b', recurrence_end=date(2030, 2, 28), recurrence_exceptions='2030-01-28\n',
+        )
+        self.make_event(recurrence='')
+        generate_instances(today=self.today, horizon_days=365)
+        self.assertEqual(self.dates(event), [date(2030, 1, 14), date(2030, 2, 11), date(2030, 2, 25)])
+        self.assertEqual(EventInstance.objects.count(), 3)
+
+    def test_rule_validation(self):
+        with self.assertRaises(ValidationError):
+            Event(title='x', recurrence='w').clean()
+        with self.assertRaises(ValidationError):
+            Event(title='x', recurrence='w', recurrence_start=self.today, recurrence_exceptions='soon').clean()
+
+    def test_command(self):
+        self.make_event(recurrence_start=date.today())
+        out = StringIO()
+        call_command('generate_instances', horizon=6, stdout=out)
+        self.assertIn('Created 1 instance(s).', out.getvalue())
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.today = date.today()
+        self.old = make_instance(max_leaders=5, max_followers=5, date=self.today - timedelta(days=60))
+        self.recent = EventInstance.objects.create(event=self.old.event, date=self.today - timedelta(days=5))
+        self.undated = EventInstance.objects.create(event=self.old.event, date=None)
+        self.users = [User.objects.create(username=name) for name in ('ana', 'ben', 'cy')]
+        for user, role in zip(self.users, 'LF'):
+            Registration.objects.create(user=user, event_instance=self.old, role=role)
+        WaitlistEntry.objects.create(user=self.users[2], event_instance=self.old, role='L')
+        Registration.objects.create(user=self.users[0], event_instance=self.recent, role='L')
+
+    def test_past_instances_move_to_the_archive(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            moved = archive_past_instances(self.today - timedelta(days=30))
+        self.assertEqual(moved, {'instances': 1, 'registrations': 2})
+        self.assertEqual(set(EventInstance.objects.values_list('pk', flat=True)), {self.recent.pk, self.undated.pk})
+        self.assertEqual(Registration.objects.get().event_instance, self.recent)
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+        archived = ArchivedEventInstance.objects.get()
+        self.assertEqual((archived.pk, archived.event_title, archived.date), (self.old.pk, 'Salsa basics', self.old.date))
+        self.assertEqual((archived.num_leaders, archived.num_followers, archived.num_registered), (1, 1, 2))
+        self.assertEqual(
+            sorted(archived.registrations.values_list('username', 'role')), [('ana', 'L'), ('ben', 'F')],
+        )
+        self.recent.refresh_from_db()
+        self.assertEqual(self.recent.num_leaders, 1)
+        self.assertEqual(Event.objects.get().version, 2)
+
+    def test_every_relation_to_archived_rows_is_deleted(self):
+        self.assertEqual(unhandled_relations(), [])
+        with mock.patch('events.archive.ARCHIVE_DELETES', ARCHIVE_DELETES[1:]):
+            with self.assertRaisesMessage(ImproperlyConfigured, 'events.Registration.event_instance'):
+                archive_past_instances(self.today - timedelta(days=30))
+        self.assertTrue(EventInstance.objects.filter(pk=self.old.pk).exists())
+
+    def test_batches(self):
+        for days in (40, 50, 70):
+            EventInstance.objects.create(event=self.old.event, date=self.today - timedelta(days=days))
+        moved = archive_past_instances(self.today - timedelta(days=30), batch_size=2)
+        self.assertEqual(moved['instances'], 4)
+        self.assertEqual(EventInstance.objects.count(), 2)
+
+    def test_history_view_lists_own_archived_registrations(self):
+        archive_past_instances(self.today - timedelta(days=30))
+        self.client.force_login(self.users[0])
+        response = self.client.get(reverse('my-history'))
+        self.assertEqual([reg.username for reg in response.context['archivedregistration_list']], ['ana'])
+        self.assertContains(response, 'Salsa basics')
+
+    def test_command(self):
+        out = StringIO()
+        call_command('archive_past_instances', dry_run=True, stdout=out)
+        self.assertIn('Would archive 1 instance(s) and 2 registration(s)', out.getvalue())
+        call_command('archive_past_instances', before=str(self.today), stdout=out)
+        self.assertIn('Archived 2 instance(s) and 3 registration(s)', out.getvalue())
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.instance = make_instance(max_leaders=3, max_followers=3)
+        self.event = self.instance.event
+        self.event_type = EventType.objects.create(name='Salsa')
+        self.event.type.add(self.event_type)
+        self.url = reverse('Event-detail', args=[self.event.pk])
+        self.user = User.objects.create(username='dancer')
+
+    def get(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        type_queries = [query for query in queries.captured_queries if 'events_eventtype' in query['sql']]
+        return response.content.decode(), type_queries
+
+    def test_registration_rerenders_only_its_instance(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_seat(self.user, self.instance, 'L')
+        content, type_queries = self.get()
+        self.assertIn('<span data-count="leaders">1</span> / 3', content)
+        # The header, with its type list, came from the cache
+        self.assertEqual(type_queries, [])
+        self.assertIn('<strong>Type:</strong> Salsa', content)
+
+    def test_type_rename_and_capacity_change_show_at_once(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.event_type.name = 'Cuban salsa'
+            self.event_type.save()
+        content, type_queries = self.get()
+        self.assertIn('<strong>Type:</strong> Cuban salsa', content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.event.max_leaders = 4
+            self.event.save()
+        self.assertIn('<span data-count="leaders">0</span> / 4', self.get()[0])
+
+    def test_user_specific_parts_are_rendered_per_request(self):
+        other = User.objects.create(username='other')
+        Registration.objects.create(user=self.user, event_instance=self.instance, role='L')
+        self.client.force_login(self.user)
+        self.assertIn('You are registered', self.get()[0])
+        self.client.force_login(other)
+        content = self.get()[0]
+        self.assertNotIn('You are registered', content)
+        self.assertIn('Register</button>', content)
+
+
+class CacheBackendTests(TestCase):
+    def backends(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        locations = {'locmem': 'cache-tests', 'file': directory, 'db': 'cache_tests'}
+        backends = {name: {**settings.CACHE_BACKENDS[name], 'LOCATION': location} for name, location in locations.items()}
+        self.enterContext(override_settings(CACHES={'default': settings.CACHES['default'], **backends}))
+        call_command('createcachetable', verbosity=0)
+        return [caches[name] for name in backends]
+
+    def test_hits_and_misses_are_counted_once(self):
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__):
+                backend.stats.reset()
+                backend.set('a', 1)
+                self.assertEqual(backend.get('a'), 1)
+                self.assertIsNone(backend.get('b'))
+                self.assertEqual(backend.get_many(['a', 'b', 'c']), {'a': 1})
+                self.assertEqual(backend.get_or_set('d', 4), 4)
+                self.assertEqual(backend.stats.snapshot(), {'hits': 2, 'misses': 4, 'hit_rate': 0.333})
+
+    def test_keys(self):
+        self.assertEqual(cache_key('home-statistics'), 'events:home-statistics')
+
+
+class ApprovalTests(TestCase):
+    def make_users(self, prefix, count):
+        users = User.objects.bulk_create(User(username=f'{prefix}{i}') for i in range(count))
+        # A third without a profile, a third unapproved, a third approved
+        ParticipantProfile.objects.bulk_create(
+            ParticipantProfile(user=user, approved=i % 3 == 2) for i, user in enumerate(users) if i % 3
+        )
+        return User.objects.filter(username__startswith=prefix)
+
+    def test_constant_queries_and_accurate_count(self):
+        for prefix, count in (('small', 6), ('large', 600)):
+            users = self.make_users(prefix, count)
+            # Savepoint, users without a profile, insert, update, release
+            with self.assertNumQueries(5):
+                approved = ParticipantProfile.approve(users)
+            self.assertEqual(approved, count * 2 // 3)
+            self.assertFalse(ParticipantProfile.objects.filter(user__in=users, approved=False).exists())
+            self.assertEqual(ParticipantProfile.objects.filter(user__in=users).count(), count)
+        self.assertEqual(ParticipantProfile.approve(User.objects.all()), 0)
+
+    def test_admin_actions(self):
+        self.client.force_login(User.objects.create(username='admin', is_staff=True, is_superuser=True))
+        users = self.make_users('dancer', 6)
+        response = self.client.post(reverse('admin:auth_user_changelist'), {
+            'action': 'approve_users', '_selected_action': list(users.values_list('pk', flat=True)),
+        }, follow=True)
+        self.assertContains(response, 'Approved 4 user(s).')
+
+        profile = ParticipantProfile.objects.create(user=User.objects.create(username='late'))
+        response = self.client.post(reverse('admin:events_participantprofile_changelist'), {
+            'action': 'approve_profiles', '_selected_action': [profile.pk],
+        }, follow=True)
+        self.assertContains(response, 'Approved 1 user(s).')
+
+    def test_unapproved_users_view(self):
+        self.client.force_login(User.objects.create(username='staff', is_staff=True))
+        self.make_users('dancer', 6)
+        first, second = ParticipantProfile.objects.filter(approved=False)
+        self.client.post(reverse('unapproved-users'), {'ids': [first.pk]})
+        self.assertEqual(list(ParticipantProfile.objects.filter(approved=False)), [second])
+        response = self.client.post(reverse('unapproved-users'), {'approve_all': '1'}, follow=True)
+        self.assertContains(response, 'Approved 1 user(s).')
+
+
+class ProfileBackendTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='dancer')
+        self.profile = ParticipantProfile.objects.create(user=self.user, role='L')
+        self.client.force_login(self.user)
+
+    def get_my_events(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('my-events'))
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def test_profile_is_loaded_with_the_user(self):
+        response, queries = self.get_my_events()
+        self.assertTrue(response.context['approval_pending'])
+        user_queries = [sql for sql in queries if 'FROM "auth_user"' in sql]
+        self.assertEqual(len(user_queries), 1)
+        self.assertIn('events_participantprofile', user_queries[0])
+        self.assertFalse([sql for sql in queries if sql.startswith('SELECT') and 'FROM "events_participantprofile"' in sql])
+
+    @override_settings(AUTH_USER_CACHE_TIMEOUT=60)
+    def test_cached_user_is_dropped_when_the_profile_changes(self):
+        self.get_my_events()
+        response, queries = self.get_my_events()
+        self.assertFalse([sql for sql in queries if 'FROM "auth_user"' in sql])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ParticipantProfile.approve(User.objects.filter(pk=self.user.pk))
+        self.assertFalse(self.get_my_events()[0].context['approval_pending'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.delete()
+        self.assertTrue(self.get_my_events()[0].context['approval_pending'])
+
+    @override_settings(AUTH_USER_CACHE_TIMEOUT=60)
+    def test_async_lookup(self):
+        backend = ProfileModelBackend()
+        user = async_to_sync(backend.aget_user)(self.user.pk)
+        self.assertEqual(user.profile.role, 'L')
+        with self.assertNumQueries(0):
+            self.assertEqual(backend.get_user(self.user.pk), user)
+
+
+class AnonymousTrafficTests(TestCase):
+    def test_anonymous_pages_write_nothing(self):
+        instance = make_instance()
+        urls = [reverse('index'), reverse('events'), reverse('Event-detail', args=[instance.event_id]), reverse('register')]
+        with CaptureQueriesContext(connection) as queries:
+            for url in urls:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual([q['sql'] for q in queries.captured_queries if not q['sql'].startswith('SELECT')], [])
+
+    def test_register_with_signed_captcha(self):
+        response = self.client.get(reverse('register'))
+        a, b, token = (response.context[key] for key in ('captcha_a', 'captcha_b', 'captcha_token'))
+        self.assertNotIn(str(a + b), signing.loads(token, salt=CAPTCHA_SALT).values())
+        form = {'username': 'new', 'password1': 'pw', 'password2': 'pw', 'role': 'L', 'captcha_token': token}
+
+        response = self.client.post(reverse('register'), {**form, 'captcha_answer': a + b + 1})
+        self.assertIn('Captcha answer is incorrect', response.context['errors'])
+        response = self.client.post(reverse('register'), {**form, 'captcha_token': 'forged', 'captcha_answer': a + b})
+        self.assertIn('Captcha answer is incorrect', response.context['errors'])
+        response = self.client.post(reverse('register'), {**form, 'captcha_answer': a + b})
+        self.assertTrue(response.context['success'])
+        self.assertEqual(User.objects.get(username='new').profile.role, 'L')
+
+    def test_solved_captcha_cannot_be_replayed(self):
+        a, b, token = captcha_challenge()
+        form = {'password1': 'pw', 'password2': 'pw', 'role': 'L', 'captcha_token': token, 'captcha_answer': a + b}
+        response = self.client.post(reverse('register'), {**form, 'username': 'first'})
+        self.assertTrue(response.context['success'])
+        response = self.client.post(reverse('register'), {**form, 'username': 'second'})
+        self.assertIn('Captcha answer is incorrect', response.context['errors'])
+        self.assertFalse(User.objects.filter(username='second').exists())
+
+
+@override_settings(RATE_LIMITS={'register-eventinstance': (0.01, 2), 'register': (0.01, 1)}, RATE_LIMIT_ADDRESS_FACTOR=2)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        limiters['local'].reset()
+        cache.clear()
+        self.instance = make_instance()
+        self.url = reverse('register-eventinstance', args=[self.instance.pk])
+
+    def login(self, username):
+        self.client.force_login(User.objects.create(username=username))
+        return self.client
+
+    def test_empty_bucket_is_refused_without_queries(self):
+        self.login('first')
+        for role in 'LF':
+            self.assertEqual(self.client.post(self.url, {'role': role}).status_code, 302)
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, {'role': 'D'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '100')
+        # Other views and GETs are not limited
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_buckets_per_session_and_address(self):
+        for name in ('first', 'second'):
+            self.login(name)
+            self.assertEqual(self.client.post(self.url, {'role': 'L'}).status_code, 302)
+        self.assertEqual(self.client.post(self.url, {'role': 'L'}).status_code, 302)
+        self.assertEqual(self.client.post(self.url, {'role': 'L'}).status_code, 429)
+        # The sessions share an address, whose bucket holds 2 * 2 tokens
+        self.login('third')
+        self.assertEqual(self.client.post(self.url, {'role': 'L'}).status_code, 302)
+        self.assertEqual(self.client.post(self.url, {'role': 'L'}).status_code, 429)
+        self.login('fourth')
+        other_address = self.client.post(self.url, {'role': 'L'}, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(other_address.status_code, 302)
+
+    def test_rotating_cookies_hits_the_address_bucket(self):
+        statuses = []
+        for i in range(3):
+            self.client.cookies[settings.CSRF_COOKIE_NAME] = f'token{i}'
+            statuses.append(self.client.post(reverse('register'), {'username': f'bot{i}'}).status_code)
+        self.assertEqual(statuses, [200, 200, 429])
+
+    @override_settings(RATE_LIMIT_BACKEND='cache')
+    def test_cache_backend(self):
+        self.login('first')
+        statuses = [self.client.post(self.url, {'role': 'L'}).status_code for i in range(3)]
+        self.assertEqual(statuses, [302, 302, 429])
+        self.assertEqual(limiters['local'].buckets, {})
+
+
+class AdmissionTests(TestCase):
+    def test_queue_is_bounded(self):
+        queue = AdmissionQueue()
+        with queue.admit('a', concurrency=1, queue=0, timeout=0):
+            with self.assertRaises(AdmissionRefused):
+                with queue.admit('a', concurrency=1, queue=0, timeout=0):
+                    pass
+            with queue.admit('b', concurrency=1, queue=0, timeout=0):
+                pass
+        with queue.admit('a', concurrency=1, queue=0, timeout=0):
+            pass
+        self.assertEqual(queue.slots, {})
+
+    def test_waiter_is_admitted_when_a_slot_frees(self):
+        queue = AdmissionQueue()
+        admitted = threading.Event()
+
+        def wait_for_turn():
+            with queue.admit('a', concurrency=1, queue=1, timeout=5):
+                admitted.set()
+
+        with queue.admit('a', concurrency=1, queue=1, timeout=0):
+            waiter = threading.Thread(target=wait_for_turn)
+            waiter.start()
+            self.assertFalse(admitted.wait(0.05))
+        waiter.join()
+        self.assertTrue(admitted.is_set())
+
+    @override_settings(RATE_LIMITS={}, ADMISSION_CONCURRENCY=1, ADMISSION_QUEUE=0)
+    def test_busy_instance_is_refused(self):
+        instance = make_instance()
+        self.client.force_login(User.objects.create(username='dancer'))
+        with admission(instance):
+            response = self.client.post(reverse('register-eventinstance', args=[instance.pk]), {'role': 'L'})
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(Registration.objects.exists())
+
+
+# Cheap parameters, so that the tests do not spend seconds hashing
+@override_settings(PASSWORD_SCRYPT_WORK_FACTOR=2 ** 8, PASSWORD_SCRYPT_PARALLELISM=1, PASSWORD_PBKDF2_ITERATIONS=1000)
+class SignupTests(TransactionTestCase):
+    def signup_form(self):
+        a, b, token = captcha_challenge()
+        return {
+            'username': 'newcomer', 'password1': 'secret', 'password2': 'secret', 'role': 'D',
+            'captcha_token': token, 'captcha_answer': a + b,
+        }
+
+    def test_signup_hashes_with_the_configured_hasher(self):
+        response = self.client.post(reverse('register'), self.signup_form())
+        self.assertTrue(response.context['success'])
+        user = User.objects.select_related('profile').get(username='newcomer')
+        self.assertEqual((user.profile.role, user.profile.approved), ('D', False))
+        self.assertTrue(user.check_password('secret'))
+        self.assertEqual(identify_hasher(user.password).algorithm, get_hasher().algorithm)
+        self.assertEqual(get_hasher().decode(user.password)['work_factor'], 2 ** 8)
+
+    @override_settings(PASSWORD_HASHERS=['events.hashers.PBKDF2PasswordHasher'])
+    def test_hasher_parameters_come_from_settings(self):
+        encoded = get_hasher().encode('secret', 'salt')
+        self.assertEqual(get_hasher().decode(encoded)['iterations'], 1000)
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertTrue(get_hasher().must_update(encoded))
+
+    def test_user_and_profile_are_created_together(self):
+        with self.assertRaises(IntegrityError):
+            create_participant('newcomer', '', 'hash', None)
+        self.assertFalse(User.objects.exists())
+        create_participant('newcomer', '', 'hash', 'L')
+        with self.assertRaisesMessage(SignupRefused, 'Username already exists'):
+            create_participant('newcomer', '', 'hash', 'F')
+        self.assertEqual(ParticipantProfile.objects.count(), 1)
+
+    def test_async_signup(self):
+        with async_views():
+            response = async_to_sync(AsyncClient().post)(reverse('register'), self.signup_form())
+        self.assertTrue(response.context['success'])
+        self.assertTrue(User.objects.get(username='newcomer').check_password('secret'))
+        self.assertTrue(ParticipantProfile.objects.filter(user__username='newcomer').exists())
+
+
+@override_settings(RATE_LIMITS={}, ADMISSION_CONCURRENCY=1, ADMISSION_QUEUE=20, ADMISSION_TIMEOUT=10)
+class AsyncAdmissionTests(TransactionTestCase):
+    def setUp(self):
+        self.enterContext(async_views())
+
+    async def post_register(self, username, instance):
+        client = AsyncClient()
+        await client.aforce_login(await User.objects.acreate(username=username))
+        return await client.post(reverse('register-eventinstance', args=[instance.pk]), {'role': 'L'})
+
+    async def test_waiters_do_not_hold_database_threads(self):
+        busy, quiet = [await sync_to_async(make_instance)(max_leaders=20) for _ in range(2)]
+        async with aadmission(busy):
+            # More waiters than the database pool has threads
+            waiters = [
+                asyncio.ensure_future(self.post_register(f'waiter{i}', busy))
+                for i in range(settings.ASYNC_DB_WORKERS + 2)
+            ]
+            await asyncio.sleep(0.1)
+            response = await asyncio.wait_for(self.post_register('elsewhere', quiet), 5)
+            self.assertEqual(response.status_code, 302)
+            self.assertFalse(any(waiter.done() for waiter in waiters))
+        responses = await asyncio.gather(*waiters)
+        self.assertEqual({response.status_code for response in responses}, {302})
+        self.assertEqual(await busy.registrations.acount(), settings.ASYNC_DB_WORKERS + 2)
+        self.assertEqual(async_admission_queue.slots, {})
+
+    @override_settings(ADMISSION_QUEUE=0)
+    async def test_busy_instance_is_refused(self):
+        instance = await sync_to_async(make_instance)()
+        async with aadmission(instance):
+            response = await self.post_register('dancer', instance)
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(await Registration.objects.aexists())
+
+    @override_settings(RATE_LIMITS={'register-eventinstance': (0.01, 1)}, RATE_LIMIT_BACKEND='cache')
+    async def test_rate_limit_in_async_mode(self):
+        await sync_to_async(cache.clear)()
+        instance = await sync_to_async(make_instance)()
+        client = AsyncClient()
+        await client.aforce_login(await User.objects.acreate(username='dancer'))
+        url = reverse('register-eventinstance', args=[instance.pk])
+        statuses = [(await client.post(url, {'role': 'L'})).status_code for i in range(2)]
+        self.assertEqual(statuses, [302, 429])
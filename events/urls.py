@@ -1,18 +1,42 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, views
+
+if settings.ASYNC_VIEWS:
+    event_detail = views.AsyncEventDetailView.as_view()
+    register_eventinstance, cancel_eventinstance = views.aregister_eventinstance, views.acancel_eventinstance
+    register = views.aregister
+else:
+    event_detail = views.EventDetailView.as_view()
+    register_eventinstance, cancel_eventinstance = views.register_eventinstance, views.cancel_eventinstance
+    register = views.register
 
 urlpatterns = [
     path('', views.index, name='index'),
     path('events/', views.EventListView.as_view(), name='events'),
-    path('events/<int:pk>', views.EventDetailView.as_view(), name='Event-detail'),
+    path('events/<int:pk>', event_detail, name='Event-detail'),
     path('contacts/', views.ContactListView.as_view(), name='contacts'),
     path('contacts/<int:pk>', views.ContactDetailView.as_view(), name='Contact-detail'),
 ]
 
+if settings.ASYNC_VIEWS:
+    # The stream never ends: a WSGI worker would collect it into a list and hang for good
+    urlpatterns += [
+        path('events/<int:pk>/seats', views.event_seat_stream, name='event-seats'),
+    ]
+
 urlpatterns += [
     path('myevents/', views.EventsByUserListView.as_view(), name='my-events'),
-    path('eventinstances/<uuid:pk>/register/', views.register_eventinstance, name='register-eventinstance'),
-    path('eventinstances/<uuid:pk>/cancel/', views.cancel_eventinstance, name='cancel-eventinstance'),
-    path('accounts/register/', views.register, name='register'),
+    path('myevents/history/', views.ArchivedRegistrationsByUserListView.as_view(), name='my-history'),
+    path('eventinstances/<uuid:pk>/register/', register_eventinstance, name='register-eventinstance'),
+    path('eventinstances/<uuid:pk>/cancel/', cancel_eventinstance, name='cancel-eventinstance'),
+    path('accounts/register/', register, name='register'),
     path('staff/unapproved-users/', views.UnapprovedUsersView.as_view(), name='unapproved-users'),
+    path('staff/registrations.csv', views.export_registrations, name='export-registrations'),
+]
+
+urlpatterns += [
+    path('api/events/', api.event_list, name='api-events'),
+    path('api/events/<int:pk>', api.event_detail, name='api-event-detail'),
+    path('api/my-registrations/', api.my_registrations, name='api-my-registrations'),
 ]
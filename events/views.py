@@ -1,77 +1,186 @@
-from django.shortcuts import render, get_object_or_404, redirect
-
-from .models import Event, Contact, EventInstance, EventType, Registration, ParticipantProfile
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
+
+from .models import ArchivedRegistration, Event, Contact, EventInstance, EventType, Registration, ParticipantProfile, WaitlistEntry
+from .capacity import (
+    CapacityReached, RegistrationRefused, available_roles, join_waitlist, release_seat, reserve_seat, role_choices,
+)
+from .asyncdb import database_sync_to_async
+from .broadcast import SEAT_FIELDS, seat_broadcaster, seat_counts, seat_message
+from .cache import cache_key
+from .export import roster_response
+from .pagination import KeysetPaginationMixin
+from .ratelimit import AdmissionRefused, aadmission, admission, too_many_requests
+from .signup import SignupRefused, ahash_password, create_participant
+from .stats import home_statistics
 
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseForbidden
+from django.conf import settings
+from django.http import HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.template.response import TemplateResponse
 from django.contrib import messages
+from django.core import signing
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare, get_random_string, salted_hmac
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from datetime import date
+import asyncio
 import random
+import uuid
+
+VISITS_SALT = 'events.index.num_visits'
+CAPTCHA_SALT = 'events.register.captcha'
+# Seconds a registration form's captcha stays valid
+CAPTCHA_MAX_AGE = 60 * 60
+VISITS_MAX_AGE = 365 * 24 * 60 * 60
+# Seconds between comment lines that keep an idle seat stream open through proxies
+SEAT_STREAM_KEEPALIVE = 15
+# Retry-After seconds of a registration refused because its instance is busy
+ADMISSION_RETRY_AFTER = 1
 
 def index(request):
     """View function for home page of site."""
 
-    # Generate counts of some of the main objects
-    num_events = Event.objects.all().count()
-    num_instances = EventInstance.objects.all().count()
-
-    num_visits = request.session.get('num_visits', 0)
-    num_visits += 1
-    request.session['num_visits'] = num_visits
-
-    # Available books (status = 'a')
-    num_instances_available = EventInstance.objects.filter(status__exact='n').count()
+    # Record counts are cached and invalidated by events.signals when the rows change
+    context = home_statistics()
 
-    num_contacts = Contact.objects.count()
-
-    context = {
-        'num_events': num_events,
-        'num_instances': num_instances,
-        'num_instances_available': num_instances_available,
-        'num_contacts': num_contacts,
-        'num_visits': num_visits,
-    }
+    # The visit counter lives in a signed cookie, so counting visits never writes the session
+    num_visits = request.get_signed_cookie('num_visits', default=0, salt=VISITS_SALT)
+    try:
+        num_visits = int(num_visits) + 1
+    except ValueError:
+        num_visits = 1
+    context['num_visits'] = num_visits
 
     # Render the HTML template index.html with the data in the context variable
-    return render(request, 'index.html', context=context)
+    response = render(request, 'index.html', context=context)
+    response.set_signed_cookie('num_visits', num_visits, salt=VISITS_SALT, max_age=VISITS_MAX_AGE, httponly=True)
+    return response
 
 from django.views import generic
 
-class EventListView(generic.ListView):
+class EventListView(KeysetPaginationMixin, generic.ListView):
     model = Event
     paginate_by = 10
+    keyset_ordering = ('id',)
+
+    def get_queryset(self):
+        return Event.objects.select_related('contact').order_by('pk')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['fragment_cache_timeout'] = settings.FRAGMENT_CACHE_TIMEOUT
+        return context
 
 class EventDetailView(generic.DetailView):
     model = Event
 
+    def get_queryset(self):
+        # The type list is only read when the cached header fragment is rendered again
+        return Event.objects.select_related('contact')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Only show event instances that are actually scheduled (have a date)
-        # Show scheduled instances (have a date) plus any instances the current user is registered to,
-        # even if they lack a date, so the user sees all their registrations for this event.
-        context['event_instances'] = (
-            EventInstance.objects.filter(event=self.object, date__isnull=False)
-            .order_by('date')
-        )
+        user = self.request.user
+        registered_ids = waitlist_entries = []
+        if user.is_authenticated:
+            registered_ids = list(self.registered_instance_ids(user))
+            waitlist_entries = list(self.waitlist_entries(user))
+        return self.add_seat_context(context, list(self.scheduled_instances()), registered_ids, waitlist_entries)
+
+    def scheduled_instances(self):
+        # Only show event instances that are actually scheduled (have a date).
+        # Seat counts are stored on each instance, so rendering them needs no further queries.
+        return EventInstance.objects.filter(event=self.object, date__isnull=False).order_by('date')
+
+    def registered_instance_ids(self, user):
+        return Registration.objects.filter(
+            user=user, event_instance__event=self.object
+        ).values_list('event_instance_id', flat=True)
+
+    def waitlist_entries(self, user):
+        return WaitlistEntry.objects.filter(user=user, event_instance__event=self.object)
+
+    def add_seat_context(self, context, instances, registered_ids, waitlist_entries):
+        for instance in instances:
+            # Every instance belongs to the event already loaded for this page
+            instance.event = self.object
+            instance.available_roles = available_roles(instance)
+            instance.role_choices = role_choices(instance)
+        context['event_instances'] = instances
         # Provide a list of instance IDs the current user has registered for, for template checks
-        reg_ids = []
-        if self.request.user.is_authenticated:
-            reg_ids = list(
-                Registration.objects.filter(
-                    user=self.request.user, event_instance__event=self.object
-                ).values_list('event_instance_id', flat=True)
-            )
-        context['registered_instance_ids'] = reg_ids
+        context['registered_instance_ids'] = registered_ids
+        # Waitlist places of the current user, by instance ID
+        waiting = {entry.event_instance_id: entry for entry in waitlist_entries}
+        for instance in instances:
+            instance.waitlist_entry = waiting.get(instance.id)
+        # Live seat counts need the async event_seat_stream view, served under ASGI
+        context['seat_stream'] = settings.ASYNC_VIEWS
+        context['fragment_cache_timeout'] = settings.FRAGMENT_CACHE_TIMEOUT
         return context
 
-class ContactListView(LoginRequiredMixin, UserPassesTestMixin, generic.ListView):
+class AsyncEventDetailView(EventDetailView):
+    """EventDetailView loading its data with the async ORM, used when ASYNC_VIEWS is on."""
+
+    async def get(self, request, *args, **kwargs):
+        self.object = await aget_object_or_404(self.get_queryset(), pk=kwargs['pk'])
+        user = await request.auser()
+        registered_ids = waitlist_entries = []
+        if user.is_authenticated:
+            registered_ids = [pk async for pk in self.registered_instance_ids(user)]
+            waitlist_entries = [entry async for entry in self.waitlist_entries(user)]
+        instances = [instance async for instance in self.scheduled_instances()]
+        # Skip EventDetailView.get_context_data, which would run the same queries synchronously
+        context = super(EventDetailView, self).get_context_data(object=self.object)
+        context = self.add_seat_context(context, instances, registered_ids, waitlist_entries)
+        return self.render_to_response(context)
+
+async def event_seat_stream(request, pk):
+    """Server-Sent Events stream of the seat counts of an event's scheduled instances.
+
+    Sends the current counts, then the counts of each instance whose registrations
+    change, as published by events.broadcast. Listening costs no queries per change.
+    """
+    event = await aget_object_or_404(Event, pk=pk)
+    instances = EventInstance.objects.filter(event=event, date__isnull=False).values('id', *SEAT_FIELDS.values())
+
+    async def stream():
+        # Subscribe before reading the current counts, so no change can fall in between
+        updates = seat_broadcaster.subscribe(event.pk)
+        try:
+            yield seat_message(seat_counts([instance async for instance in instances]))
+            while True:
+                try:
+                    seats = await asyncio.wait_for(updates.get(), SEAT_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                else:
+                    yield seat_message(seats)
+        finally:
+            # The client went away
+            seat_broadcaster.unsubscribe(event.pk, updates)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+class ContactListView(LoginRequiredMixin, UserPassesTestMixin, KeysetPaginationMixin, generic.ListView):
     model = Contact
     paginate_by = 10
+    keyset_ordering = ('last_name', 'first_name', 'id')
 
     def test_func(self):
         return self.request.user.is_staff
 
+    def get_queryset(self):
+        # The template lists each contact's events and their instances
+        return Contact.objects.prefetch_related('event_set__eventinstance_set')
+
 class ContactDetailView(LoginRequiredMixin, UserPassesTestMixin, generic.DetailView):
     model = Contact
 
@@ -79,10 +188,11 @@ class ContactDetailView(LoginRequiredMixin, UserPassesTestMixin, generic.DetailV
         return self.request.user.is_staff
 
 
-class UnapprovedUsersView(LoginRequiredMixin, UserPassesTestMixin, generic.ListView):
+class UnapprovedUsersView(LoginRequiredMixin, UserPassesTestMixin, KeysetPaginationMixin, generic.ListView):
     model = ParticipantProfile
     template_name = 'events/unapproved_users.html'
     paginate_by = 20
+    keyset_ordering = ('user__username', 'id')
 
     def test_func(self):
         return self.request.user.is_staff
@@ -99,24 +209,57 @@ class UnapprovedUsersView(LoginRequiredMixin, UserPassesTestMixin, generic.ListV
             return HttpResponseForbidden()
         ids = request.POST.getlist('ids')
         approve_all = request.POST.get('approve_all')
+        User = get_user_model()
         if approve_all:
-            updated = ParticipantProfile.objects.filter(approved=False).update(approved=True)
+            updated = ParticipantProfile.approve(User.objects.filter(profile__approved=False))
             messages.success(request, f'Approved {updated} user(s).')
         else:
             if ids:
-                updated = ParticipantProfile.objects.filter(id__in=ids, approved=False).update(approved=True)
+                updated = ParticipantProfile.approve(User.objects.filter(profile__in=ids))
                 messages.success(request, f'Approved {updated} selected user(s).')
             else:
                 messages.info(request, 'No users selected.')
         return redirect('unapproved-users')
 
 
-
-class EventsByUserListView(LoginRequiredMixin,generic.ListView):
+@login_required
+def export_registrations(request):
+    """Stream registrations as CSV for staff: ?instance=<uuid>, ?event=<pk> or ?from=&to= dates.
+
+    Without filters the export covers every registration.
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    registrations = Registration.objects.all()
+    filename = 'registrations'
+    try:
+        if request.GET.get('instance'):
+            instance = uuid.UUID(request.GET['instance'])
+            registrations = registrations.filter(event_instance=instance)
+            filename += f'-{instance}'
+        if request.GET.get('event'):
+            event = int(request.GET['event'])
+            registrations = registrations.filter(event_instance__event=event)
+            filename += f'-event-{event}'
+        if request.GET.get('from'):
+            registrations = registrations.filter(event_instance__date__gte=date.fromisoformat(request.GET['from']))
+            filename += f'-from-{request.GET["from"]}'
+        if request.GET.get('to'):
+            registrations = registrations.filter(event_instance__date__lte=date.fromisoformat(request.GET['to']))
+            filename += f'-to-{request.GET["to"]}'
+    except ValueError:
+        return HttpResponseBadRequest('instance must be a UUID, event a number and from/to YYYY-MM-DD dates.')
+    return roster_response(registrations, f'{filename}.csv')
+
+
+
+class EventsByUserListView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     """List Registrations for the current user."""
     model = Registration
     template_name = 'events/eventinstance_list_user.html'
     paginate_by = 10
+    # Undated instances sort last, so the key is never null
+    keyset_ordering = ('instance_date', 'id')
 
     def get_queryset(self):
         profile = getattr(self.request.user, 'profile', None)
@@ -125,6 +268,7 @@ class EventsByUserListView(LoginRequiredMixin,generic.ListView):
         return (
             Registration.objects.select_related('event_instance', 'event_instance__event')
             .filter(user=self.request.user, event_instance__status__exact='n')
+            .annotate(instance_date=Coalesce('event_instance__date', Value(date.max)))
             .order_by('event_instance__date')
         )
 
@@ -135,56 +279,93 @@ class EventsByUserListView(LoginRequiredMixin,generic.ListView):
         return context
 
 
+class ArchivedRegistrationsByUserListView(LoginRequiredMixin, generic.ListView):
+    """Read-only list of the current user's registrations to archived instances, newest first."""
+    model = ArchivedRegistration
+    template_name = 'events/archivedregistration_list_user.html'
+    paginate_by = 20
+
+    def get_queryset(self):
+        return (
+            ArchivedRegistration.objects.select_related('event_instance')
+            .filter(user=self.request.user)
+            .order_by('-event_instance__date', '-id')
+        )
+
+
 @login_required
 def register_eventinstance(request, pk):
     """Register the current user to a specific EventInstance with a role, respecting capacity."""
-    eventinst = get_object_or_404(EventInstance, pk=pk)
+    eventinst = get_object_or_404(EventInstance.objects.select_related('event'), pk=pk)
     if request.method != 'POST':
         return redirect('Event-detail', pk=eventinst.event.pk)
 
-    if eventinst.status != 'n' or eventinst.is_past:
-        return HttpResponseForbidden('Registration not allowed for this event instance.')
-
     role = request.POST.get('role')
     if role not in [Registration.Role.LEADER, Registration.Role.FOLLOWER, Registration.Role.DOUBLEROLE]:
         return HttpResponseForbidden('Invalid role')
 
-    # Prevent duplicate registration per instance
-    if Registration.objects.filter(user=request.user, event_instance=eventinst).exists():
+    try:
+        admitted_reserve_seat(request.user, eventinst, role)
+    except AdmissionRefused:
+        return too_many_requests(ADMISSION_RETRY_AFTER, 'Registration is busy, please try again shortly.')
+    except CapacityReached as refusal:
+        messages.info(request, waitlist(request.user, eventinst, role, refusal))
+    except RegistrationRefused as refusal:
+        return HttpResponseForbidden(str(refusal))
+
+    return redirect('Event-detail', pk=eventinst.event.pk)
+
+
+@login_required
+async def aregister_eventinstance(request, pk):
+    """Async register_eventinstance; the seat is reserved on the database thread pool."""
+    eventinst = await aget_object_or_404(EventInstance.objects.select_related('event'), pk=pk)
+    if request.method != 'POST':
         return redirect('Event-detail', pk=eventinst.event.pk)
 
-    leaders = eventinst.leaders_count()
-    followers = eventinst.followers_count()
-    total = eventinst.total_count()
-    maxL = eventinst.event.max_leaders
-    maxF = eventinst.event.max_followers
-    maxT = eventinst.event.max_participants
-
-    if role == Registration.Role.LEADER:
-        if maxL and leaders >= maxL:
-            return HttpResponseForbidden('Leader capacity reached')
-    elif role == Registration.Role.FOLLOWER:
-        if maxF and followers >= maxF:
-            return HttpResponseForbidden('Follower capacity reached')
-    elif role == Registration.Role.DOUBLEROLE:
-        # DoubleRole allowed if total capacity exists beyond sum of role caps
-        # i.e., if max_participants > (max_leaders + max_followers) and total < max_participants
-        if not maxT or maxT <= (maxL + maxF) or total >= maxT:
-            return HttpResponseForbidden('DoubleRole not available')
-
-    Registration.objects.create(user=request.user, event_instance=eventinst, role=role)
+    role = request.POST.get('role')
+    if role not in [Registration.Role.LEADER, Registration.Role.FOLLOWER, Registration.Role.DOUBLEROLE]:
+        return HttpResponseForbidden('Invalid role')
+
+    user = await request.auser()
+    try:
+        # Wait for a turn on the event loop; only the reservation itself takes a database thread
+        async with aadmission(eventinst):
+            await database_sync_to_async(reserve_seat)(user, eventinst, role)
+    except AdmissionRefused:
+        return too_many_requests(ADMISSION_RETRY_AFTER, 'Registration is busy, please try again shortly.')
+    except CapacityReached as refusal:
+        messages.info(request, await database_sync_to_async(waitlist)(user, eventinst, role, refusal))
+    except RegistrationRefused as refusal:
+        return HttpResponseForbidden(str(refusal))
 
     return redirect('Event-detail', pk=eventinst.event.pk)
 
 
+def admitted_reserve_seat(user, eventinst, role):
+    """reserve_seat once one of the instance's admission slots is free (events.ratelimit)."""
+    with admission(eventinst):
+        return reserve_seat(user, eventinst, role)
+
+
+def waitlist(user, eventinst, role, refusal):
+    """Put user on the waitlist of a full role and return the message telling them so."""
+    entry = join_waitlist(user, eventinst, role)
+    return (
+        f'{refusal}. You are number {entry.position()} on the {entry.get_role_display()} waitlist '
+        'and will be registered automatically when a seat frees up.'
+    )
+
+
 @login_required
 def cancel_eventinstance(request, pk):
-    """Cancel the current user's registration for a specific EventInstance."""
-    eventinst = get_object_or_404(EventInstance, pk=pk)
+    """Cancel the current user's registration or waitlist entry for a specific EventInstance."""
+    eventinst = get_object_or_404(EventInstance.objects.select_related('event'), pk=pk)
     if request.method != 'POST':
         return redirect('Event-detail', pk=eventinst.event.pk)
 
-    deleted, _ = Registration.objects.filter(user=request.user, event_instance=eventinst).delete()
+    # The freed seat goes to the first eligible waiter in the same transaction
+    release_seat(request.user, eventinst)
 
     next_url = request.GET.get('next')
     if next_url:
@@ -192,56 +373,136 @@ def cancel_eventinstance(request, pk):
     return redirect('my-events')
 
 
-def register(request):
-    """Simple registration with math captcha and staff approval workflow."""
-    User = get_user_model()
-    errors = []
-    success = False
+@login_required
+async def acancel_eventinstance(request, pk):
+    """Async cancel_eventinstance; the cancellation runs on the database thread pool."""
+    eventinst = await aget_object_or_404(EventInstance.objects.select_related('event'), pk=pk)
+    if request.method != 'POST':
+        return redirect('Event-detail', pk=eventinst.event.pk)
 
-    # Generate new captcha when missing or on GET
-    if request.method == 'GET' or 'captcha_a' not in request.session or 'captcha_b' not in request.session:
-        request.session['captcha_a'] = random.randint(1, 9)
-        request.session['captcha_b'] = random.randint(1, 9)
-    a = request.session['captcha_a']
-    b = request.session['captcha_b']
+    await database_sync_to_async(release_seat)(await request.auser(), eventinst)
 
-    if request.method == 'POST':
-        username = (request.POST.get('username') or '').strip()
-        email = (request.POST.get('email') or '').strip()
-        password1 = request.POST.get('password1') or ''
-        password2 = request.POST.get('password2') or ''
-        role = request.POST.get('role') or 'F'
-        ans = request.POST.get('captcha_answer') or ''
-
-        # Validate
-        if not username:
-            errors.append('Username is required')
-        elif User.objects.filter(username=username).exists():
-            errors.append('Username already exists')
-        if not password1:
-            errors.append('Password is required')
-        if password1 != password2:
-            errors.append('Passwords do not match')
-        try:
-            if int(ans) != (a + b):
-                errors.append('Captcha answer is incorrect')
-        except ValueError:
-            errors.append('Captcha answer is required')
-        if role not in [Registration.Role.LEADER, Registration.Role.FOLLOWER, Registration.Role.DOUBLEROLE]:
-            errors.append('Invalid role')
+    next_url = request.GET.get('next')
+    if next_url:
+        return redirect(next_url)
+    return redirect('my-events')
 
-        if not errors:
-            user = User.objects.create_user(username=username, email=email, password=password1)
-            from .models import ParticipantProfile
-            ParticipantProfile.objects.create(user=user, role=role, approved=False)
-            success = True
-            # Reset captcha for next time
-            request.session.pop('captcha_a', None)
-            request.session.pop('captcha_b', None)
-
-    return render(request, 'registration/register.html', {
+
+def captcha_challenge():
+    """A new captcha: the two numbers to add and a signed token to check the answer against.
+
+    The token carries a keyed hash of the answer rather than the answer, so the form
+    needs no session and the page does not give the answer away.
+    """
+    a, b = random.randint(1, 9), random.randint(1, 9)
+    nonce = get_random_string(12)
+    token = signing.dumps({'n': nonce, 'h': captcha_hash(nonce, a + b)}, salt=CAPTCHA_SALT)
+    return a, b, token
+
+
+def captcha_hash(nonce, answer):
+    return salted_hmac(CAPTCHA_SALT, f'{nonce}:{answer}').hexdigest()
+
+
+def captcha_solved(token, answer):
+    """Whether answer solves the captcha of token, which must be at most CAPTCHA_MAX_AGE seconds old.
+
+    A solved captcha is spent: its nonce is kept in the cache until the token expires,
+    and a token whose nonce is there already does not solve anything again.
+    """
+    try:
+        challenge = signing.loads(token, salt=CAPTCHA_SALT, max_age=CAPTCHA_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    if not constant_time_compare(challenge['h'], captcha_hash(challenge['n'], answer)):
+        return False
+    return cache.add(cache_key('captcha', challenge['n']), True, CAPTCHA_MAX_AGE)
+
+
+def signup_errors(post, username_taken):
+    """Validation errors of a signup form; username_taken tells whether its username exists."""
+    errors = []
+    if not post['username']:
+        errors.append('Username is required')
+    elif username_taken:
+        errors.append('Username already exists')
+    if not post['password1']:
+        errors.append('Password is required')
+    if post['password1'] != post['password2']:
+        errors.append('Passwords do not match')
+    try:
+        if not captcha_solved(post['captcha_token'], int(post['captcha_answer'])):
+            errors.append('Captcha answer is incorrect')
+    except ValueError:
+        errors.append('Captcha answer is required')
+    if post['role'] not in [Registration.Role.LEADER, Registration.Role.FOLLOWER, Registration.Role.DOUBLEROLE]:
+        errors.append('Invalid role')
+    return errors
+
+
+def signup_form(request):
+    post = {
+        name: request.POST.get(name) or ''
+        for name in ('email', 'password1', 'password2', 'captcha_token', 'captcha_answer')
+    }
+    post['username'] = (request.POST.get('username') or '').strip()
+    post['email'] = post['email'].strip()
+    post['role'] = request.POST.get('role') or 'F'
+    return post
+
+
+def register_page(request, errors, success):
+    # A new captcha for every form shown
+    a, b, token = captcha_challenge()
+    return TemplateResponse(request, 'registration/register.html', {
         'errors': errors,
         'success': success,
         'captcha_a': a,
         'captcha_b': b,
+        'captcha_token': token,
     })
+
+
+def register(request):
+    """Simple registration with math captcha and staff approval workflow."""
+    errors = []
+    success = False
+
+    if request.method == 'POST':
+        post = signup_form(request)
+        username_taken = bool(post['username']) and get_user_model().objects.filter(username=post['username']).exists()
+        errors = signup_errors(post, username_taken)
+        if not errors:
+            try:
+                # The user and profile are created in one transaction, after the slow hashing
+                create_participant(post['username'], post['email'], make_password(post['password1']), post['role'])
+                success = True
+            except SignupRefused as refusal:
+                errors.append(str(refusal))
+
+    return register_page(request, errors, success)
+
+
+async def aregister(request):
+    """Async register; the password is hashed on the hashing thread pool (events.signup)."""
+    errors = []
+    success = False
+
+    if request.method == 'POST':
+        post = signup_form(request)
+        username_taken = bool(post['username']) and await get_user_model().objects.filter(
+            username=post['username'],
+        ).aexists()
+        # The captcha check writes to the cache; the file and database caches block
+        errors = await database_sync_to_async(signup_errors)(post, username_taken)
+        if not errors:
+            encoded_password = await ahash_password(post['password1'])
+            try:
+                await database_sync_to_async(create_participant)(
+                    post['username'], post['email'], encoded_password, post['role'],
+                )
+                success = True
+            except SignupRefused as refusal:
+                errors.append(str(refusal))
+
+    return register_page(request, errors, success)
@@ -14,6 +14,7 @@ from pathlib import Path
 from dotenv import load_dotenv
 load_dotenv()
 
+import importlib.util
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that the queries of every other middleware are measured too
+    'events.middleware.RequestTimingMiddleware',
+    # Before the other middleware's process_view, so limited requests cost no more work
+    'events.ratelimit.RateLimitMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,12 +83,152 @@ WSGI_APPLICATION = 'registrations.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+SQLITE_DATABASE = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': BASE_DIR / 'db.sqlite3',
+    'OPTIONS': {
+        # Seconds a connection waits for a lock before raising "database is locked"
+        'timeout': int(os.getenv('SQLITE_TIMEOUT', 20)),
+        # Take the write lock when a transaction starts. A deferred transaction that
+        # reads first and writes later can fail instantly when another writer holds
+        # the lock, because SQLite cannot wait for it without risking a deadlock.
+        'transaction_mode': 'IMMEDIATE',
+        # Applied to every new connection. WAL lets readers carry on while one writer
+        # commits; synchronous=NORMAL is durable across application crashes in WAL mode.
+        'init_command': (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            f"PRAGMA cache_size=-{int(os.getenv('SQLITE_CACHE_KB', 20000))};"
+            f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_BYTES', 128 * 1024 * 1024))};"
+            'PRAGMA temp_store=MEMORY;'
+        ),
+    },
+    # Tests use a file database: in-memory SQLite cannot serve the concurrent
+    # connections opened by the registration concurrency tests.
+    'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+}
+
+# PostgreSQL is selected with DB_ENGINE=postgresql and configured from the POSTGRES_*
+# variables. Connections are kept open for DB_CONN_MAX_AGE seconds and checked before
+# reuse; DB_POOL=1 uses psycopg's connection pool instead (needs psycopg[pool]).
+POSTGRES_DATABASE = {
+    'ENGINE': 'django.db.backends.postgresql',
+    'NAME': os.getenv('POSTGRES_DB', 'registrations'),
+    'USER': os.getenv('POSTGRES_USER', ''),
+    'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+    'HOST': os.getenv('POSTGRES_HOST', ''),
+    'PORT': os.getenv('POSTGRES_PORT', ''),
+    'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+    'CONN_HEALTH_CHECKS': True,
+    'OPTIONS': {},
+    'TEST': {'NAME': os.getenv('POSTGRES_TEST_DB', 'test_registrations')},
+}
+if os.getenv('DB_POOL') == '1':
+    # Pooled connections are returned to the pool after each request, so persistent
+    # connections must be off.
+    POSTGRES_DATABASE['CONN_MAX_AGE'] = 0
+    POSTGRES_DATABASE['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+        'timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+    }
+
 DATABASES = {
+    'default': POSTGRES_DATABASE if os.getenv('DB_ENGINE') == 'postgresql' else SQLITE_DATABASE,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+#
+# CACHE_BACKEND picks one of these; all count their hits and misses (events.cache).
+# locmem is private to each process, so deployments running several processes should
+# use file (a directory on a disk they share) or db (a table in the database, created
+# with `manage.py createcachetable`).
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'events.cache.LocMemCache',
+        'LOCATION': 'registrations',
+    },
+    'file': {
+        'BACKEND': 'events.cache.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / 'cache')),
+    },
+    'db': {
+        'BACKEND': 'events.cache.DatabaseCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', 'registrations_cache'),
+    },
+}
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        **CACHE_BACKENDS[os.getenv('CACHE_BACKEND', 'locmem')],
+        'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', 300)),
+        'KEY_PREFIX': os.getenv('CACHE_KEY_PREFIX', ''),
+        'OPTIONS': {
+            # Past this many entries a third of them is evicted
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 5000)),
+            'CULL_FREQUENCY': 3,
+        },
+    },
+}
+
+
+# Sessions
+# SESSION_BACKEND=cached_db (default) reads sessions through the cache and writes them to
+# the database; cache keeps them in the cache only (use a shared, persistent one);
+# signed_cookies keeps them in the browser, with no server storage at all, but a logout
+# cannot revoke a copied cookie. Anonymous pages do not create sessions with any of them.
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[os.getenv('SESSION_BACKEND', 'cached_db')]
+
+# events.backends.ProfileModelBackend loads the user's profile with the user. ModelBackend
+# stays listed so that sessions logged in before it was added remain valid.
+AUTHENTICATION_BACKENDS = [
+    'events.backends.ProfileModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Seconds ProfileModelBackend caches the logged-in user and profile (0: not cached).
+# Changes to either drop the cached copy at once.
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv('AUTH_USER_CACHE_TIMEOUT', 0))
+
+
+# Hasher of new passwords: argon2 (needs argon2-cffi), scrypt or pbkdf2 (Django's own
+# default). Defaults to argon2 when installed, else scrypt. Passwords stored with any of
+# them still verify, and are rehashed with this one at the next login.
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER') or ('argon2' if importlib.util.find_spec('argon2') else 'scrypt')
+PASSWORD_HASHER_CLASSES = {
+    'argon2': 'events.hashers.Argon2PasswordHasher',
+    'scrypt': 'events.hashers.ScryptPasswordHasher',
+    'pbkdf2': 'events.hashers.PBKDF2PasswordHasher',
 }
+PASSWORD_HASHERS = [
+    PASSWORD_HASHER_CLASSES[PASSWORD_HASHER],
+    *(path for name, path in PASSWORD_HASHER_CLASSES.items() if name != PASSWORD_HASHER),
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+
+def optional_int(name):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+# Cost parameters of the hashers in events.hashers; unset keeps Django's defaults. Compare
+# them with `python manage.py benchmark signup`.
+PASSWORD_PBKDF2_ITERATIONS = optional_int('PASSWORD_PBKDF2_ITERATIONS')
+PASSWORD_SCRYPT_WORK_FACTOR = optional_int('PASSWORD_SCRYPT_WORK_FACTOR')
+PASSWORD_SCRYPT_PARALLELISM = optional_int('PASSWORD_SCRYPT_PARALLELISM')
+PASSWORD_ARGON2_TIME_COST = optional_int('PASSWORD_ARGON2_TIME_COST')
+PASSWORD_ARGON2_MEMORY_COST = optional_int('PASSWORD_ARGON2_MEMORY_COST')
+
+# Threads that hash the passwords of async signups (events.signup), and so the most
+# hashes that run at once in a process
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
 
 
 # Password validation
@@ -129,5 +274,85 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Maximum number of SQL queries per request, by URL name. RequestTimingMiddleware logs a
+# warning when a view goes over its budget and the test suite fails on it.
+QUERY_BUDGETS = {
+    'index': 6,
+    'events': 4,
+    'Event-detail': 8,
+    'my-events': 5,
+    'contacts': 6,
+    'register-eventinstance': 8,
+    'cancel-eventinstance': 10,
+    'unapproved-users': 5,
+    'api-events': 3,
+    'api-event-detail': 4,
+    'api-my-registrations': 5,
+}
+
+# Serve registration, cancellation and event detail with async views. registrations.asgi
+# turns this on; under WSGI the sync views are used.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS') == '1'
+
+# Threads the async views run their registration transactions on (events.asyncdb).
+# Each thread keeps its own database connection.
+ASYNC_DB_WORKERS = int(os.getenv('ASYNC_DB_WORKERS', 8))
+
+# Paginate every list view with cursors instead of page numbers (no COUNT, no OFFSET).
+# Without it, keyset pagination is used only for requests that carry a ?cursor= parameter.
+KEYSET_PAGINATION = os.getenv('KEYSET_PAGINATION') == '1'
+
+# Seconds the home page record counts stay cached; saves and deletes also expire them
+HOME_STATISTICS_TIMEOUT = int(os.getenv('HOME_STATISTICS_TIMEOUT', 300))
+
+# Seconds the shared fragments of the event pages stay cached. Their keys carry the
+# event and instance version stamps, so changes show at once whatever the timeout.
+FRAGMENT_CACHE_TIMEOUT = int(os.getenv('FRAGMENT_CACHE_TIMEOUT', 24 * 60 * 60))
+
+# Days ahead of today that events.recurrence creates the instances of recurring events
+RECURRENCE_HORIZON_DAYS = int(os.getenv('RECURRENCE_HORIZON_DAYS', 56))
+
+# Instances older than this many days move to the archive tables (archive_past_instances)
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 30))
+
+# Token buckets of events.ratelimit.RateLimitMiddleware by URL name: (tokens added per
+# second, bucket size). Each POST takes a token from its client's bucket (session, else
+# CSRF cookie, else address) and from its address's bucket, which is
+# RATE_LIMIT_ADDRESS_FACTOR times as large; an empty bucket gets a 429 response.
+RATE_LIMITS = {
+    'register-eventinstance': (1, 10),
+    'register': (0.1, 5),
+}
+RATE_LIMIT_ADDRESS_FACTOR = int(os.getenv('RATE_LIMIT_ADDRESS_FACTOR', 10))
+# local keeps the buckets per process; cache keeps them in the default cache, which the
+# workers share with CACHE_BACKEND=file or db
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'local')
+# Where the client address is read from; behind a proxy e.g. HTTP_X_FORWARDED_FOR
+RATE_LIMIT_ADDRESS_HEADER = os.getenv('RATE_LIMIT_ADDRESS_HEADER', 'REMOTE_ADDR')
+
+# Seat reservations for one event instance that run at once in a process. Up to
+# ADMISSION_QUEUE more wait ADMISSION_TIMEOUT seconds for a turn; the rest get a 429.
+ADMISSION_CONCURRENCY = int(os.getenv('ADMISSION_CONCURRENCY', 2))
+ADMISSION_QUEUE = int(os.getenv('ADMISSION_QUEUE', 16))
+ADMISSION_TIMEOUT = float(os.getenv('ADMISSION_TIMEOUT', 2))
+
+# Per-request timing lines from RequestTimingMiddleware go to the events.performance logger
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'events.performance': {
+            'handlers': ['console'],
+            'level': os.getenv('PERFORMANCE_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 # Redirect to home URL after login (Default redirects to /accounts/profile/)
 LOGIN_REDIRECT_URL = '/'
\ No newline at end of file